@@ -14,7 +14,6 @@ This is the FastAPI start index. Currently it has 4 paths
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 from threading import Timer
-import math
 
 
 # importing internal modules
@@ -32,8 +31,22 @@ timer_mgr = {}
 
 # Some global configurations
 PAGE_SIZE = 10
+# the number of pages of results a search is cached for, the ranker only selects the results of these pages
+MAX_PAGES = 10
 CACHE_TIME = 3600
 
+
+class SearchAPIResponse(APIResponse):
+    # the number of documents that match the query, the cached results only hold the first MAX_PAGES pages of them
+    total_hits: int | None = None
+
+
+def last_page(num_results: int) -> int:
+    # pages are numbered from 0, page p holds results [p * PAGE_SIZE, (p + 1) * PAGE_SIZE), so the last page is
+    # the one of the last result, and page 0 when there are none
+    return max(num_results - 1, 0) // PAGE_SIZE
+
+
 # this is the FastAPI application
 app = FastAPI()
 # cache deletion function used to delete cache entries after a set timeout.
@@ -43,6 +56,8 @@ def delete_from_cache(query):
     global pagination_cache
     if query in pagination_cache:
         del pagination_cache[query]
+        pagination_cache.pop(f'{query}_max_page', None)
+        pagination_cache.pop(f'{query}_total_hits', None)
         del timer_mgr[query]
 
 # API paths begin here
@@ -55,20 +70,21 @@ async def home():
 
 
 @app.post('/search')
-async def doSearch(body: QueryModel) -> APIResponse:
+async def doSearch(body: QueryModel) -> SearchAPIResponse:
     request_query = body.query
-    response = algorithm.search(request_query)
+    response, total_hits = algorithm.search_top_k(request_query, MAX_PAGES * PAGE_SIZE)
     global pagination_cache
     pagination_cache[request_query] = response
-    pagination_cache[f'{request_query}_max_page'] = math.floor(
-        len(response) / PAGE_SIZE)
+    pagination_cache[f'{request_query}_max_page'] = last_page(len(response))
+    pagination_cache[f'{request_query}_total_hits'] = total_hits
     global timer_mgr
     t = Timer(CACHE_TIME, delete_from_cache, [request_query])
     timer_mgr[request_query] = t
     t.start()
-    return APIResponse(results=response[:PAGE_SIZE],
-                       page=PaginationModel(prev=f'/cache/{request_query}/page/0',
-                                            next=f'/cache/{request_query}/page/1'))
+    return SearchAPIResponse(results=response[:PAGE_SIZE],
+                             page=PaginationModel(prev=f'/cache/{request_query}/page/0',
+                                                  next=f'/cache/{request_query}/page/{min(1, last_page(len(response)))}'),
+                             total_hits=total_hits)
 
 
 @app.get('/experiment')
@@ -78,10 +94,11 @@ async def runExperiment() -> APIResponse:
 
 
 @app.get('/cache/{query}/page/{page}')
-async def getCache(query: str, page: int) -> APIResponse:
+async def getCache(query: str, page: int) -> SearchAPIResponse:
     if query in pagination_cache:
         if page < 0:
             page = 0
+        page = min(page, pagination_cache[f'{query}_max_page'])
         if page == 0:
             prev_page = page
         else:
@@ -90,9 +107,10 @@ async def getCache(query: str, page: int) -> APIResponse:
             next_page = page
         else:
             next_page = page+1
-        return APIResponse(results=pagination_cache[query][page*PAGE_SIZE:(page+1)*PAGE_SIZE],
-                           page=PaginationModel(prev=f'/cache/{query}/page/{prev_page}',
-                                                next=f'/cache/{query}/page/{next_page}'))
+        return SearchAPIResponse(results=pagination_cache[query][page*PAGE_SIZE:(page+1)*PAGE_SIZE],
+                                 page=PaginationModel(prev=f'/cache/{query}/page/{prev_page}',
+                                                      next=f'/cache/{query}/page/{next_page}'),
+                                 total_hits=pagination_cache[f'{query}_total_hits'])
     else:
         return await doSearch(QueryModel(query=query))
 
@@ -0,0 +1,73 @@
+'''
+Helpers shared by the tests: the multi-word expressions file, Zipf distributed documents and the indexes built from
+them, in memory or saved and loaded again.
+'''
+import os
+
+import numpy as np
+import pytest
+
+from document_preprocessor import Analyzer, SplitTokenizer
+from indexing import BasicInvertedIndex
+
+MULTI_WORD_EXPRESSIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'multi_word_expressions.txt')
+
+
+def make_documents(num_docs: int = 600, vocabulary=40, lengths: tuple[int, int] = (5, 60), copy_every: int = 0,
+                   seed: int = 0) -> dict[int, list[str]]:
+    '''
+    Return documents of Zipf distributed words, so that the common words have several blocks of postings.
+
+    Parameters:
+
+    num_docs [int]: The number of documents, with docids from 1.
+
+    vocabulary [int | list[str]]: The words from the most to the least common, or the number of words w0, w1, ...
+
+    lengths [tuple[int, int]]: The smallest and one past the largest number of tokens of a document.
+
+    copy_every [int]: Make every copy_every-th document a copy of an earlier one, so that some documents have the
+    same score for every query, or 0 for none.
+
+    seed [int]: The seed of the random generator.
+    '''
+    if isinstance(vocabulary, int):
+        vocabulary = [f'w{word}' for word in range(vocabulary)]
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+    documents = {}
+    for docid in range(1, num_docs + 1):
+        if copy_every and docid % copy_every == 0:
+            documents[docid] = list(documents[int(rng.integers(1, docid))])
+        else:
+            words = rng.choice(len(vocabulary), int(rng.integers(*lengths)), p=weights)
+            documents[docid] = [vocabulary[word] for word in words]
+    return documents
+
+
+def make_index(index_name: str, documents: dict[int, list[str]], index_class=BasicInvertedIndex, saved: bool = False):
+    # a frozen index of the documents, or the index loaded back from the files it was saved to
+    index = index_class(index_name)
+    for docid, tokens in documents.items():
+        index.add_doc(docid, tokens)
+    index.freeze()
+    if saved:
+        index.save()
+        index = index_class(index_name)
+        index.load()
+    return index
+
+
+@pytest.fixture(scope='module', params=['in memory', 'saved'])
+def index(request, tmp_path_factory):
+    # the index of the test module's DOCUMENTS (make_documents() if it has none) of its INDEX_CLASS
+    # (BasicInvertedIndex if it has none), once in memory and once saved and loaded
+    documents = getattr(request.module, 'DOCUMENTS', None) or make_documents()
+    index_class = getattr(request.module, 'INDEX_CLASS', BasicInvertedIndex)
+    return make_index(str(tmp_path_factory.mktemp('index')), documents, index_class, request.param == 'saved')
+
+
+@pytest.fixture(scope='session')
+def analyzer():
+    return Analyzer(SplitTokenizer(MULTI_WORD_EXPRESSIONS), stopword_filtering=False)
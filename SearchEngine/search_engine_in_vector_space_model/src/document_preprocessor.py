@@ -8,6 +8,8 @@ import spacy
 import re
 import time
 import json
+import functools
+from collections import deque
 # import matplotlib.pyplot as plt
 
 class Tokenizer:
@@ -20,14 +22,106 @@ class Tokenizer:
         except FileNotFoundError:
             print(f"File at {file_path} not found. Multi-word expressions list is empty.")
 
+        # Expressions are applied longest first (ties keep file order), so their position in this list is their priority.
+        # Expressions without a space are skipped since replacing them would not change the text.
+        self.sorted_expressions = [expression for expression in sorted(self.multi_word_expressions, key=len, reverse=True)
+                                   if ' ' in expression]
+        self._build_automaton()
+
+    def _build_automaton(self) -> None:
+        """Build an Aho-Corasick automaton over all multi-word expressions so a text can be matched in one pass."""
+        # An underscore inside an expression can match text that an earlier replacement produced,
+        # which a single scan over the original text cannot see. Fall back to sequential replacement in that case.
+        self.use_automaton = not any('_' in expression for expression in self.sorted_expressions)
+
+        # offsets of the spaces in each expression, these are the characters a replacement turns into underscores
+        self.expression_spaces = [[i for i, char in enumerate(expression) if char == ' ']
+                                  for expression in self.sorted_expressions]
+
+        # trie transitions, failure links and the expressions ending in each state
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for expression_id, expression in enumerate(self.sorted_expressions):
+            state = 0
+            for char in expression:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[state][char] = next_state
+                state = next_state
+            self.outputs[state].append(expression_id)
+
+        # breadth first so that the failure state of a parent is always ready before its children
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def find_multi_word_expressions(self, text: str) -> list[tuple[int, int]]:
+        """Find every occurrence of every multi-word expression in the text, overlapping ones included.
+
+        Parameters:
+
+        text [str]: This is an input text you want to search.
+
+        Returns a list of (expression_id, start) pairs, where expression_id indexes self.sorted_expressions.
+        """
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        matches = []
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                for expression_id in outputs[state]:
+                    matches.append((expression_id, i - len(self.sorted_expressions[expression_id]) + 1))
+        return matches
+
     def replace_multi_word_expressions(self, text: str) -> str:
-        sorted_expressions = sorted(self.multi_word_expressions, key=len, reverse=True)
-        
-        for expression in sorted_expressions:
-            single_token = expression.replace(" ", "_")  
-            text = text.replace(expression, single_token)  
-        
-        return text
+        if not self.use_automaton:
+            for expression in self.sorted_expressions:
+                text = text.replace(expression, expression.replace(" ", "_"))
+            return text
+
+        matches = self.find_multi_word_expressions(text)
+        if not matches:
+            return text
+
+        # Replay the replacements in priority order. Replacing an expression only turns its spaces into underscores,
+        # so a match found in the original text is still there unless an earlier replacement took one of its spaces.
+        # Like str.replace, the occurrences of one expression are taken left to right without overlapping.
+        matches.sort()
+        replaced = bytearray(len(text))
+        replaced_positions = []
+        previous_id, previous_end = -1, 0
+        for expression_id, start in matches:
+            if expression_id != previous_id:
+                previous_id, previous_end = expression_id, 0
+            if start < previous_end:
+                continue
+            spaces = [start + offset for offset in self.expression_spaces[expression_id]]
+            if any(replaced[position] for position in spaces):
+                continue
+            for position in spaces:
+                replaced[position] = 1
+            replaced_positions.extend(spaces)
+            previous_end = start + len(self.sorted_expressions[expression_id])
+
+        chars = list(text)
+        for position in replaced_positions:
+            chars[position] = '_'
+        return ''.join(chars)
 
 
 '''
@@ -121,6 +215,66 @@ class SpaCyTokenizer(Tokenizer):
         #             tokens.append(token.text)
         #     return tokens
 
+@functools.lru_cache(maxsize=None)
+def load_stopwords(path: str = 'stopwords.txt') -> frozenset[str]:
+    '''
+    Read a stopword file, one lowercase stopword per line. Each file is only read once per process.
+    '''
+    with open(path, 'r') as f:
+        return frozenset(line.strip().lower() for line in f)
+
+
+class Analyzer:
+    '''
+    The tokenizer and the stopword set shared by the Indexer, the Ranker and relevance.py, loaded once, with a
+    bounded LRU cache of analyzed queries so that a repeated query is not tokenized again.
+
+    An Analyzer can be passed wherever a tokenizer is expected, its tokenize() is the tokenizer's.
+    '''
+
+    def __init__(self, tokenizer: Tokenizer, stopword_filtering: bool = True, stopwords_path: str = 'stopwords.txt',
+                 cache_size: int = 1024) -> None:
+        '''
+        Parameters:
+
+        tokenizer [Tokenizer]: The tokenizer of the documents and the queries.
+
+        stopword_filtering [bool]: Whether stopwords are replaced with None in analyzed queries.
+
+        stopwords_path [str]: The stopword file, one stopword per line.
+
+        cache_size [int]: The number of distinct queries whose analysis is kept.
+        '''
+        self.tokenizer = tokenizer
+        self.stopword_filtering = stopword_filtering
+        self.stopwords = load_stopwords(stopwords_path) if stopword_filtering else frozenset()
+        self._analyze_query = functools.lru_cache(maxsize=cache_size)(self._analyze)
+
+    def tokenize(self, text: str) -> list[str]:
+        return self.tokenizer.tokenize(text)
+
+    def analyze_query(self, query: str) -> list[str]:
+        '''
+        Return the tokens of a query, with None for the stopwords when they are filtered.
+
+        Parameters:
+
+        query [str]: The query to analyze.
+        '''
+        # the cache holds tuples, so that callers can change the list they get
+        return list(self._analyze_query(query))
+
+    def _analyze(self, query: str) -> tuple[str, ...]:
+        query_parts = self.tokenizer.tokenize(query)
+        if self.stopword_filtering:
+            query_parts = [None if term.lower() in self.stopwords else term for term in query_parts if term is not None]
+        return tuple(query_parts)
+
+    def cache_info(self):
+        # the hits, misses and size of the query cache
+        return self._analyze_query.cache_info()
+
+
 # TODO tokenize the first 1000 documents and record the time. Make a plot showing the time taken for each.
 if __name__=='__main__':
     import matplotlib.pyplot as plt
@@ -137,12 +291,22 @@ if __name__=='__main__':
 
     times = {name: 0 for name in tokenizer_names}
 
+    # the previous multi-word expression replacement, one str.replace pass per expression
+    def replace_multi_word_expressions_naive(text: str) -> str:
+        for expression in sorted(split_tokenizer.multi_word_expressions, key=len, reverse=True):
+            text = text.replace(expression, expression.replace(" ", "_"))
+        return text
+
+    mwe_times = {'naive': 0, 'automaton': 0}
+    total_chars = 0
+
     with open(FILE_PATH, 'r') as file:
         for i, line in enumerate(file):
             if i >= 1000: 
                 break
                 
             doc = json.loads(line)
+            total_chars += len(doc['text'])
             
             for tokenizer, name in zip(tokenizers, tokenizer_names):
                 start_time = time.time()
@@ -150,10 +314,21 @@ if __name__=='__main__':
                 end_time = time.time()
                 times[name] += end_time - start_time
 
+            start_time = time.time()
+            naive_text = replace_multi_word_expressions_naive(doc['text'])
+            mwe_times['naive'] += time.time() - start_time
+
+            start_time = time.time()
+            automaton_text = split_tokenizer.replace_multi_word_expressions(doc['text'])
+            mwe_times['automaton'] += time.time() - start_time
+            assert naive_text == automaton_text
+
     names = list(times.keys())
     values = list(times.values())
 
     print(times)
+    for method, seconds in mwe_times.items():
+        print(f"multi-word expressions ({method}): {seconds:.3f}s, {total_chars / seconds / 1e6:.2f}M chars/s")
     plt.figure(figsize=(10, 5))
     plt.bar(names, values, color=['blue', 'green', 'red'], log=True)
     plt.title('Time taken by each tokenizer for the first 1000 documents')
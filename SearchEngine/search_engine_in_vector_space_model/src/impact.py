@@ -0,0 +1,150 @@
+'''
+Impact-ordered postings: the contribution of every term to every document it is in, computed once with a
+vectorized scorer whose parameters are fixed, quantized to a few bits and sorted from the highest impact down.
+
+A term's contribution to a document only depends on the query through the term's query weight
+(RelevanceScorer.term_weights times RelevanceScorer.query_weight), so a query is scored score at a time:
+the postings of all query terms are read in segments of equal impact, the segments with the largest
+query weight times impact first, and reading can stop after a budget of postings. The documents that
+matter most are read first, so a small budget gives a fast, approximate top k and no budget gives the
+exact scores of the quantized impacts.
+
+InvertedIndex.get_impact_index computes the impact index of a scorer once and saves it with the index, in a
+folder of impacts/ named after the scorer, its parameters and the number of bits. Ranker(..., impact_bits=8)
+scores its queries with it. An impact index is saved in its folder as:
+
+impact.json         the number of bits, the scale of an impact step and the first and last segment of every term
+impact_segments.npy one record per segment, in term order and from the highest impact down: the impact and
+                    where the segment's docids end in impact_docids.npy
+impact_docids.npy   the docids of every segment, sorted by docid within a segment
+
+The .npy files are memory mapped when the impact index is loaded.
+'''
+import json
+import os
+import numpy as np
+
+IMPACT_SEGMENT = np.dtype([('impact', '<u2'), ('end', '<u8')])
+
+
+class ImpactIndex:
+    '''
+    Quantized impact-ordered postings of an index for one scorer (see the module docstring).
+
+    Contributions at or below 0, like the BM25 contributions of terms in more than half of the documents,
+    are not stored: impacts only add to the score of a document.
+    '''
+
+    def __init__(self, terms: dict[str, list[int]], segments: np.ndarray, docids: np.ndarray, scale: float, bits: int) -> None:
+        self.terms = terms
+        self.segments = segments
+        self.docids = docids
+        self.scale = scale
+        self.bits = bits
+
+    @classmethod
+    def from_index(cls, index, scorer, bits: int = 8) -> 'ImpactIndex':
+        '''
+        Compute the impacts of every term of an index.
+
+        Parameters:
+
+        index [InvertedIndex]: The index to compute the impacts of.
+
+        scorer [RelevanceScorer]: A vectorized scorer whose term_weights are the impacts.
+
+        bits [int]: The number of bits of an impact, from 1 to 16. Fewer bits make fewer, longer segments.
+        '''
+        if not scorer.vectorized:
+            raise ValueError(f"{type(scorer).__name__} does not implement score_postings")
+        if not 1 <= bits <= 16:
+            raise ValueError(f"Impacts have 1 to 16 bits, not {bits}")
+        levels = (1 << bits) - 1
+
+        term_weights = []
+        max_weight = 0.0
+        for term in sorted(index.vocabulary):
+            docids, freqs = index.get_postings_arrays(term)
+            weights = scorer.term_weights(term, docids, freqs, index.get_doc_lengths(docids)) if len(docids) else np.zeros(0)
+            positive = weights > 0
+            term_weights.append((term, docids[positive], weights[positive]))
+            if positive.any():
+                max_weight = max(max_weight, float(weights[positive].max()))
+        scale = max_weight / levels if max_weight > 0 else 1.0
+
+        terms = {}
+        segments, all_docids = [], []
+        num_segments = num_postings = 0
+        for term, docids, weights in term_weights:
+            if len(docids) == 0:
+                continue
+            # every positive contribution keeps an impact of at least 1
+            impacts = np.clip(np.rint(weights / scale), 1, levels).astype(np.uint16)
+            order = np.lexsort((docids, -impacts.astype(np.int32)))
+            docids, impacts = docids[order], impacts[order]
+            ends = np.append(np.flatnonzero(impacts[1:] != impacts[:-1]) + 1, len(impacts))
+            term_segments = np.zeros(len(ends), dtype=IMPACT_SEGMENT)
+            term_segments['impact'] = impacts[ends - 1]
+            term_segments['end'] = ends + num_postings
+            terms[term] = [num_segments, num_segments + len(ends)]
+            segments.append(term_segments)
+            all_docids.append(docids.astype(np.uint32))
+            num_segments += len(ends)
+            num_postings += len(docids)
+        segments = np.concatenate(segments) if segments else np.zeros(0, dtype=IMPACT_SEGMENT)
+        all_docids = np.concatenate(all_docids) if all_docids else np.zeros(0, dtype=np.uint32)
+        return cls(terms, segments, all_docids, scale, bits)
+
+    def save(self, index_name: str) -> None:
+        os.makedirs(index_name, exist_ok=True)
+        np.save(os.path.join(index_name, 'impact_segments.npy'), self.segments)
+        np.save(os.path.join(index_name, 'impact_docids.npy'), self.docids)
+        with open(os.path.join(index_name, 'impact.json'), 'w', encoding='utf-8') as impact_file:
+            json.dump({'bits': self.bits, 'scale': self.scale, 'terms': self.terms}, impact_file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_name: str) -> 'ImpactIndex':
+        with open(os.path.join(index_name, 'impact.json'), 'r', encoding='utf-8') as impact_file:
+            metadata = json.load(impact_file)
+        segments = np.load(os.path.join(index_name, 'impact_segments.npy'), mmap_mode='r')
+        docids = np.load(os.path.join(index_name, 'impact_docids.npy'), mmap_mode='r')
+        return cls(metadata['terms'], segments, docids, metadata['scale'], metadata['bits'])
+
+    def score(self, term_weights: dict[str, float], posting_budget: int = None) -> tuple[np.ndarray, np.ndarray, int]:
+        '''
+        Score a query score at a time. Returns the docids of the scored documents, sorted, their scores and the
+        number of postings read.
+
+        Parameters:
+
+        term_weights [dict[str, float]]: The query weight of every query term.
+
+        posting_budget [int]: The number of postings after which reading stops, or None to read them all.
+        '''
+        # the segments of the query terms, and the contribution of their documents
+        segment_ids, weights = [], []
+        for term, weight in term_weights.items():
+            first, last = self.terms.get(term, (0, 0))
+            segment_ids.append(np.arange(first, last))
+            weights.append(np.full(last - first, weight))
+        segment_ids = np.concatenate(segment_ids) if segment_ids else np.zeros(0, dtype=np.int64)
+        if len(segment_ids) == 0:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0), 0
+        contributions = np.concatenate(weights) * self.segments['impact'][segment_ids]
+        ends = self.segments['end'][segment_ids].astype(np.int64)
+        starts = np.where(segment_ids > 0, self.segments['end'][np.maximum(segment_ids - 1, 0)].astype(np.int64), 0)
+
+        # the largest contributions first, equal ones in term and impact order
+        order = np.argsort(-contributions, kind='stable')
+        contributions, starts, lengths = contributions[order], starts[order], (ends - starts)[order]
+        if posting_budget is not None:
+            read_before = np.cumsum(lengths) - lengths
+            lengths = np.clip(posting_budget - read_before, 0, lengths)
+        postings_read = int(lengths.sum())
+
+        # the positions of the postings of all read segments, one after the other
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(postings_read)
+        docids, inverse = np.unique(self.docids[positions], return_inverse=True)
+        scores = np.bincount(inverse, weights=np.repeat(contributions, lengths), minlength=len(docids)) * self.scale
+        return docids, scores, postings_read
@@ -5,7 +5,10 @@ Use libraries such as tqdm, orjson, collections.Counter, shelve if you need them
 DO NOT use the pickle module.
 '''
 from enum import Enum
-import bisect
+import hashlib
+import heapq
+import itertools
+import dbm
 import shelve
 import pickle
 import json
@@ -15,7 +18,16 @@ import os
 import numpy as np
 from sample_data import SAMPLE_DOCS
 from tqdm import tqdm
-from collections import Counter
+from collections import Counter, deque
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import queue
+import shutil
+import threading
+from document_preprocessor import Analyzer, load_stopwords
+from impact import ImpactIndex
+from postings import BLOCK_SIZE, DocumentBitmap, PositionalPostingsList, PostingsList, decode_varints, encode_postings, encode_varints, find_frequency
+from storage import DocumentTable, IndexFileWriter, Lexicon, PostingsCache, Vocabulary, load_statistics, save_statistics
 
 class IndexType(Enum):
     # the three types of index currently supported are InvertedIndex, PositionalIndex and OnDiskInvertedIndex
@@ -31,117 +43,580 @@ class InvertedIndex:
     The functions are meant to be implemented in the actual index classes and not as part of this interface.
     '''
 
-    def __init__(self, index_name) -> None:
+    # rough number of bytes a posting (and a stored position) takes in memory, used to decide when to flush a SPIMI segment
+    posting_bytes = 100
+    position_bytes = 0
+    # removed documents are only masked out until this fraction of the documents is removed, then compact() drops their postings
+    compaction_threshold = 0.2
+
+    def __init__(self, index_name, forward_index: bool = True) -> None:
         self.index_name = index_name  # name of the index
-        self.statistics = {'vocab': {}}  # the central statistics of the index
+        # the central statistics of the index, kept up to date by add_doc and remove_docs: the number of tokens of the
+        # documents, saved in statistics.json
+        self.statistics = {'total_token_count': 0}
+        # [document frequency, total term frequency] of the terms changed since the index was last saved, over the
+        # saved statistics of the other terms (in the lexicon). Both are exact while term_statistics_exact is true,
+        # otherwise only the terms asked for since are kept (see get_term_metadata).
+        self.term_statistics = {}
+        self.term_statistics_exact = True
         self.index = {}  # the index
         self.vocabulary = set()  # the vocabulary of the collection
         # metadata like length, number of unique tokens of the documents
-        self.document_metadata = {}
+        self.document_metadata = DocumentTable()
         # OPTIONAL if using SPIMI, use this variable to keep track of the index segments.
         self.index_segment = 0
+        # the saved terms and postings, once the index has been loaded or its segments merged
+        self.lexicon = None
+        # optional forward index from each document added since the index was created or loaded to the ids of its terms
+        # and their frequencies, so that removing a document only touches its own postings lists and statistics
+        self.forward_index = {} if forward_index else None
+        self.term_ids = {}
+        self.terms = []
+        # removed documents whose postings have not been dropped yet
+        self.tombstones = DocumentBitmap()
+        # per-block statistics of the postings of the terms asked for since the index last changed, for score upper bounds
+        self.block_statistics = {}
+        # the docids of the long postings lists of the terms asked for since the index last changed, for counting hits
+        self.docid_bitmaps = {}
+        # the ImpactIndex of every scorer asked for since the index last changed, saved in the index folder with the
+        # index, and whether the ones saved there are out of date
+        self.impact_indexes = {}
+        self.impacts_changed = True
 
     
     # NOTE: The following functions have to be implemented in the three inherited classes and not in this class
 
     def remove_doc(self, docid: int) -> None:
         # TODO implement this to remove a document from the entire index and statistics
+        self.remove_docs([docid])
+
+    def remove_docs(self, docids) -> None:
+        '''
+        Remove several documents from the index and its statistics.
+
+        Removed documents are taken out of the document table and marked in the tombstones bitmap, which
+        get_postings (and so the Ranker and every scorer) filters on right away. Their postings are only dropped
+        by compact(), once compaction_threshold of the documents are removed, or when the index is saved.
+
+        Parameters:
+
+        docids [iterable]: The ids of the documents to remove. Ids that are not in the index are ignored.
+        '''
+        self._postings_changed()
+        docids = [docid for docid in dict.fromkeys(docids) if docid in self.document_metadata]
+        self._uncount_docs(docids)
+        for docid in docids:
+            del self.document_metadata[docid]
+            self.tombstones.add(docid)
+        if self.tombstones and self.deleted_ratio() >= self.compaction_threshold:
+            self.compact()
+
+    def _postings_changed(self) -> None:
+        # the statistics computed from the postings are out of date once documents are added or removed
+        self.block_statistics.clear()
+        self.docid_bitmaps.clear()
+        self.impact_indexes.clear()
+        self.impacts_changed = True
+
+    def is_deleted(self, docid: int) -> bool:
+        return docid in self.tombstones
+
+    def deleted_ratio(self) -> float:
+        total = len(self.document_metadata) + len(self.tombstones)
+        return len(self.tombstones) / total if total else 0.0
+
+    def compact(self) -> None:
+        '''
+        Drop the postings of the removed documents. The postings lists of the forward index's terms are rewritten
+        in memory, saved postings and flushed segments are merged again without them.
+        '''
+        if not self.tombstones:
+            return
+        self._drop_tombstoned_postings()
+        if self.lexicon is not None or self.index_segment > 0:
+            self.merge_segments()
+        self._forget_tombstones()
+
+    def _drop_tombstoned_postings(self) -> None:
+        docids = set(self.tombstones)
+        self._remove_postings(self._terms_of_docs(docids), docids)
+
+    def _forget_tombstones(self) -> None:
+        self.tombstones.clear()
+        self.document_metadata.compact()
+
+    def _without_tombstones(self, postings):
+        # the postings of documents that are not removed
+        if isinstance(postings, PostingsList):
+            docids, freqs = postings.decode()
+            live = ~self.tombstones.mask(docids)
+            return PostingsList.from_columns(docids[live], freqs[live])
+        return [posting for posting in postings if posting[0] not in self.tombstones]
+
+    def _add_to_forward_index(self, docid: int, term_freqs) -> None:
+        # the (term, frequency) pairs of a new document
+        if self.forward_index is None:
+            return
+        if docid in self.forward_index and self.forward_index[docid] is None:
+            # added again without being removed (see _count_tokens), its old postings are not in the forward index
+            del self.forward_index[docid]
+            return
+        term_ids = array('I')
+        freqs = array('I')
+        for term, freq in term_freqs:
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = self.term_ids[term] = len(self.terms)
+                self.terms.append(term)
+            term_ids.append(term_id)
+            freqs.append(freq)
+        self.forward_index[docid] = term_ids, freqs
+
+    def _terms_of_docs(self, docids: set[int]):
+        # the terms whose postings may hold the documents: from the forward index when it has all of them,
+        # otherwise every term with postings that can be changed
+        if self.forward_index is not None:
+            complete = all(docid in self.forward_index for docid in docids)
+            term_ids = set()
+            for docid in docids:
+                term_ids.update(self.forward_index.pop(docid, ((),))[0])
+            if complete:
+                return [self.terms[term_id] for term_id in term_ids]
+        return list(self._changeable_terms())
+
+    def _changeable_terms(self):
+        return self.index.keys()
+
+    def _count_tokens(self, docid: int, length: int) -> None:
+        # called by add_doc before the document is put in the document table
+        if docid in self.document_metadata:
+            # a document added again without being removed keeps its old postings, so its terms are counted again
+            self.statistics['total_token_count'] -= self.document_metadata.get_length(docid)
+            self._forget_term_statistics()
+            if self.forward_index is not None:
+                self.forward_index[docid] = None
+        self.statistics['total_token_count'] += length
+
+    def _changed_term_statistics(self, term: str) -> list[int]:
+        # the statistics of a term in the overlay, copied from the saved ones when it is first changed.
+        # None when the statistics are not exact and the term was not counted yet
+        term_statistics = self.term_statistics.get(term)
+        if term_statistics is None and self.term_statistics_exact:
+            term_statistics = self.term_statistics[term] = self._saved_term_statistics(term)
+        return term_statistics
+
+    def _saved_term_statistics(self, term: str) -> list[int]:
+        # [document frequency, total term frequency] of a term when the index was last saved
+        i = self.lexicon.find(term) if self.lexicon is not None else -1
+        return list(self.lexicon.get_term_statistics(i)) if i >= 0 else [0, 0]
+
+    def _count_terms(self, term_freqs) -> None:
+        # add the (term, frequency) pairs of a new document to the term statistics
+        for term, freq in term_freqs:
+            term_statistics = self._changed_term_statistics(term)
+            if term_statistics is None:
+                continue
+            term_statistics[0] += 1
+            term_statistics[1] += freq
+
+    def _uncount_docs(self, docids: list[int]) -> None:
+        # take documents that are about to be removed out of the statistics, while their postings are still there
+        for docid in docids:
+            self.statistics['total_token_count'] -= self.document_metadata.get_length(docid)
+        if self.forward_index is None or not all(docid in self.forward_index for docid in docids):
+            # the terms of the documents are unknown without scanning the index
+            self._forget_term_statistics()
+            return
+        # the frequencies are in the forward index, so the postings lists are not read
+        for docid in docids:
+            term_ids, freqs = self.forward_index[docid]
+            for term_id, freq in zip(term_ids, freqs):
+                term_statistics = self._changed_term_statistics(self.terms[term_id])
+                if term_statistics is None:
+                    continue
+                term_statistics[0] -= 1
+                term_statistics[1] -= freq
+
+    def _forget_term_statistics(self) -> None:
+        # the term statistics are recomputed from the postings when they are asked for, and in full at the next save
+        self.term_statistics = {}
+        self.term_statistics_exact = False
+
+    def _remove_postings(self, terms, docids: set[int]) -> None:
+        # remove the postings of docids from the postings lists of terms
         pass
 
+    def _discard_term(self, term: str) -> None:
+        # forget a term whose postings became empty, unless it still has saved postings
+        self.index.pop(term, None)
+        if self.lexicon is None or self.lexicon.find(term) < 0:
+            self.vocabulary.discard(term)
+
     def add_doc(self, docid: int, tokens: list[str]) -> None:
         # TODO implement this to add documents to the index
         pass
 
     def get_postings(self, term: str) -> list:
         # TODO implement this to fetch a term's postings from the index
-        return self.index.get(term, [])
+        postings = self.index.get(term, [])
+        if self.lexicon is not None:
+            saved_postings = self.get_saved_postings(term)
+            postings = saved_postings + postings if postings else saved_postings
+            if isinstance(postings, list) and saved_postings and len(postings) > len(saved_postings):
+                # postings added since the index was saved can have smaller docids than the saved ones
+                postings.sort()
+        if self.tombstones:
+            postings = self._without_tombstones(postings)
+        return postings
+
+    def get_postings_arrays(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        # a term's postings as (docids, freqs) NumPy columns sorted by docid, for scorers that score a whole postings list at once
+        return self._postings_arrays(self.get_postings(term))
+
+    def get_postings_docids(self, term: str):
+        # a term's docids for intersect(): a frozen PostingsList as it is, so that only the blocks it needs are
+        # decoded, and a sorted docid column otherwise
+        postings = self.get_postings(term)
+        if isinstance(postings, PostingsList) and postings.frozen:
+            return postings
+        return self._postings_arrays(postings)[0]
+
+    @staticmethod
+    def _postings_arrays(postings) -> tuple[np.ndarray, np.ndarray]:
+        if isinstance(postings, PostingsList):
+            docids, freqs = postings.decode()
+        elif isinstance(postings, PositionalPostingsList):
+            # copied, since a view would stop the array('I') columns from growing
+            docids, freqs = np.frombuffer(postings.docids, dtype=np.uint32).copy(), np.frombuffer(postings.freqs, dtype=np.uint32).copy()
+        else:
+            docids = np.fromiter((posting[0] for posting in postings), dtype=np.uint32, count=len(postings))
+            freqs = np.fromiter((posting[1] for posting in postings), dtype=np.uint32, count=len(postings))
+        if len(docids) > 1 and np.any(docids[1:] < docids[:-1]):
+            # postings added out of docid order, or in-memory postings that come after saved ones
+            order = np.argsort(docids, kind='stable')
+            docids, freqs = docids[order], freqs[order]
+        return docids, freqs
+
+    def get_term_positions(self, term: str, docids) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the frequency of a term in each of several documents that contain it and its sorted positions in
+        them, one document after the other, or None if the index does not store positions.
+
+        Parameters:
+
+        term [str]: The term to look up.
+
+        docids: The sorted documents, all in the term's postings.
+        '''
+        return None
+
+    def get_block_statistics(self, term: str) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Split a term's postings, sorted by docid, into blocks of BLOCK_SIZE postings and return the last docid, the
+        smallest and largest term frequency and the smallest and largest document length of every block.
+        Scorers turn these into upper bounds on the score of every block. They are computed once per term and kept
+        until the index changes.
+
+        Parameters:
+
+        term [str]: The term.
+        '''
+        statistics = self.block_statistics.get(term)
+        if statistics is None:
+            docids, freqs = self.get_postings_arrays(term)
+            doc_lengths = self.get_doc_lengths(docids)
+            starts = np.arange(0, len(docids), BLOCK_SIZE)
+            if len(docids) == 0:
+                statistics = tuple(np.zeros(0, dtype=np.int64) for _ in range(5))
+            else:
+                statistics = (docids[np.minimum(starts + BLOCK_SIZE, len(docids)) - 1].astype(np.int64),
+                              np.minimum.reduceat(freqs, starts).astype(np.int64), np.maximum.reduceat(freqs, starts).astype(np.int64),
+                              np.minimum.reduceat(doc_lengths, starts), np.maximum.reduceat(doc_lengths, starts))
+            self.block_statistics[term] = statistics
+        return statistics
+
+    def get_docid_bitmap(self, term: str) -> DocumentBitmap:
+        '''
+        Return the docids of a term's postings as a DocumentBitmap, so that the documents of several terms are
+        counted without decoding their postings, or None when the bitmap would be larger than the docids, for the
+        terms in fewer than one in 32 of the documents. It is computed once per term and kept until the index changes.
+
+        Parameters:
+
+        term [str]: The term.
+        '''
+        if term not in self.docid_bitmaps:
+            docids = self.get_postings_arrays(term)[0]
+            bitmap = None
+            if len(docids) and int(docids[-1]) >> 3 < 4 * len(docids):
+                bitmap = DocumentBitmap.from_docids(docids)
+            self.docid_bitmaps[term] = bitmap
+        return self.docid_bitmaps[term]
+
+    def get_impact_index(self, scorer, bits: int = 8) -> ImpactIndex:
+        '''
+        Return the impact-ordered postings of a scorer (see impact.py). They are computed once per scorer, its
+        parameters and the number of bits, and kept until the index changes. The ones that were saved with the
+        index are loaded from its folder instead.
+
+        Parameters:
+
+        scorer [RelevanceScorer]: A vectorized scorer whose term_weights are the impacts.
+
+        bits [int]: The number of bits of an impact, from 1 to 16.
+        '''
+        key = self._impact_key(scorer, bits)
+        impact_index = self.impact_indexes.get(key)
+        if impact_index is None:
+            path = os.path.join(self.index_name, 'impacts', key)
+            if not self.impacts_changed and os.path.exists(os.path.join(path, 'impact.json')):
+                impact_index = ImpactIndex.load(path)
+            else:
+                impact_index = ImpactIndex.from_index(self, scorer, bits)
+            self.impact_indexes[key] = impact_index
+        return impact_index
+
+    @staticmethod
+    def _impact_key(scorer, bits: int) -> str:
+        # the folder name of a scorer's impacts: its class, the number of bits and a digest of its parameters, the
+        # scorers keep them as attributes like BM25's k1 and b
+        parameters = json.dumps({name: value for name, value in vars(scorer).items() if isinstance(value, (bool, int, float, str))},
+                                sort_keys=True)
+        return f'{type(scorer).__name__}-{bits}-{hashlib.sha1(parameters.encode("utf-8")).hexdigest()[:12]}'
+
+    def _save_impact_indexes(self) -> None:
+        # the impacts saved before the index changed are removed, the ones computed since are saved
+        folder = os.path.join(self.index_name, 'impacts')
+        if self.impacts_changed and os.path.exists(folder):
+            shutil.rmtree(folder)
+        for key, impact_index in self.impact_indexes.items():
+            path = os.path.join(folder, key)
+            if not os.path.exists(os.path.join(path, 'impact.json')):
+                impact_index.save(path)
+        self.impacts_changed = False
 
     def get_doc_metadata(self, doc_id: int) -> dict[str, int]:
         # TODO implement to fetch a particular documents stored metadata
         return self.document_metadata.get(doc_id, {})
 
+    def get_doc_length(self, doc_id: int) -> int:
+        # a single array lookup in the document table, without building a metadata dict
+        return self.document_metadata.get_length(doc_id)
+
+    def get_doc_lengths(self, doc_ids) -> np.ndarray:
+        # the lengths of many documents at once, 0 for documents that are not in the index
+        return self.document_metadata.get_lengths(doc_ids)
+
     def get_term_metadata(self, term: str) -> dict[str, int]:
         # TODO implement to fetch a particular terms stored metadata
-        postings_list = self.get_postings(term)
-        document_frequency = len(postings_list)
-        total_term_frequency = sum(freq for _, freq in postings_list)
-        return {'total_term_frequency': total_term_frequency, 'document_frequency': document_frequency}
+        # The running statistics of the changed terms and the saved statistics of the others answer without reading
+        # postings. When they are not exact, a term that was not asked for yet is counted once and kept.
+        term_statistics = self.term_statistics.get(term)
+        if term_statistics is None:
+            if self.term_statistics_exact:
+                term_statistics = self._saved_term_statistics(term)
+            else:
+                term_statistics = self.term_statistics[term] = self._term_statistics(self.get_postings(term))
+        return {'total_term_frequency': term_statistics[1], 'document_frequency': term_statistics[0]}
+
+    @staticmethod
+    def _term_statistics(postings) -> list[int]:
+        # [document frequency, total term frequency] of a postings list; the frequency is the second field of a posting
+        if isinstance(postings, (PostingsList, PositionalPostingsList)):
+            return [len(postings), int(InvertedIndex._postings_arrays(postings)[1].sum(dtype=np.int64))]
+        return [len(postings), sum(posting[1] for posting in postings)]
+
+    def _complete_term_statistics(self, term_statistics) -> None:
+        # replace incomplete term statistics with (term, statistics) pairs recounted over the whole index
+        if not self.term_statistics_exact:
+            self.term_statistics = dict(term_statistics)
+            self.term_statistics_exact = True
 
     def get_statistics(self) -> dict[str, int]:
         # TODO calculate statistics like 'unique_token_count', 'total_token_count', 'number_of_documents', 'mean_document_length' and any other relevant central statistic.
-        total_document_length = sum(doc_meta['length'] for doc_meta in self.document_metadata.values())
-        mean_document_length = total_document_length / len(self.document_metadata) if self.document_metadata else 0
+        total_token_count = self.statistics['total_token_count']
+        number_of_documents = len(self.document_metadata)
+        mean_document_length = total_token_count / number_of_documents if number_of_documents else 0
         
         return {
             'mean_document_length': mean_document_length,
-            'number_of_documents': len(self.document_metadata),
-            'total_token_count': total_document_length,
+            'number_of_documents': number_of_documents,
+            'total_token_count': total_token_count,
             'unique_token_count': len(self.vocabulary)
         }
     
+    def get_term_frequency(self, term: str, docid: int) -> int:
+        # the raw frequency of a term in a document, found with a binary search of the term's postings
+        return find_frequency(self.get_postings(term), docid)
+
     def get_TF(self, term: str, docid: int) -> int:
         """
         Get term frequency of a term in a document.
         """
-        postings_list = self.get_postings(term)
-        for doc, freq in postings_list:
-            if doc == docid:
-                return np.log(freq + 1)
+        freq = self.get_term_frequency(term, docid)
+        if freq:
+            return np.log(freq + 1)
         return 0
     
     def get_IDF(self, term: str) -> float:
         """
         Get inverse document frequency of a term.
         """
-        N = self.get_statistics()['number_of_documents'] 
-        df_t = len(self.get_postings(term))
+        N = len(self.document_metadata)
+        df_t = self.get_term_metadata(term)['document_frequency']
         return 1 + np.log(N / df_t) if df_t > 0 else 0
 
+    def freeze(self) -> None:
+        # Called once all documents are added. Indexes that build their postings in growable buffers compact them here.
+        pass
+
     def save(self) -> None:
         # TODO save the index files to disk
+        # The index is written in the binary format described in storage.py: a sorted lexicon, the postings and a document table.
         if not os.path.exists(self.index_name):
             os.makedirs(self.index_name)
-        
-        with open(os.path.join(self.index_name, "index.json"), "w", encoding='utf-8') as index_file:
-            json.dump(self.index, index_file, ensure_ascii=False, indent=4)
+
+        # removed documents are never saved: their in-memory postings are dropped here and the merge skips the others
+        if self.tombstones:
+            self._drop_tombstoned_postings()
+
+        if self.index_segment > 0 or self.lexicon is not None:
+            # An index built in SPIMI segments (or loaded from disk) is saved by merging whatever is still in memory
+            # with the segments and the saved postings
+            if self.index:
+                self.flush_to_disk()
+            self.merge_segments()
+        else:
+            self._complete_term_statistics((term, self._term_statistics(postings)) for term, postings in self.index.items())
+            with IndexFileWriter(self.index_name) as writer:
+                for term in sorted(self.index):
+                    postings = self.index[term]
+                    writer.add_term(term, self._encode_postings(postings), *self._term_statistics(postings))
+        self._forget_tombstones()
+
+        self.document_metadata.save(self.index_name)
+        save_statistics(self.index_name, self.statistics)
+        self._save_impact_indexes()
 
     def load(self) -> None:
         # TODO load the index files from disk to a Python object
-        with open(os.path.join(self.index_name, "index.json"), "r", encoding='utf-8') as index_file:
-            self.index = json.load(index_file)
+        # Only maps the files, postings and document metadata are read from them when they are asked for
+        self.lexicon = Lexicon(self.index_name)
+        self.vocabulary = Vocabulary(self.lexicon)
+        self.document_metadata = DocumentTable.load(self.index_name)
+        self.statistics = load_statistics(self.index_name)
+        self._upgrade_statistics()
+        self.index = {}
+        self.block_statistics = {}
+        self.docid_bitmaps = {}
+        self.impact_indexes = {}
+        self.impacts_changed = False
+        # documents of a loaded index are not in the forward index, removing them scans the changeable terms
+        if self.forward_index is not None:
+            self.forward_index = {}
+
+    def _upgrade_statistics(self) -> None:
+        # indexes saved before the running statistics were kept count their tokens once and their terms when asked,
+        # and the term statistics saved with the others are dropped
+        self.term_statistics = {}
+        self.term_statistics_exact = True
+        if 'total_token_count' not in self.statistics or 'vocab' in self.statistics:
+            self.statistics.setdefault('total_token_count', self.document_metadata.total_length())
+            self.statistics.pop('vocab', None)
+            self.statistics.pop('vocab_complete', None)
+            self._forget_term_statistics()
 
     def flush_to_disk(self) -> None:
         # OPTIONAL TODO flush index segments created using SPIMI strategy to disk and increment the segment number
-        segment_name = f"{self.index_name}_segment_{self.index_segment}"
+        # Each segment is a JSON line per term, sorted by term, so that all segments can be merged in one streaming pass.
+        os.makedirs(self.index_name, exist_ok=True)
+        segment_path = os.path.join(self.index_name, f"segment_{self.index_segment}.jsonl")
     
-        with open(f"{segment_name}_index.json", "w", encoding='utf-8') as index_file:
-            json.dump(self.index, index_file, ensure_ascii=False, indent=4)
+        with open(segment_path, "w", encoding='utf-8') as segment_file:
+            for term in sorted(self.index):
+                segment_file.write(json.dumps([term, self._postings_to_json(self.index[term])], ensure_ascii=False) + '\n')
         
         self.index = {}
         self.index_segment += 1
+        # flushed postings cannot be changed, so the forward index is only kept for the documents still in memory
+        if self.forward_index is not None:
+            self.forward_index = {}
+
+    def merge_segments(self) -> None:
+        '''
+        Merge all flushed segments and the previously saved postings, if any, into the index files with a k-way merge.
+        Only one term per input is held in memory at a time. The segment files are deleted afterwards.
+
+        The postings of a term from all inputs are concatenated and sorted by docid when they are encoded.
+        '''
+        segment_paths = [os.path.join(self.index_name, f"segment_{i}.jsonl") for i in range(self.index_segment)]
+        segment_files = [open(path, 'r', encoding='utf-8') for path in segment_paths]
+
+        # (term, input number, postings) so that equal terms come out in input order
+        streams = [((entry[0], i + 1, entry[1]) for entry in map(json.loads, segment_file))
+                   for i, segment_file in enumerate(segment_files)]
+        if self.lexicon is not None:
+            streams.insert(0, ((term, 0, self._decode_postings(buffer)) for term, buffer in self.lexicon.items()))
+
+        with IndexFileWriter(self.index_name) as writer:
+            for term, group in itertools.groupby(heapq.merge(*streams), key=lambda entry: entry[0]):
+                postings = []
+                for _, _, term_postings in group:
+                    postings.extend(term_postings)
+                if self.tombstones:
+                    postings = [posting for posting in postings if posting[0] not in self.tombstones]
+                    if not postings:
+                        if term not in self.index:
+                            self.vocabulary.discard(term)
+                        continue
+                writer.add_term(term, self._encode_postings(postings), *self._term_statistics(postings))
+
+        for segment_file in segment_files:
+            segment_file.close()
+        for path in segment_paths:
+            os.remove(path)
+
+        self.lexicon = Lexicon(self.index_name)
+        self.index_segment = 0
+        if not self.index:
+            # the merged postings are the whole index when nothing is left in memory, and the lexicon has their statistics
+            self.term_statistics = {}
+            self.term_statistics_exact = True
+
+    def get_saved_postings(self, term: str):
+        '''
+        Decode the postings of a term from the saved index files. Returns an empty list for terms that are not saved.
+        '''
+        i = self.lexicon.find(term) if self.lexicon is not None else -1
+        if i < 0:
+            return []
+        return self._decode_postings(self.lexicon.get_postings_buffer(i))
+
+    def _postings_to_json(self, postings) -> list:
+        return list(postings)
+
+    def _encode_postings(self, postings) -> bytes:
+        # (docid, freq) postings are stored sorted by docid and compressed, see postings.py
+        if isinstance(postings, PostingsList):
+            return postings.to_bytes()
+        return PostingsList.from_postings(postings).to_bytes()
+
+    def _decode_postings(self, buffer):
+        return PostingsList.from_buffer(buffer)
 
 
 class BasicInvertedIndex(InvertedIndex):
-    def __init__(self, index_name) -> None:
-        super().__init__(index_name)
+    def __init__(self, index_name, forward_index: bool = True) -> None:
+        super().__init__(index_name, forward_index)
         self.statistics['index_type'] = 'BasicInvertedIndex'
     # TODO implement all the functions mentioned in the interface
     # This is the typical inverted index where each term keeps track of documents and the term count per document.
 
-    def remove_doc(self, docid: int) -> None:
-        doc_tokens = [term for term, postings in self.index.items() if any(doc[0] == docid for doc in postings)]
-        
-        for token in doc_tokens:
-            postings_list = self.index[token]
-            postings_list = [(d, f) for d, f in postings_list if d != docid]
-            
-            if not postings_list:
-                del self.index[token]
-                self.vocabulary.remove(token)
-            else:
-                self.index[token] = postings_list
-        
-        doc_meta = self.document_metadata.pop(docid, {})
+    def _remove_postings(self, terms, docids: set[int]) -> None:
+        for term in terms:
+            postings_list = self.index.get(term)
+            if postings_list is not None and postings_list.remove_many(docids) and not postings_list:
+                self._discard_term(term)
 
     # def add_doc(self, docid: int, tokens: list[str]) -> None:
     #     self.document_metadata[docid] = {
@@ -170,24 +645,36 @@ class BasicInvertedIndex(InvertedIndex):
     #         postings_list.sort()
 
     def add_doc(self, docid: int, tokens: list[str]) -> None:
+        if docid in self.tombstones:
+            # the old postings of a removed document must be gone before it is added again
+            self.compact()
+        self._postings_changed()
+        self._count_tokens(docid, len(tokens))
         self.document_metadata[docid] = {
             'length': len(tokens),
             'unique_tokens': len(set(tokens))
         }
 
         token_freqs = Counter(tokens)
+        token_freqs.pop(None, None)
+        self._add_to_forward_index(docid, token_freqs.items())
+        self._count_terms(token_freqs.items())
 
         for token, freq in token_freqs.items():
             if token is None:
                 continue
             
             if token not in self.index:
-                self.index[token] = []
+                self.index[token] = PostingsList()
 
-            self.index[token].append((docid, freq))
+            self.index[token].append(docid, freq)
             
             self.vocabulary.add(token)
 
+    def freeze(self) -> None:
+        for postings_list in self.index.values():
+            postings_list.freeze()
+
     def get_postings(self, term: str) -> list:
         return super().get_postings(term)
     
@@ -210,62 +697,89 @@ class BasicInvertedIndex(InvertedIndex):
         return super().flush_to_disk()
 
 class PositionalInvertedIndex(InvertedIndex):
-    def __init__(self, index_name) -> None:
-        super().__init__(index_name)
+    position_bytes = 36
+    # the size in bytes of the decoded saved postings that are kept in memory
+    saved_postings_cache_bytes = 64 << 20
+
+    def __init__(self, index_name, forward_index: bool = True) -> None:
+        super().__init__(index_name, forward_index)
         self.statistics['index_type'] = 'PositionalInvertedIndex'
+        # decoding the positions is most of the cost of reading saved postings, and phrase queries read the
+        # postings of a term more than once
+        self.saved_postings_cache = PostingsCache(self.saved_postings_cache_bytes)
     # TODO implement all the functions mentioned in the interface
     # This is the positional inverted index where each term keeps track of documents and positions of the terms occring in the document.
 
-    def remove_doc(self, docid: int) -> None:
-        if docid not in self.document_metadata:
-            return
-        terms_to_delete = []
-        for term, postings_list in self.index.items():
-            for i, (d, _, _) in enumerate(postings_list):
-                if d == docid:
-                    del postings_list[i]
-                    break
-            if not postings_list:
-                terms_to_delete.append(term)
-        for term in terms_to_delete:
-            del self.index[term]
-            self.vocabulary.remove(term)
-        del self.document_metadata[docid]
+    def _remove_postings(self, terms, docids: set[int]) -> None:
+        for term in terms:
+            postings_list = self.index.get(term)
+            if postings_list is not None and postings_list.remove_many(docids) and not postings_list:
+                self._discard_term(term)
 
     def add_doc(self, docid: int, tokens: list[str]) -> None:
+        if docid in self.tombstones:
+            # the old postings of a removed document must be gone before it is added again
+            self.compact()
+        self._postings_changed()
+        self._count_tokens(docid, len(tokens))
         self.document_metadata[docid] = {
             'length': len(tokens),
             'unique_tokens': len(set(tokens))
         }
-        
+        # collect the positions of every term in one pass, then add one posting per term
+        term_positions = {}
         for position, token in enumerate(tokens):
-            # None token
             if token is None:
                 continue
+            positions = term_positions.get(token)
+            if positions is None:
+                term_positions[token] = [position]
+            else:
+                positions.append(position)
+        self._add_to_forward_index(docid, ((token, len(positions)) for token, positions in term_positions.items()))
+        self._count_terms((token, len(positions)) for token, positions in term_positions.items())
 
-            if token not in self.index:
-                self.index[token] = []
+        for token, positions in term_positions.items():
+            postings_list = self.index.get(token)
+            if postings_list is None:
+                postings_list = self.index[token] = PositionalPostingsList()
                 self.vocabulary.add(token)
-            
-            insert_pos = bisect.bisect_left(self.index[token], (docid,))
+            postings_list.append(docid, positions)
 
-            if insert_pos == len(self.index[token]) or self.index[token][insert_pos][0] != docid:
-                self.index[token].insert(insert_pos, (docid, 1, [position]))
-            else:
-                _, freq, positions = self.index[token][insert_pos]
-                self.index[token][insert_pos] = (docid, freq + 1, positions + [position])
-        
     def get_postings(self, term: str) -> list:
         return super().get_postings(term)
 
+    def get_saved_postings(self, term: str):
+        postings = self.saved_postings_cache.get(term)
+        if postings is None:
+            postings = super().get_saved_postings(term)
+            if postings:
+                self.saved_postings_cache.put(term, postings, self.position_bytes * (len(postings) + sum(posting[1] for posting in postings)))
+        return postings
+
+    def merge_segments(self) -> None:
+        # the saved postings are replaced by the merged ones
+        super().merge_segments()
+        self.saved_postings_cache.clear()
+
+    def get_term_positions(self, term: str, docids) -> tuple[np.ndarray, np.ndarray]:
+        # only the positions of the asked documents are decoded
+        postings = self.get_postings(term)
+        if isinstance(postings, PositionalPostingsList):
+            indices = np.searchsorted(np.frombuffer(postings.docids, dtype=np.uint32), docids)
+            return postings.get_positions_array(indices)
+        # saved postings merged with the in-memory ones, or without the removed documents, are a sorted list
+        postings_docids = np.fromiter((posting[0] for posting in postings), dtype=np.int64, count=len(postings))
+        selected = [postings[i] for i in np.searchsorted(postings_docids, docids).tolist()]
+        freqs = np.fromiter((posting[1] for posting in selected), dtype=np.int64, count=len(selected))
+        positions = np.fromiter(itertools.chain.from_iterable(posting[2] for posting in selected), dtype=np.int64, count=int(freqs.sum()))
+        return freqs, positions
+
     def get_doc_metadata(self, doc_id: int) -> dict[str, int]:
         return super().get_doc_metadata(doc_id)
     
     def get_term_metadata(self, term: str) -> dict[str, int]:
-        postings_list = self.get_postings(term)
-        doc_frequency = len(postings_list)
-        total_term_frequency = sum(freq for _, freq, _ in postings_list)
-        return {'document_frequency': doc_frequency, 'total_term_frequency': total_term_frequency}
+        return super().get_term_metadata(term)
 
     def get_statistics(self) -> dict[str, int]:
         return super().get_statistics()
@@ -274,114 +788,371 @@ class PositionalInvertedIndex(InvertedIndex):
         return super().save()
     
     def load(self) -> None:
-        return super().load()
+        super().load()
+        self.saved_postings_cache.clear()
     
     def flush_to_disk(self) -> None:
         return super().flush_to_disk()
 
+    def _encode_postings(self, postings) -> bytes:
+        # the number of postings, then the docid gaps, the frequencies and the gaps between the positions of every
+        # posting (the first position is stored as is), all as varints
+        postings = sorted(postings, key=lambda posting: posting[0])
+        values = [len(postings)]
+        previous_docid = 0
+        for docid, _, _ in postings:
+            values.append(docid - previous_docid)
+            previous_docid = docid
+        values.extend(freq for _, freq, _ in postings)
+        for _, _, positions in postings:
+            previous_position = 0
+            for position in positions:
+                values.append(position - previous_position)
+                previous_position = position
+        return encode_varints(values)
+
+    def _decode_postings(self, buffer) -> list:
+        values = decode_varints(buffer)
+        count = int(values[0])
+        docids = np.cumsum(values[1:count + 1]).tolist()
+        freqs = values[count + 1:2 * count + 1].astype(np.int64)
+        # positions are the running sum of their gaps, restarted at every posting
+        position_gaps = values[2 * count + 1:]
+        positions = np.cumsum(position_gaps)
+        starts = np.cumsum(freqs) - freqs
+        if len(positions):
+            positions -= np.repeat(positions[starts] - position_gaps[starts], freqs)
+        positions = positions.tolist()
+        postings = []
+        start = 0
+        for docid, freq in zip(docids, freqs.tolist()):
+            postings.append((docid, freq, positions[start:start + freq]))
+            start += freq
+        return postings
+
 class OnDiskInvertedIndex(InvertedIndex):
-    def __init__(self, index_name) -> None:
-        super().__init__(index_name)
+    posting_bytes = 150
+    # the number of added documents whose postings are gathered in memory before they are written to the postings
+    # database in one batch
+    write_batch_size = 1000
+    # the size in bytes of the decoded postings lists that are kept in memory
+    postings_cache_bytes = 64 << 20
+
+    def __init__(self, index_name, forward_index: bool = True) -> None:
+        super().__init__(index_name, forward_index)
         self.statistics['index_type'] = 'OnDiskInvertedIndex'
         self.postings_db_path = os.path.join(self.index_name, "postings_db")
         os.makedirs(self.index_name, exist_ok=True)
+        # the (docid, freq) postings of every term added since the last batch was written, and their number of documents
+        self.pending_postings = {}
+        self.pending_documents = 0
+        # the number of batches appended to each term's stored postings since they were last joined, which are kept in
+        # a database of their own that stays open until they are joined (see flush_writes)
+        self.postings_chunks = {}
+        self.postings_chunks_db_path = os.path.join(self.index_name, "postings_chunks_db")
+        self.chunks_db = None
+        # the postings are only read from the postings database, through an LRU cache of the recently used terms.
+        # The database stays open for reading until it is written to.
+        self.postings_cache = PostingsCache(self.postings_cache_bytes)
+        self.postings_reader = None
+        # the saved statistics of every term are in their own database, read a term at a time like the postings
+        self.term_statistics_db_path = os.path.join(self.index_name, "term_statistics_db")
+        self.term_statistics_reader = None
     
-    def remove_doc(self, docid: int) -> None:
-        if docid in self.document_metadata:
-            del self.document_metadata[docid]
-        
-        with shelve.open(self.postings_db_path, writeback=True) as postings_db:         
-            for token in list(self.vocabulary):
-                postings_list = postings_db.get(token, {})
-                if docid in postings_list:
-                    del postings_list[docid]
-                
-                    if postings_list:
-                        postings_db[token] = postings_list
-                    else:
-                        del postings_db[token]
-                        self.vocabulary.remove(token)
-                        del self.index[token]
+    def _changeable_terms(self):
+        # every term ever added has its postings in the postings database
+        return self.vocabulary
+
+    def _remove_postings(self, terms, docids: set[int]) -> None:
+        # the postings database holds every term's compressed postings (see postings.py)
+        self.flush_writes()
+        self._join_postings_chunks()
+        self._close_postings_reader()
+        with shelve.open(self.postings_db_path) as postings_db:
+            for term in terms:
+                if term not in postings_db:
+                    continue
+                postings_list = PostingsList.from_buffer(postings_db[term])
+                if not postings_list.remove_many(docids):
+                    continue
+                self.postings_cache.discard(term)
+                if postings_list:
+                    postings_db[term] = postings_list.to_bytes()
+                else:
+                    del postings_db[term]
+                    self._discard_term(term)
 
-    
     def add_doc(self, docid: int, tokens: list[str]) -> None:
+        if docid in self.tombstones:
+            # the old postings of a removed document must be gone before it is added again
+            self.compact()
+        self._postings_changed()
+        self._count_tokens(docid, len(tokens))
         self.document_metadata[docid] = {
             'length': len(tokens), 
             'unique_tokens': len(set(tokens))
         }
         
-        with shelve.open(self.postings_db_path, writeback=True) as postings_db:
-            for token in tokens:
-                if token is None:
-                    continue
-                
-                if token not in self.index:
-                    self.index[token] = {}
-                        
-                if docid in self.index[token]:
-                    self.index[token][docid] += 1
-                else:
-                    self.index[token][docid] = 1
-                    self.vocabulary.add(token)
-                
-                postings_list = postings_db.get(token, {})
-                postings_list[docid] = postings_list.get(docid, 0) + 1
-                postings_db[token] = postings_list
+        token_freqs = Counter(token for token in tokens if token is not None)
+        self._add_to_forward_index(docid, token_freqs.items())
+        self._count_terms(token_freqs.items())
+
+        for token, freq in token_freqs.items():
+            self.vocabulary.add(token)
+            pending = self.pending_postings.get(token)
+            if pending is None:
+                pending = self.pending_postings[token] = []
+            pending.append((docid, freq))
+        self.pending_documents += 1
+        if self.pending_documents >= self.write_batch_size:
+            self.flush_writes()
+
+    def flush_writes(self) -> None:
+        '''
+        Write the postings gathered since the last batch to the postings database. The database is opened once and
+        every term is written once, in term order. The new postings of a term that is already stored are encoded on
+        their own and appended to the chunks database, so a batch only writes its own postings. The chunks are joined
+        to the stored postings once, by freeze(), see _join_postings_chunks.
+        '''
+        if self.pending_postings:
+            self._close_postings_reader()
+            with shelve.open(self.postings_db_path) as postings_db:
+                for term in sorted(self.pending_postings):
+                    docids, freqs = self._sum_postings(*np.array(self.pending_postings[term], dtype=np.int64).T)
+                    if term in postings_db:
+                        if self.chunks_db is None:
+                            self.chunks_db = shelve.open(self.postings_chunks_db_path, 'n')
+                        chunks = self.postings_chunks.get(term, 0) + 1
+                        self.chunks_db[self._chunk_key(term, chunks)] = encode_postings(docids, freqs)
+                        self.postings_chunks[term] = chunks
+                    else:
+                        postings_db[term] = encode_postings(docids, freqs)
+                    self.postings_cache.discard(term)
+        self.pending_postings = {}
+        self.pending_documents = 0
+
+    @staticmethod
+    def _chunk_key(term: str, chunk: int) -> str:
+        # the key of a batch of postings appended to a term's stored ones
+        return f'{term}\x00{chunk}'
+
+    @staticmethod
+    def _sum_postings(docids: np.ndarray, freqs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # postings sorted by docid, with the frequencies of a document that was added again added up
+        if len(docids) > 1 and not (docids[1:] > docids[:-1]).all():
+            docids, inverse = np.unique(docids, return_inverse=True)
+            freqs = np.bincount(inverse, weights=freqs).astype(np.int64)
+        return docids, freqs
+
+    def _stored_postings(self, postings_db, term: str):
+        # the decoded (docids, freqs) of a term's stored postings and of the chunks appended to them, or None
+        buffer = postings_db.get(term)
+        if buffer is None:
+            return None
+        chunks = self.postings_chunks.get(term, 0)
+        if not chunks:
+            return PostingsList.from_buffer(buffer).decode()
+        columns = [PostingsList.from_buffer(buffer).decode()]
+        columns.extend(PostingsList.from_buffer(self.chunks_db[self._chunk_key(term, chunk)]).decode()
+                       for chunk in range(1, chunks + 1))
+        return self._sum_postings(np.concatenate([docids for docids, _ in columns]).astype(np.int64),
+                                  np.concatenate([freqs for _, freqs in columns]).astype(np.int64))
+
+    def _join_postings_chunks(self) -> None:
+        # rewrite the postings of every term with appended chunks as one list, once for all the batches
+        if not self.postings_chunks:
+            return
+        self._close_postings_reader()
+        with shelve.open(self.postings_db_path) as postings_db:
+            for term in sorted(self.postings_chunks):
+                postings_db[term] = encode_postings(*self._stored_postings(postings_db, term))
+        self._close_chunks_db()
+
+    def _close_chunks_db(self) -> None:
+        # the chunks are dropped all at once, rather than deleted one by one
+        if self.chunks_db is not None:
+            self.chunks_db.close()
+            self.chunks_db = None
+            shelve.open(self.postings_chunks_db_path, 'n').close()
+        self.postings_chunks = {}
+
+    def freeze(self) -> None:
+        self.flush_writes()
+        self._join_postings_chunks()
+
+    def _read_postings(self, term: str) -> PostingsList:
+        # the decoded postings of a term from the cache, or else from the postings database
+        if term in self.pending_postings:
+            self.flush_writes()
+        if term not in self.vocabulary:
+            return PostingsList()
+        postings_list = self.postings_cache.get(term)
+        if postings_list is None:
+            if self.postings_reader is None:
+                self.postings_reader = shelve.open(self.postings_db_path, 'r')
+            columns = self._stored_postings(self.postings_reader, term)
+            if columns is None:
+                return PostingsList()
+            postings_list = PostingsList.from_columns(*columns)
+            self.postings_cache.put(term, postings_list, 8 * len(postings_list))
+        return postings_list
+
+    def _close_postings_reader(self) -> None:
+        # the reader's view of the database is stale once it is written to
+        if self.postings_reader is not None:
+            self.postings_reader.close()
+            self.postings_reader = None
     
     def get_postings(self, term: str) -> list:
-        # with shelve.open(self.postings_db_path, writeback=False) as postings_db:
-        #     postings_dict = postings_db.get(term, {})
-        #     return [(docid, freq) for docid, freq in postings_dict.items()]
-        postings_list = self.index.get(term, {})
-        postings = [(docid, freq) for docid, freq in postings_list.items()]
+        # read from disk when the term is not cached, only the lexicon of the postings database is kept in memory
+        postings = self._read_postings(term)
+        if self.tombstones:
+            postings = self._without_tombstones(postings)
         return postings
+
+    def get_term_frequency(self, term: str, docid: int) -> int:
+        # looked up in the cached postings without building the whole postings list
+        if docid in self.tombstones:
+            return 0
+        return find_frequency(self._read_postings(term), docid)
     
     def get_statistics(self) -> dict[str, int]:
         return super().get_statistics()
     
     def get_term_metadata(self, term: str) -> dict[str, int]:
-        postings_list = self.index.get(term, {})
-        
-        return {
-            'total_term_frequency': sum(postings_list.values()),  
-            'document_frequency': len(postings_list)
-        }
+        return super().get_term_metadata(term)
 
+    def _saved_term_statistics(self, term: str) -> list[int]:
+        # terms that were removed since may still have a record
+        if self.term_statistics_reader is None or term not in self.vocabulary:
+            return [0, 0]
+        return list(self.term_statistics_reader.get(term, (0, 0)))
+
+    def _save_term_statistics(self, rewrite: bool) -> None:
+        # write the statistics of the terms changed since the last save, or of every term when they were recounted
+        if self.term_statistics_reader is not None:
+            self.term_statistics_reader.close()
+        with shelve.open(self.term_statistics_db_path, 'n' if rewrite else 'c') as term_statistics_db:
+            for term, term_statistics in self.term_statistics.items():
+                if term_statistics[0]:
+                    term_statistics_db[term] = tuple(term_statistics)
+                elif term in term_statistics_db:
+                    del term_statistics_db[term]
+        self.term_statistics = {}
+        self.term_statistics_reader = shelve.open(self.term_statistics_db_path, 'r')
 
     def save(self) -> None:
         # TODO save the index files to disk
         if not os.path.exists(self.index_name):
             os.makedirs(self.index_name)
 
+        self.freeze()
+        if self.tombstones:
+            self._drop_tombstoned_postings()
+        # the postings database holds the whole index
+        recount = not self.term_statistics_exact
+        self._complete_term_statistics((term, self._term_statistics(self._read_postings(term))) for term in self.vocabulary)
+        self._forget_tombstones()
+        self._save_term_statistics(recount)
+
+        # the document table is saved in the same binary format as the other index types
+        self.document_metadata.save(self.index_name)
         with shelve.open(os.path.join(self.index_name, "index"), 'c') as index:
-            index['index'] = self.index
-            index['vocabulary'] = self.vocabulary
-            index['document_metadata'] = self.document_metadata
+            index['vocabulary'] = set(self.vocabulary)
             index['statistics'] = self.statistics
+        self._save_impact_indexes()
     
     def load(self) -> None:
         # TODO load the index files from disk to a Python object
+        # only the vocabulary and the statistics are loaded, postings are read from the postings database when asked for
         with shelve.open(os.path.join(self.index_name, "index"), 'r') as index:
-            self.index = index['index']
             self.vocabulary = index['vocabulary']
-            self.document_metadata = index['document_metadata']
+            self.document_metadata = DocumentTable.load(self.index_name)
             self.statistics = index['statistics']
+            self._upgrade_statistics()
+        if self.term_statistics_reader is not None:
+            self.term_statistics_reader.close()
+        try:
+            self.term_statistics_reader = shelve.open(self.term_statistics_db_path, 'r')
+        except dbm.error:
+            # saved before the term statistics had a database, _upgrade_statistics counts them again
+            self.term_statistics_reader = None
+        self.index = {}
+        self.lexicon = None
+        self.block_statistics = {}
+        self.docid_bitmaps = {}
+        self.impact_indexes = {}
+        self.impacts_changed = False
+        self.pending_postings = {}
+        self.pending_documents = 0
+        self._close_chunks_db()
+        self._close_postings_reader()
+        self.postings_cache.clear()
+        if self.forward_index is not None:
+            self.forward_index = {}
     
     def flush_to_disk(self) -> None:
-        # OPTIONAL TODO flush index segments created using SPIMI strategy to disk and increment the segment number
-        segment_name = f"{self.index_name}_segment_{self.index_segment}"
-        with shelve.open(segment_name) as segment_db:
-            segment_db.update(self.index)
+        # the postings are on disk once the pending batch is written, so there are no SPIMI segments to flush
+        self.flush_writes()
+
+def filter_tokens(tokens: list[str], stopwords: set[str], minimum_word_frequency: int) -> list[str]:
+    '''
+    Replace stopwords and tokens that occur fewer than minimum_word_frequency times in the document with None.
+    Passing an empty stopword set and a minimum_word_frequency of 0 returns the tokens unchanged.
+    '''
+    if not stopwords and minimum_word_frequency <= 1:
+        return tokens
+
+    lower_tokens = [token.lower() if token is not None else None for token in tokens]
+
+    token_freq = {}
+    for token in lower_tokens:
+        if token:
+            token_freq[token] = token_freq.get(token, 0) + 1
+
+    filtered_tokens = []
+    for token, lower_token in zip(tokens, lower_tokens):
+        if lower_token in stopwords:
+            filtered_tokens.append(None)
+        elif minimum_word_frequency > 1 and token_freq.get(lower_token, 0) < minimum_word_frequency:
+            filtered_tokens.append(None)
+        else:
+            filtered_tokens.append(token)
+    return filtered_tokens
+
+
+# state of a tokenizer worker process, set once by _init_tokenize_worker so it is not pickled with every batch
+_worker_state = {}
+
+
+def _init_tokenize_worker(document_preprocessor, stopwords: set[str], minimum_word_frequency: int) -> None:
+    _worker_state['document_preprocessor'] = document_preprocessor
+    _worker_state['stopwords'] = stopwords
+    _worker_state['minimum_word_frequency'] = minimum_word_frequency
+
+
+def _tokenize_batch(lines: list[str]) -> list[tuple[int, list[str]]]:
+    # runs inside a worker process: parse, tokenize and filter a batch of JSONL lines
+    document_preprocessor = _worker_state['document_preprocessor']
+    stopwords = _worker_state['stopwords']
+    minimum_word_frequency = _worker_state['minimum_word_frequency']
+
+    documents = []
+    for line in lines:
+        doc = json.loads(line.strip())
+        tokens = document_preprocessor.tokenize(doc['text'])
+        documents.append((doc['docid'], filter_tokens(tokens, stopwords, minimum_word_frequency)))
+    return documents
 
-        self.index_segment += 1
-        self.index = {}
 
 class Indexer:
     '''The Indexer class is responsible for creating the index used by the search/ranking algorithm.
     '''
 
     @staticmethod
-    def create_index(index_name: str, index_type: IndexType, dataset_path: str, document_preprocessor, stopword_filtering: bool, minimum_word_frequency: int) -> InvertedIndex:
+    def create_index(index_name: str, index_type: IndexType, dataset_path: str, document_preprocessor, stopword_filtering: bool, minimum_word_frequency: int,
+                     *, num_workers: int = 0, batch_size: int = 64, memory_budget: int = 0, forward_index: bool = True,
+                     minimum_collection_frequency: int = 0, max_docs: int = None) -> InvertedIndex:
         '''
         The Index class' static function which is responsible for creating the indexes already created indexes present on disk.
 
@@ -399,53 +1170,154 @@ class Indexer:
 
         minimum_word_frequency [int]: This is also an optional configuration which sets the minimum word frequency of a particular token to be indexed. If the token does not appear in the document atleast for the set frequency, it will not be indexed. Setting a value of 0 will completely ignore the parameter.
 
+        num_workers [int]: The number of processes used to tokenize documents. With 0 every document is read, tokenized and indexed one at a time in this process. Otherwise a reader thread, a pool of tokenizer processes and the indexing loop run as separate stages connected by bounded queues. Both paths build the same index.
+
+        batch_size [int]: The number of documents sent to a tokenizer process at a time. Only used when num_workers is greater than 0.
+
+        memory_budget [int]: The approximate number of bytes the postings held in memory may take. When the budget is reached the postings are flushed to disk as a sorted segment (SPIMI), and all segments are merged into a single on-disk index at the end. Setting a value of 0 keeps the whole index in memory.
+
+        forward_index [bool]: Whether the index keeps the terms of every added document, so that remove_doc and remove_docs only rewrite the postings lists of the removed documents' terms instead of scanning the whole index.
+
+        minimum_collection_frequency [int]: The number of times a token must occur in the whole collection to be indexed. Unlike minimum_word_frequency it keeps the terms that are rare in a document but not in the collection, and drops the long tail of terms that only occur once or twice in the collection. The documents are read and tokenized twice: once to count the terms, once to index them. Setting a value of 0 will completely ignore the parameter.
+
+        max_docs [int]: The number of documents to index from the start of the dataset, or None to index all of them.
+
+        The parameters after minimum_word_frequency are keyword-only.
+
         '''
         # TODO implement this class properly. This is responsible for going through the documents one by one and inserting them into the index after tokenizing the document
         if index_type == IndexType.PositionalIndex:
-            index = PositionalInvertedIndex(index_name)
+            index = PositionalInvertedIndex(index_name, forward_index)
         elif index_type == IndexType.InvertedIndex:
-            index = BasicInvertedIndex(index_name)
+            index = BasicInvertedIndex(index_name, forward_index)
         elif index_type == IndexType.OnDiskInvertedIndex:
-            index = OnDiskInvertedIndex(index_name)
+            index = OnDiskInvertedIndex(index_name, forward_index)
         else:
             raise ValueError(f"Unknown index_type: {index_type}")
         
-        if stopword_filtering:
-            with open('stopwords.txt', 'r') as f:
-                stopwords = set(f.read().splitlines())
+        # the stopwords are read once per process, an Analyzer brings its own
+        stopwords = set()
+        if isinstance(document_preprocessor, Analyzer):
+            if stopword_filtering:
+                stopwords = document_preprocessor.stopwords or load_stopwords()
+            document_preprocessor = document_preprocessor.tokenizer
+        elif stopword_filtering:
+            stopwords = load_stopwords()
         
-        with open(dataset_path, 'r', encoding='utf-8') as file:
-            for count, line in tqdm(enumerate(file)):
-                # if count >= 5:
-                #     break
-                doc = json.loads(line.strip())
-                tokens = document_preprocessor.tokenize(doc['text'])
+        def read_documents():
+            if num_workers > 0:
+                return Indexer.tokenize_parallel(dataset_path, document_preprocessor, stopwords, minimum_word_frequency,
+                                                 num_workers, batch_size, max_docs)
+            return Indexer.tokenize_serial(dataset_path, document_preprocessor, stopwords, minimum_word_frequency, max_docs)
 
-                if stopword_filtering or minimum_word_frequency > 1:
-                    lower_tokens = [token.lower() if token is not None else None for token in tokens]
-                    
-                    token_freq = {}
-                    for token in lower_tokens:
-                        if token:
-                            token_freq[token] = token_freq.get(token, 0) + 1
-                    #print(token_freq)
-                    filtered_tokens = []
-
-                    for token, lower_token in zip(tokens, lower_tokens):
-                        if stopword_filtering and lower_token in stopwords:
-                            filtered_tokens.append(None)
-                        elif minimum_word_frequency > 1 and token_freq.get(lower_token, 0) < minimum_word_frequency:
-                            filtered_tokens.append(None)
-                        else:
-                            filtered_tokens.append(token)
-                else:
-                    filtered_tokens = tokens
-                # print(filtered_tokens)
-                index.add_doc(doc['docid'], filtered_tokens)
+        # a first pass over the collection finds the terms that are frequent enough, so that the others never
+        # take room in the index
+        frequent_terms = None
+        if minimum_collection_frequency > 1:
+            frequent_terms = Indexer.frequent_terms(read_documents(), minimum_collection_frequency)
+
+        segment_bytes = 0
+        for docid, filtered_tokens in tqdm(read_documents()):
+            if frequent_terms is not None:
+                filtered_tokens = [token if token in frequent_terms else None for token in filtered_tokens]
+            index.add_doc(docid, filtered_tokens)
+
+            if memory_budget > 0:
+                terms = set(filtered_tokens)
+                terms.discard(None)
+                segment_bytes += len(terms) * index.posting_bytes + len(filtered_tokens) * index.position_bytes
+                if segment_bytes >= memory_budget:
+                    index.flush_to_disk()
+                    segment_bytes = 0
         
+        # with segments on disk, saving merges them into the final index
+        index.freeze()
         index.save()       
         return index
 
+    @staticmethod
+    def frequent_terms(documents, minimum_collection_frequency: int) -> set[str]:
+        '''
+        Return the terms that occur at least minimum_collection_frequency times in the tokenized documents. Only the
+        counts of the terms are kept while the documents are read, and only the frequent terms once they are.
+        '''
+        term_counts = Counter()
+        for _, tokens in documents:
+            term_counts.update(tokens)
+        term_counts.pop(None, None)
+        return {term for term, count in term_counts.items() if count >= minimum_collection_frequency}
+
+    @staticmethod
+    def tokenize_serial(dataset_path: str, document_preprocessor, stopwords: set[str], minimum_word_frequency: int,
+                        max_docs: int = None):
+        '''
+        Read, tokenize and filter the documents of the dataset one at a time, yielding (docid, tokens) pairs in file order.
+        Only the first max_docs documents are read, all of them if max_docs is None.
+        '''
+        with open(dataset_path, 'r', encoding='utf-8') as file:
+            for line in itertools.islice(file, max_docs):
+                doc = json.loads(line.strip())
+                tokens = document_preprocessor.tokenize(doc['text'])
+                yield doc['docid'], filter_tokens(tokens, stopwords, minimum_word_frequency)
+
+    @staticmethod
+    def tokenize_parallel(dataset_path: str, document_preprocessor, stopwords: set[str], minimum_word_frequency: int,
+                          num_workers: int, batch_size: int, max_docs: int = None):
+        '''
+        Same as tokenize_serial, but as a pipeline of three stages:
+
+        1. a reader thread that groups the lines of the dataset into batches and puts them on a bounded queue,
+        2. a pool of num_workers processes that parse, tokenize and filter one batch at a time,
+        3. the caller, which receives the tokenized documents in file order.
+
+        At most 2 * num_workers batches are being tokenized or waiting to be indexed at any time,
+        so memory stays bounded when the indexing stage is slower than the tokenizers.
+        '''
+        max_pending = 2 * num_workers
+        batches = queue.Queue(maxsize=max_pending)
+
+        # opened before the reader thread starts so that a missing dataset raises here and not inside the thread
+        file = open(dataset_path, 'r', encoding='utf-8')
+        read_errors = []
+
+        def read_batches() -> None:
+            try:
+                with file:
+                    batch = []
+                    for line in itertools.islice(file, max_docs):
+                        batch.append(line)
+                        if len(batch) == batch_size:
+                            batches.put(batch)
+                            batch = []
+                    if batch:
+                        batches.put(batch)
+            except Exception as e:
+                read_errors.append(e)
+            finally:
+                batches.put(None)
+
+        reader = threading.Thread(target=read_batches, daemon=True)
+        reader.start()
+
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_tokenize_worker,
+                                 initargs=(document_preprocessor, stopwords, minimum_word_frequency)) as pool:
+            pending = deque()
+            done_reading = False
+            while not done_reading or pending:
+                # keep the pool busy until enough batches are in flight or the reader is done
+                while not done_reading and len(pending) < max_pending:
+                    batch = batches.get()
+                    if batch is None:
+                        done_reading = True
+                    else:
+                        pending.append(pool.submit(_tokenize_batch, batch))
+                if pending:
+                    # results are handed over in submission order so the index matches the serial path
+                    yield from pending.popleft().result()
+        reader.join()
+        if read_errors:
+            raise read_errors[0]
+
 # TODO for each inverted index implementation, use the Indexer to create an index with the first 10, 100, 1000, and 10000 documents in the collection (what was just preprocessed). At each size, record (1) how
 # long it took to index that many documents and (2) using the get memory footprint function provided, how much memory the index consumes. Record these sizes and timestamps. Make
 # a plot for each, showing the number of documents on the x-axis and either time or memory
@@ -481,6 +1353,9 @@ def get_memory_footprint(obj, seen=None):
     elif obj_id in seen:
         return 0
     seen.add(obj_id)
+    if isinstance(obj, (PostingsList, PositionalPostingsList, array, np.ndarray)):
+        # flat buffers, sys.getsizeof already counts their contents
+        return size
     if isinstance(obj, dict):
         size += sum([get_memory_footprint(v, seen) for v in obj.values()])
         size += sum([get_memory_footprint(k, seen) for k in obj.keys()])
@@ -509,10 +1384,10 @@ if __name__=='__main__':
     memory_usages = []
     
     for doc_size in doc_sizes:
-        # NOTE: The dataset should be preprocessed to have subsets for 10, 100, 1000, 10000 documents
+        # only the first doc_size documents of the dataset are indexed
         start_time = time.time()
         index = Indexer.create_index(index_name + f"_{doc_size}", index_type, FILE_PATH, 
-                                     document_preprocessor, stopword_filtering, minimum_word_frequency, doc_size)
+                                     document_preprocessor, stopword_filtering, minimum_word_frequency, max_docs=doc_size)
         end_time = time.time()
         
         indexing_times.append(end_time - start_time)
@@ -25,13 +25,18 @@ class SearchEngine(BaseSearchEngine):
         # initialize the search algorithm and rank using the index
         self.ranker = Ranker(self.index, document_preprocessor, False, SampleScorer(self.index, {'hyperparam1': 100, 'hyperparam2': 2}))
 
-    def search(self, query: str) -> list[SearchResponse]:
+    def search(self, query: str, k: int = None) -> list[SearchResponse]:
         # here the ranker should score, sort and return a bunch of docids as results
-        results = self.ranker.query(query)
+        return self.search_top_k(query, k)[0]
+
+    def search_top_k(self, query: str, k: int = None) -> tuple[list[SearchResponse], int]:
+        # only the k best documents are selected and sorted, all of them if k is None, and the total number of
+        # matching documents is returned with them since it can be larger than k
+        results, total_hits = self.ranker.query_top_k(query, k)
         # SearchResponse is a FastAPI/Pydantic model which essentially helps creates the UI.
         # the expectation is to create a list of SearchResponses where the id is the rank of the document, docid is the Wikipedia document id and score is the score of the document.
         # As a sample, we have hardcoded the docid to a magical wikipedia doc and it has to be changed in your final implementation
-        return [SearchResponse(id=idx+1, docid=result['docid'], score=result['score']) for idx, result in enumerate(results)]
+        return [SearchResponse(id=idx+1, docid=result['docid'], score=result['score']) for idx, result in enumerate(results)], total_hits
 
 
 def initialize():
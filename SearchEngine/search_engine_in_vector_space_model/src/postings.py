@@ -0,0 +1,988 @@
+'''
+Compact postings lists used by the index classes in indexing.py, and the compressed codec they are stored in.
+
+Encoded postings (the frozen form of a PostingsList and the postings in postings.bin) are laid out as:
+
+count           varint, the number of postings
+skip table      only when there is more than one block: the last docid of every block followed by the byte
+                offset where every block ends, as uint32
+blocks          BLOCK_SIZE postings each: the docid gaps followed by the term frequencies, as varints
+
+Docids are sorted, so every docid is stored as the gap to the previous one (the first gap of a block is
+relative to the last docid of the previous block). Small gaps and frequencies take one byte instead of four.
+The skip table lets a lookup decode a single block, and whole lists or blocks are decoded with NumPy in one go.
+'''
+from array import array
+import bisect
+import sys
+import numpy as np
+
+BLOCK_SIZE = 128
+# below these sizes a plain Python loop is faster than setting up NumPy arrays
+SMALL_ENCODE = 32
+SMALL_DECODE = 64
+SMALL_INTERSECT = 16
+
+
+def encode_varints(values) -> bytes:
+    '''
+    Encode non-negative integers as LEB128 varints: 7 bits per byte, the high bit is set on all but the last byte.
+    '''
+    return _encode_varints(values)[0]
+
+
+def _encode_varints(values) -> tuple[bytes, np.ndarray | None]:
+    # the encoded bytes and, for the NumPy path, the number of bytes of every value
+    if len(values) < SMALL_ENCODE:
+        encoded = bytearray()
+        for value in values:
+            value = int(value)
+            while value >= 0x80:
+                encoded.append((value & 0x7F) | 0x80)
+                value >>= 7
+            encoded.append(value)
+        return bytes(encoded), None
+
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    encoded = np.empty(int(ends[-1]), dtype=np.uint8)
+    for k in range(int(lengths.max())):
+        has_byte = lengths > k
+        chunk = ((values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7F)).astype(np.uint8)
+        chunk[lengths[has_byte] > k + 1] |= 0x80
+        encoded[starts[has_byte] + k] = chunk
+    return encoded.tobytes(), lengths
+
+
+def decode_varints(buffer) -> np.ndarray:
+    '''
+    Decode a buffer of varints into a uint64 array, all at once.
+    '''
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == len(data):
+        # every value fits in one byte
+        return data.astype(np.uint64)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # add the k-th byte of every value that is longer than k bytes, so each pass only touches fewer values
+    extra_bytes = ends - starts
+    values = (data[starts] & 0x7F).astype(np.uint64)
+    longer = np.flatnonzero(extra_bytes)
+    k = 1
+    while len(longer):
+        values[longer] |= (data[starts[longer] + k] & 0x7F).astype(np.uint64) << np.uint64(7 * k)
+        k += 1
+        longer = longer[extra_bytes[longer] >= k]
+    return values
+
+
+def _decode_varints_small(buffer) -> list[int]:
+    values, value, shift = [], 0, 0
+    for byte in bytes(buffer):
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            values.append(value)
+            value = shift = 0
+        else:
+            shift += 7
+    return values
+
+
+def _read_header(buffer) -> tuple[int, int, int]:
+    # (number of postings, number of blocks, offset of the skip table)
+    count, shift, offset = 0, 0, 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        count |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return count, -(-count // BLOCK_SIZE), offset
+
+
+def _block_layout(count: int, num_blocks: int) -> tuple[np.ndarray, np.ndarray]:
+    # where the gap and the frequency of every posting are in the value stream of the blocks
+    index = np.arange(count)
+    block = index // BLOCK_SIZE
+    block_sizes = np.full(num_blocks, BLOCK_SIZE)
+    block_sizes[-1] = count - BLOCK_SIZE * (num_blocks - 1)
+    gap_index = index + block * BLOCK_SIZE
+    return gap_index, gap_index + block_sizes[block]
+
+
+def _split_blocks(values: np.ndarray, count: int) -> tuple[np.ndarray, np.ndarray]:
+    # the inverse of _block_layout: the gaps and the frequencies of the value stream of all blocks
+    full_blocks = count // BLOCK_SIZE
+    blocks = values[:2 * BLOCK_SIZE * full_blocks].reshape(full_blocks, 2, BLOCK_SIZE)
+    tail = values[2 * BLOCK_SIZE * full_blocks:]
+    tail_size = count - BLOCK_SIZE * full_blocks
+    gaps = np.concatenate([blocks[:, 0].ravel(), tail[:tail_size]])
+    freqs = np.concatenate([blocks[:, 1].ravel(), tail[tail_size:]])
+    return gaps, freqs
+
+
+def encode_postings(docids, freqs) -> bytes:
+    '''
+    Encode postings sorted by docid in the block format described at the top of this module.
+    '''
+    count = len(docids)
+    header = encode_varints([count])
+    if count == 0:
+        return header
+    docids = np.asarray(docids, dtype=np.int64)
+    gaps = np.diff(docids, prepend=0)
+    if count <= BLOCK_SIZE:
+        return header + encode_varints(np.concatenate([gaps, np.asarray(freqs, dtype=np.int64)]))
+
+    num_blocks = -(-count // BLOCK_SIZE)
+    gap_index, freq_index = _block_layout(count, num_blocks)
+    values = np.empty(2 * count, dtype=np.int64)
+    values[gap_index] = gaps
+    values[freq_index] = freqs
+    encoded, lengths = _encode_varints(values)
+    # the number of values up to the end of every block, and the byte where each block ends
+    block_values = np.minimum(np.arange(1, num_blocks + 1) * BLOCK_SIZE, count) * 2
+    block_ends = np.cumsum(lengths)[block_values - 1]
+    last_docids = docids[block_values // 2 - 1]
+    skip_table = last_docids.astype('<u4').tobytes() + block_ends.astype('<u4').tobytes()
+    return header + skip_table + encoded
+
+
+def decode_postings(buffer) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Decode encoded postings into (docids, freqs) uint32 arrays.
+    '''
+    count, num_blocks, offset = _read_header(buffer)
+    if num_blocks > 1:
+        offset += 8 * num_blocks
+    values = decode_varints(memoryview(buffer)[offset:])
+    if num_blocks > 1:
+        gaps, freqs = _split_blocks(values, count)
+    else:
+        gaps, freqs = values[:count], values[count:]
+    return np.cumsum(gaps).astype(np.uint32), freqs.astype(np.uint32)
+
+
+def _decode_postings_small(buffer) -> tuple[list[int], list[int]]:
+    # decode_postings for short single block lists, as Python lists
+    count, _, offset = _read_header(buffer)
+    values = _decode_varints_small(buffer[offset:])
+    docids, docid = values[:count], 0
+    for i, gap in enumerate(docids):
+        docid += gap
+        docids[i] = docid
+    return docids, values[count:]
+
+
+def decode_block(buffer, block: int) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Decode only one block of encoded postings into (docids, freqs) uint32 arrays.
+    '''
+    count, num_blocks, offset = _read_header(buffer)
+    if num_blocks <= 1:
+        return decode_postings(buffer)
+    last_docids, block_ends = _skip_table(buffer, num_blocks, offset)
+    data_offset = offset + 8 * num_blocks
+    start = int(block_ends[block - 1]) if block > 0 else 0
+    size = min(BLOCK_SIZE, count - block * BLOCK_SIZE)
+    values = decode_varints(memoryview(buffer)[data_offset + start:data_offset + int(block_ends[block])])
+    gaps = values[:size]
+    gaps[0] += int(last_docids[block - 1]) if block > 0 else 0
+    return np.cumsum(gaps).astype(np.uint32), values[size:].astype(np.uint32)
+
+
+def decode_blocks(buffer, blocks) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Decode several blocks of encoded postings, given in increasing order, into (docids, freqs) uint32 arrays, all at
+    once like decode_postings.
+    '''
+    count, num_blocks, offset = _read_header(buffer)
+    if num_blocks <= 1:
+        return decode_postings(buffer) if len(blocks) else (np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32))
+    blocks = np.asarray(blocks, dtype=np.int64)
+    last_docids, block_ends = _skip_table(buffer, num_blocks, offset)
+    block_ends = block_ends.astype(np.int64)
+    starts = np.where(blocks > 0, block_ends[blocks - 1], 0)
+    byte_counts = block_ends[blocks] - starts
+    # the bytes of the blocks, one after the other
+    byte_offsets = np.cumsum(byte_counts) - byte_counts
+    data = np.frombuffer(buffer, dtype=np.uint8, offset=offset + 8 * num_blocks)
+    values = decode_varints(data[np.repeat(starts - byte_offsets, byte_counts) + np.arange(int(byte_counts.sum()))])
+    # every block holds its gaps, then its frequencies
+    sizes = np.minimum(count - blocks * BLOCK_SIZE, BLOCK_SIZE)
+    size_offsets = np.cumsum(sizes) - sizes
+    gap_index = np.repeat(size_offsets, sizes) + np.arange(int(sizes.sum()))
+    freq_index = gap_index + np.repeat(sizes, sizes)
+    gaps = values[gap_index].astype(np.int64)
+    # the first gap of a block is from the last docid of the block before it
+    gaps[size_offsets] += np.where(blocks > 0, last_docids[blocks - 1], 0)
+    docids = np.cumsum(gaps)
+    docids -= np.repeat(docids[size_offsets] - gaps[size_offsets], sizes)
+    return docids.astype(np.uint32), values[freq_index].astype(np.uint32)
+
+
+def _skip_table(buffer, num_blocks: int, offset: int) -> tuple[np.ndarray, np.ndarray]:
+    table = np.frombuffer(buffer, dtype='<u4', count=2 * num_blocks, offset=offset)
+    return table[:num_blocks], table[num_blocks:]
+
+
+class PostingsList:
+    '''
+    The postings of a single term: document ids and term frequencies, sorted by docid once frozen.
+
+    While the index is being built both columns are array('I') so that appending a posting is cheap.
+    freeze() sorts them by docid and compresses them with encode_postings(), which keeps the per-term
+    overhead to a single bytes object. The same bytes are written to postings.bin, so a saved list is used
+    straight from the mapped file. The docids and freqs properties return the columns as NumPy arrays.
+    Iterating or indexing a PostingsList yields (docid, freq) tuples, so it can be used wherever a list of
+    tuples was used before.
+    '''
+    __slots__ = ('_docids', '_freqs', '_data', '_sorted')
+
+    def __init__(self) -> None:
+        self._docids = array('I')
+        self._freqs = array('I')
+        self._data = None
+        # whether the unfrozen docids are in increasing order, None when not known yet
+        self._sorted = True
+
+    @staticmethod
+    def from_postings(postings) -> 'PostingsList':
+        # build a frozen PostingsList from any iterable of (docid, freq) pairs
+        postings_list = PostingsList()
+        for docid, freq in postings:
+            postings_list.append(docid, freq)
+        postings_list.freeze()
+        return postings_list
+
+    @staticmethod
+    def from_buffer(buffer) -> 'PostingsList':
+        # wrap bytes produced by to_bytes(), for example a slice of a mapped index file, without copying them
+        postings_list = PostingsList()
+        postings_list._docids = postings_list._freqs = None
+        postings_list._data = buffer
+        return postings_list
+
+    @staticmethod
+    def from_columns(docids, freqs) -> 'PostingsList':
+        # an unfrozen PostingsList holding copies of the two columns
+        postings_list = PostingsList()
+        postings_list._docids.frombytes(np.asarray(docids, dtype=np.uint32).tobytes())
+        postings_list._freqs.frombytes(np.asarray(freqs, dtype=np.uint32).tobytes())
+        postings_list._sorted = None
+        return postings_list
+
+    def to_bytes(self) -> bytes:
+        if self.frozen:
+            return bytes(self._data)
+        docids, freqs = self._sorted_columns()
+        return encode_postings(docids, freqs)
+
+    @property
+    def frozen(self) -> bool:
+        return self._data is not None
+
+    @property
+    def docids(self) -> np.ndarray:
+        return self.decode()[0]
+
+    @property
+    def freqs(self) -> np.ndarray:
+        return self.decode()[1]
+
+    @property
+    def num_blocks(self) -> int:
+        return _read_header(self._data)[1] if self.frozen else -(-len(self._docids) // BLOCK_SIZE)
+
+    def decode(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the (docids, freqs) columns as uint32 NumPy arrays.
+        '''
+        if self.frozen:
+            return decode_postings(self._data)
+        return np.array(self._docids, dtype=np.uint32), np.array(self._freqs, dtype=np.uint32)
+
+    def decode_block(self, block: int) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the (docids, freqs) of one block of BLOCK_SIZE postings of a frozen list.
+        '''
+        self.freeze()
+        return decode_block(self._data, block)
+
+    def decode_blocks(self, blocks) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the (docids, freqs) of several blocks of BLOCK_SIZE postings of a frozen list, given in increasing order.
+        '''
+        self.freeze()
+        return decode_blocks(self._data, blocks)
+
+    def sorted_docids(self) -> np.ndarray:
+        # the docids column in increasing order, also while unfrozen postings were appended out of order
+        if self.frozen:
+            return self.decode()[0]
+        return self._sorted_columns()[0].copy()
+
+    def docids_near(self, docids: np.ndarray) -> np.ndarray:
+        '''
+        Return the docids of the blocks whose docid range can hold one of several sorted docids, sorted. Only those
+        blocks of a frozen list are decoded, the skip table tells which they are.
+        '''
+        return self.postings_near(docids)[0]
+
+    def postings_near(self, docids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the (docids, freqs) of the blocks whose docid range can hold one of several sorted docids, sorted by
+        docid, like docids_near.
+        '''
+        if not self.frozen:
+            return tuple(column.copy() for column in self._sorted_columns())
+        count, num_blocks, offset = _read_header(self._data)
+        if num_blocks <= 1:
+            return self.decode()
+        last_docids, _ = _skip_table(self._data, num_blocks, offset)
+        blocks = np.unique(np.searchsorted(last_docids, docids))
+        blocks = blocks[blocks < num_blocks]
+        if len(blocks) * 2 > num_blocks:
+            # most blocks are needed, decoding them all at once is faster
+            return self.decode()
+        return decode_blocks(self._data, blocks)
+
+    def _columns(self) -> tuple[list[int], list[int]]:
+        # (docids, freqs) as Python lists, avoiding NumPy for short lists
+        if not self.frozen:
+            return self._docids.tolist(), self._freqs.tolist()
+        if len(self._data) <= SMALL_DECODE:
+            return _decode_postings_small(self._data)
+        docids, freqs = decode_postings(self._data)
+        return docids.tolist(), freqs.tolist()
+
+    def _sorted_columns(self) -> tuple[np.ndarray, np.ndarray]:
+        docids = np.frombuffer(self._docids, dtype=np.uint32)
+        freqs = np.frombuffer(self._freqs, dtype=np.uint32)
+        if len(docids) > 1 and np.any(docids[1:] < docids[:-1]):
+            order = np.argsort(docids, kind='stable')
+            docids, freqs = docids[order], freqs[order]
+        return docids, freqs
+
+    def append(self, docid: int, freq: int) -> None:
+        if self.frozen:
+            self.thaw()
+        if self._sorted and self._docids and docid < self._docids[-1]:
+            self._sorted = False
+        self._docids.append(docid)
+        self._freqs.append(freq)
+
+    def freeze(self) -> None:
+        if self.frozen:
+            return
+        self._data = self.to_bytes()
+        self._docids = self._freqs = None
+
+    def thaw(self) -> None:
+        if not self.frozen:
+            return
+        docids, freqs = self.decode()
+        self._docids, self._freqs = array('I'), array('I')
+        self._docids.frombytes(docids.tobytes())
+        self._freqs.frombytes(freqs.tobytes())
+        self._data = None
+        self._sorted = True
+
+    def find(self, docid: int) -> int:
+        '''
+        Return the position of docid in the postings list, or -1 if the term does not occur in that document.
+        '''
+        return self._lookup(docid)[0]
+
+    def get_freq(self, docid: int) -> int:
+        '''
+        Return the frequency of the term in a document, 0 if it does not occur in it.
+        '''
+        return self._lookup(docid)[1]
+
+    def _lookup(self, docid: int) -> tuple[int, int]:
+        # the position and frequency of docid, (-1, 0) when it is not in the list
+        if not self.frozen:
+            if self._sorted is None:
+                docids = np.frombuffer(self._docids, dtype=np.uint32)
+                self._sorted = not np.any(docids[1:] < docids[:-1])
+            if self._sorted:
+                position = bisect.bisect_left(self._docids, docid)
+                found = position < len(self._docids) and self._docids[position] == docid
+            else:
+                try:
+                    position, found = self._docids.index(docid), True
+                except (ValueError, OverflowError):
+                    found = False
+            return (position, self._freqs[position]) if found else (-1, 0)
+        count, num_blocks, offset = _read_header(self._data)
+        if num_blocks <= 1:
+            docids, freqs = self._columns()
+            position = bisect.bisect_left(docids, docid)
+            return (position, freqs[position]) if position < count and docids[position] == docid else (-1, 0)
+        # only the block whose docid range can hold docid is decoded
+        last_docids, _ = _skip_table(self._data, num_blocks, offset)
+        block = int(np.searchsorted(last_docids, docid))
+        if block == num_blocks:
+            return -1, 0
+        docids, freqs = decode_block(self._data, block)
+        position = int(np.searchsorted(docids, docid))
+        if position < len(docids) and docids[position] == docid:
+            return block * BLOCK_SIZE + position, int(freqs[position])
+        return -1, 0
+
+    def remove(self, docid: int) -> bool:
+        '''
+        Remove the posting of docid. Returns False if there was none.
+        '''
+        position = self.find(docid)
+        if position < 0:
+            return False
+        frozen = self.frozen
+        self.thaw()
+        del self._docids[position]
+        del self._freqs[position]
+        if frozen:
+            self.freeze()
+        return True
+
+    def remove_many(self, docids) -> int:
+        '''
+        Remove the postings of all the given docids in one pass. Returns the number of postings removed.
+        '''
+        if len(self) <= BLOCK_SIZE:
+            docids = docids if isinstance(docids, (set, frozenset)) else set(docids)
+            postings = [posting for posting in zip(*self._columns()) if posting[0] not in docids]
+            removed = len(self) - len(postings)
+            docid_column = np.array([docid for docid, _ in postings], dtype=np.uint32)
+            freq_column = np.array([freq for _, freq in postings], dtype=np.uint32)
+        else:
+            docid_column, freq_column = self.decode()
+            keep = ~np.isin(docid_column, np.fromiter(docids, dtype=np.int64))
+            removed = len(keep) - int(keep.sum())
+            docid_column, freq_column = docid_column[keep], freq_column[keep]
+        if removed:
+            frozen = self.frozen
+            self._docids, self._freqs, self._data = array('I'), array('I'), None
+            # removing postings keeps the order, sorted if frozen
+            self._sorted = True if frozen else self._sorted
+            self._docids.frombytes(docid_column.tobytes())
+            self._freqs.frombytes(freq_column.tobytes())
+            if frozen:
+                self.freeze()
+        return removed
+
+    def __len__(self) -> int:
+        if self.frozen:
+            return _read_header(self._data)[0]
+        return len(self._docids)
+
+    def __iter__(self):
+        return zip(*self._columns())
+
+    def __contains__(self, docid: int) -> bool:
+        return self.find(docid) >= 0
+
+    def __getitem__(self, i):
+        docids, freqs = self._columns()
+        if isinstance(i, slice):
+            return list(zip(docids[i], freqs[i]))
+        return docids[i], freqs[i]
+
+    def __add__(self, other):
+        if isinstance(other, PostingsList):
+            combined = PostingsList()
+            for postings_list in (self, other):
+                docids, freqs = postings_list.decode()
+                combined._docids.frombytes(docids.tobytes())
+                combined._freqs.frombytes(freqs.tobytes())
+            combined._sorted = None
+            if self.frozen and other.frozen:
+                combined.freeze()
+            return combined
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other) -> bool:
+        try:
+            return list(self) == [tuple(posting) for posting in other]
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'PostingsList({list(self)})'
+
+    def __sizeof__(self) -> int:
+        buffers = (self._data,) if self.frozen else (self._docids, self._freqs)
+        return object.__sizeof__(self) + sum(sys.getsizeof(buffer) for buffer in buffers)
+
+
+class PositionalPostingsList:
+    '''
+    The postings of a single term together with the positions of the term in every document, sorted by docid.
+
+    docids and freqs are array('I') columns. The positions of each posting are gap encoded as varints and
+    stored back to back in one bytearray, and offsets holds where the positions of every posting start.
+    Iterating or indexing yields (docid, freq, positions) tuples like the list of tuples it replaces.
+    '''
+    __slots__ = ('docids', 'freqs', 'offsets', 'positions')
+
+    def __init__(self) -> None:
+        self.docids = array('I')
+        self.freqs = array('I')
+        self.offsets = array('I', [0])
+        self.positions = bytearray()
+
+    @staticmethod
+    def _encode_positions(positions, encoded: bytearray) -> None:
+        # append the gaps between the positions to encoded as varints
+        previous = 0
+        for position in positions:
+            gap = position - previous
+            previous = position
+            while gap >= 0x80:
+                encoded.append((gap & 0x7F) | 0x80)
+                gap >>= 7
+            encoded.append(gap)
+
+    def append(self, docid: int, positions: list[int]) -> None:
+        '''
+        Add the posting of a document given the sorted positions of the term in it.
+        '''
+        if not self.docids or docid > self.docids[-1]:
+            self.docids.append(docid)
+            self.freqs.append(len(positions))
+            self._encode_positions(positions, self.positions)
+            self.offsets.append(len(self.positions))
+            return
+        # documents added out of docid order are inserted in place, and a document added again gets the positions of both
+        i = bisect.bisect_left(self.docids, docid)
+        if i < len(self.docids) and self.docids[i] == docid:
+            positions = sorted(self.get_positions(i) + list(positions))
+            self.remove_many({docid})
+            self.append(docid, positions)
+            return
+        encoded = bytearray()
+        self._encode_positions(positions, encoded)
+        start = self.offsets[i]
+        self.docids.insert(i, docid)
+        self.freqs.insert(i, len(positions))
+        self.positions[start:start] = encoded
+        self.offsets.insert(i + 1, start + len(encoded))
+        for j in range(i + 2, len(self.offsets)):
+            self.offsets[j] += len(encoded)
+
+    def find(self, docid: int) -> int:
+        # the docids are always kept sorted, so a binary search finds the position of a document
+        i = bisect.bisect_left(self.docids, docid)
+        return i if i < len(self.docids) and self.docids[i] == docid else -1
+
+    def get_freq(self, docid: int) -> int:
+        i = self.find(docid)
+        return self.freqs[i] if i >= 0 else 0
+
+    def get_positions(self, i: int) -> list[int]:
+        gaps = _decode_varints_small(self.positions[self.offsets[i]:self.offsets[i + 1]])
+        for j in range(1, len(gaps)):
+            gaps[j] += gaps[j - 1]
+        return gaps
+
+    def get_positions_array(self, indices) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the frequencies of the postings at several indices and their positions, one posting after the other,
+        decoding the positions of all of them at once.
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        freqs = np.frombuffer(self.freqs, dtype=np.uint32)[indices].astype(np.int64)
+        offsets = np.frombuffer(self.offsets, dtype=np.uint32).astype(np.int64)
+        starts, lengths = offsets[indices], offsets[indices + 1] - offsets[indices]
+        byte_positions = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        gaps = decode_varints(np.frombuffer(self.positions, dtype=np.uint8)[byte_positions]).astype(np.int64)
+        # positions are the running sum of their gaps, restarted at every posting
+        positions = np.cumsum(gaps)
+        posting_starts = np.cumsum(freqs) - freqs
+        if len(positions):
+            positions -= np.repeat(positions[posting_starts] - gaps[posting_starts], freqs)
+        return freqs, positions
+
+    def remove_many(self, docids) -> int:
+        '''
+        Remove the postings of all the given docids. Returns the number of postings removed.
+        '''
+        kept = [i for i, docid in enumerate(self.docids) if docid not in docids]
+        removed = len(self.docids) - len(kept)
+        if removed:
+            positions = bytearray()
+            offsets = array('I', [0])
+            for i in kept:
+                positions += self.positions[self.offsets[i]:self.offsets[i + 1]]
+                offsets.append(len(positions))
+            self.docids = array('I', [self.docids[i] for i in kept])
+            self.freqs = array('I', [self.freqs[i] for i in kept])
+            self.offsets, self.positions = offsets, positions
+        return removed
+
+    def __len__(self) -> int:
+        return len(self.docids)
+
+    def __iter__(self):
+        for i, (docid, freq) in enumerate(zip(self.docids, self.freqs)):
+            yield docid, freq, self.get_positions(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        i = range(len(self))[i]
+        return self.docids[i], self.freqs[i], self.get_positions(i)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other) -> bool:
+        try:
+            return list(self) == [tuple(posting) for posting in other]
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'PositionalPostingsList({list(self)})'
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sum(sys.getsizeof(column)
+                                             for column in (self.docids, self.freqs, self.offsets, self.positions))
+
+
+class DocumentBitmap:
+    '''
+    A set of docids stored as one bit per docid, used to mark deleted documents.
+    Adding, removing and testing a docid are O(1), and mask() tests a whole array of docids at once.
+    '''
+
+    def __init__(self) -> None:
+        self.bits = np.zeros(0, dtype=np.uint8)
+        self.count = 0
+
+    def add(self, docid: int) -> None:
+        if docid < 0:
+            # a negative docid would shift onto the bit of another document
+            raise ValueError(f"Docids are not negative: {docid}")
+        if docid in self:
+            return
+        if docid >> 3 >= len(self.bits):
+            grown = np.zeros(max((docid >> 3) + 1, 2 * len(self.bits)), dtype=np.uint8)
+            grown[:len(self.bits)] = self.bits
+            self.bits = grown
+        self.bits[docid >> 3] |= 1 << (docid & 7)
+        self.count += 1
+
+    @staticmethod
+    def from_docids(docids) -> 'DocumentBitmap':
+        # the bitmap of distinct docids, all set at once
+        bitmap = DocumentBitmap()
+        docids = np.asarray(docids, dtype=np.int64)
+        if len(docids):
+            if docids.min() < 0:
+                raise ValueError(f"Docids are not negative: {docids.min()}")
+            marked = np.zeros(int(docids.max()) + 1, dtype=bool)
+            marked[docids] = True
+            bitmap.bits = np.packbits(marked, bitorder='little')
+            bitmap.count = int(np.count_nonzero(marked))
+        return bitmap
+
+    def __ior__(self, other: 'DocumentBitmap') -> 'DocumentBitmap':
+        # add every docid of another bitmap
+        if len(other.bits) > len(self.bits):
+            grown = np.zeros(len(other.bits), dtype=np.uint8)
+            grown[:len(self.bits)] = self.bits
+            self.bits = grown
+        self.bits[:len(other.bits)] |= other.bits
+        self.count = int(np.count_nonzero(np.unpackbits(self.bits)))
+        return self
+
+    def discard(self, docid: int) -> None:
+        if docid in self:
+            self.bits[docid >> 3] &= ~(1 << (docid & 7)) & 0xFF
+            self.count -= 1
+
+    def clear(self) -> None:
+        self.bits = np.zeros(0, dtype=np.uint8)
+        self.count = 0
+
+    def mask(self, docids) -> np.ndarray:
+        '''
+        Return a boolean array telling which of the docids are in the bitmap.
+        '''
+        docids = np.asarray(docids, dtype=np.int64)
+        inside = (docids >= 0) & (docids >> 3 < len(self.bits))
+        marked = np.zeros(len(docids), dtype=bool)
+        docids = docids[inside]
+        marked[inside] = (self.bits[docids >> 3] >> (docids & 7)) & 1 == 1
+        return marked
+
+    def __contains__(self, docid: int) -> bool:
+        return 0 <= docid and docid >> 3 < len(self.bits) and bool(self.bits[docid >> 3] >> (docid & 7) & 1)
+
+    def __iter__(self):
+        return iter(np.flatnonzero(np.unpackbits(self.bits, bitorder='little')).tolist())
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def find_frequency(postings, docid: int) -> int:
+    '''
+    Return the frequency of docid in the postings of a term, 0 if the term does not occur in the document.
+
+    PostingsList and PositionalPostingsList are searched through their skip table or with a binary search. Any
+    other sequence of (docid, freq, ...) postings, as returned by the index's get_postings, is sorted by docid and
+    binary searched as well.
+
+    Parameters:
+
+    postings: The postings of a term.
+
+    docid [int]: The document to look for.
+    '''
+    if isinstance(postings, (PostingsList, PositionalPostingsList)):
+        return postings.get_freq(docid)
+    lo, hi = 0, len(postings)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if postings[mid][0] < docid:
+            lo = mid + 1
+        else:
+            hi = mid
+    return postings[lo][1] if lo < len(postings) and postings[lo][0] == docid else 0
+
+
+def gallop(docids, target: int, start: int = 0) -> int:
+    '''
+    Return the first position at or after start whose docid is at least target, len(docids) if there is none.
+
+    The search probes start + 1, start + 2, start + 4, ... until it passes target and then binary searches the last
+    range, so advancing a cursor by d postings costs O(log d) instead of O(d) or O(log n).
+
+    Parameters:
+
+    docids: A sorted sequence of docids, an array('I'), a list or a NumPy array.
+
+    target [int]: The docid to advance to.
+
+    start [int]: The position to search from.
+    '''
+    n = len(docids)
+    if start >= n or docids[start] >= target:
+        return start
+    step = 1
+    lo = start
+    while lo + step < n and docids[lo + step] < target:
+        lo += step
+        step *= 2
+    return bisect.bisect_left(docids, target, lo + 1, min(lo + step, n))
+
+
+def intersect(postings: list) -> np.ndarray:
+    '''
+    Return the docids that are in every one of several postings lists, sorted.
+
+    The lists are intersected shortest first, and every following list is only read where it can hold the docids
+    left. A frozen PostingsList only decodes the blocks whose docid range holds one of them, found in its skip
+    table, so a rare term AND a common term does not decode the whole common list. With a few docids left, a
+    PostingsCursor leapfrogs through the list with galloping advances instead. Other docid columns are probed
+    with a binary search, in O(m log n) for m docids left and n in the column.
+
+    Parameters:
+
+    postings [list]: PostingsLists or sorted docid columns, from InvertedIndex.get_postings_docids for example.
+    '''
+    if not postings:
+        return np.zeros(0, dtype=np.uint32)
+    postings = sorted(postings, key=len)
+    first = postings[0]
+    docids = first.sorted_docids() if isinstance(first, PostingsList) else np.asarray(first)
+    for other in postings[1:]:
+        if len(docids) == 0 or len(other) == 0:
+            return docids[:0]
+        if len(docids) <= SMALL_INTERSECT:
+            cursor = PostingsCursor(other)
+            docids = docids[np.array([cursor.advance(docid) == docid for docid in docids.tolist()], dtype=bool)]
+            continue
+        if isinstance(other, PostingsList):
+            column = other.docids_near(docids)
+        else:
+            column = np.asarray(other)
+        if len(column) == 0:
+            return docids[:0]
+        positions = np.minimum(np.searchsorted(column, docids), len(column) - 1)
+        docids = docids[column[positions] == docids]
+    return docids
+
+
+def difference(docids, excluded) -> np.ndarray:
+    '''
+    Return the docids of a sorted docid column that are not in another sorted column. Every docid is looked up
+    in the excluded column with a binary search, so a NOT costs O(m log n) for m docids and n excluded ones.
+
+    Parameters:
+
+    docids: The sorted docids to keep some of.
+
+    excluded: The sorted docids to remove.
+    '''
+    docids = np.asarray(docids)
+    excluded = np.asarray(excluded)
+    if len(docids) == 0 or len(excluded) == 0:
+        return docids
+    positions = np.minimum(np.searchsorted(excluded, docids), len(excluded) - 1)
+    return docids[excluded[positions] != docids]
+
+
+def _position_keys(freqs: np.ndarray, positions: np.ndarray, stride: int) -> tuple[np.ndarray, np.ndarray]:
+    # the document of every position, and the position as one sorted key per document, stride apart
+    doc_indices = np.repeat(np.arange(len(freqs)), freqs)
+    return doc_indices, doc_indices * stride + positions
+
+
+def phrase_documents(term_positions: list, offsets: list[int]) -> np.ndarray:
+    '''
+    Return which documents hold a phrase, as a boolean array.
+
+    Parameters:
+
+    term_positions [list]: The (freqs, positions) of every phrase term in the same documents, positions holding
+    the sorted positions of each document one document after the other.
+
+    offsets [list[int]]: The offset of every term in the phrase, so that a term at offset i must be at the start
+    position plus i.
+    '''
+    num_docs = len(term_positions[0][0])
+    max_offset = max(offsets)
+    stride = max(int(positions.max()) for _, positions in term_positions) + max_offset + 1
+    # the possible starts of the phrase, shortest position list first, every other one can only remove starts
+    starts = None
+    for i in sorted(range(len(offsets)), key=lambda i: len(term_positions[i][1])):
+        freqs, positions = term_positions[i]
+        _, keys = _position_keys(freqs, positions + (max_offset - offsets[i]), stride)
+        starts = keys if starts is None else np.intersect1d(starts, keys, assume_unique=True)
+    matches = np.zeros(num_docs, dtype=bool)
+    matches[starts // stride] = True
+    return matches
+
+
+def near_documents(left_positions: tuple, right_positions: tuple, distance: int) -> np.ndarray:
+    '''
+    Return which documents hold two terms at most distance positions apart, in either order, as a boolean array.
+
+    Parameters:
+
+    left_positions [tuple]: The (freqs, positions) of the first term, as in phrase_documents.
+
+    right_positions [tuple]: The (freqs, positions) of the second term in the same documents.
+
+    distance [int]: The largest number of positions between the two terms.
+    '''
+    stride = max(int(left_positions[1].max()), int(right_positions[1].max())) + distance + 1
+    doc_indices, left_keys = _position_keys(*left_positions, stride)
+    _, right_keys = _position_keys(*right_positions, stride)
+    # the closest position of the right term before and after every position of the left term
+    after = np.searchsorted(right_keys, left_keys)
+    before = right_keys[np.maximum(after - 1, 0)]
+    after = right_keys[np.minimum(after, len(right_keys) - 1)]
+    near = (np.abs(after - left_keys) <= distance) | (np.abs(left_keys - before) <= distance)
+    matches = np.zeros(len(left_positions[0]), dtype=bool)
+    matches[doc_indices[near]] = True
+    return matches
+
+
+class PostingsCursor:
+    '''
+    A position in the sorted postings of a term for document-at-a-time query evaluation, as in conjunctive and
+    phrase queries. advance() moves forward with a galloping search.
+
+    A frozen PostingsList of several blocks is read through its skip table: advance() gallops over the last
+    docid of every block and only decodes the block the target can be in. Other postings are decoded at once.
+    '''
+    __slots__ = ('postings', 'last_docids', 'block', 'docids', 'freqs', 'position')
+
+    def __init__(self, postings, freqs=None) -> None:
+        '''
+        Parameters:
+
+        postings: A PostingsList, or a sorted docid column.
+
+        freqs: The frequencies of a docid column, None if freq is not needed.
+        '''
+        self.postings = None
+        self.last_docids = None
+        self.block = 0
+        self.position = 0
+        if isinstance(postings, PostingsList):
+            if postings.frozen and postings.num_blocks > 1:
+                count, num_blocks, offset = _read_header(postings._data)
+                self.postings = postings
+                self.last_docids = _skip_table(postings._data, num_blocks, offset)[0].tolist()
+                self._load_block(0)
+                return
+            # copied when unfrozen, since a view would stop the array('I') columns from growing
+            postings, freqs = postings.decode() if postings.frozen else (column.copy() for column in postings._sorted_columns())
+        self.docids = postings
+        self.freqs = freqs
+
+    def _load_block(self, block: int) -> None:
+        self.block = block
+        docids, freqs = self.postings.decode_block(block)
+        self.docids, self.freqs = docids.tolist(), freqs.tolist()
+        self.position = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.position >= len(self.docids)
+
+    @property
+    def docid(self) -> int:
+        # the current docid, None once the cursor is past the last posting
+        return None if self.exhausted else int(self.docids[self.position])
+
+    @property
+    def freq(self) -> int:
+        return int(self.freqs[self.position])
+
+    def next(self) -> int:
+        self.position += 1
+        if self.exhausted and self.last_docids is not None and self.block + 1 < len(self.last_docids):
+            self._load_block(self.block + 1)
+        return self.docid
+
+    def advance(self, target: int) -> int:
+        '''
+        Move to the first posting whose docid is at least target and return that docid, None if there is none.
+        '''
+        if self.last_docids is not None and target > self.last_docids[self.block]:
+            # the blocks in between are skipped without being decoded
+            block = gallop(self.last_docids, target, self.block + 1)
+            if block == len(self.last_docids):
+                self.position = len(self.docids)
+                return None
+            self._load_block(block)
+        self.position = gallop(self.docids, target, self.position)
+        return self.docid
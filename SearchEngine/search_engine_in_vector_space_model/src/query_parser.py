@@ -0,0 +1,218 @@
+'''
+The query syntax of the Ranker on top of plain bag-of-words queries:
+
+"how i met your mother"   a phrase: the documents must contain the words next to each other, in this order
+pizza NEAR/3 york         a proximity: the documents must contain both words at most 3 positions apart, in either order
+a AND b, a OR b, NOT a    boolean operators, NOT binding tighter than AND and AND tighter than OR
+( ... )                   a group
+
+Words next to each other without an operator are combined with the default operator: OR, so that a plain
+query matches the documents of any of its words, or AND for conjunctive queries. Phrases and proximities must
+always match, and the words next to them that are not joined by AND only add to the score. NOT excludes the
+documents of its operand from the clause it is in, a clause that only holds negations matches nothing.
+
+The query only decides which documents match. The words of the whole query that are not negated, without the
+quotes and the operators, are still what the documents are scored with.
+'''
+import re
+
+# a quoted phrase, a parenthesis or a word, a quote without a closing quote is skipped like other punctuation
+QUERY_TOKEN = re.compile(r'"([^"]*)"|([()])|([^\s()"]+)')
+NEAR_OPERATOR = re.compile(r'NEAR/(\d+)$')
+OPERATORS = {'AND', 'OR', 'NOT'}
+
+
+class QueryNode:
+    '''
+    A node of a parsed query: a TERM, PHRASE or NEAR leaf, or an AND, OR or NOT of other nodes.
+    '''
+
+    def __init__(self, operator: str, children: list['QueryNode'] = None, text: str = None, distance: int = None) -> None:
+        self.operator = operator
+        self.children = children or []
+        # the word or the phrase of a TERM or PHRASE leaf
+        self.text = text
+        # the largest distance between the two TERM children of a NEAR leaf
+        self.distance = distance
+
+    def __repr__(self) -> str:
+        if self.operator in ('TERM', 'PHRASE'):
+            return f'{self.operator}({self.text!r})'
+        if self.operator == 'NEAR':
+            return f'NEAR/{self.distance}({self.children[0].text!r}, {self.children[1].text!r})'
+        return f'{self.operator}({", ".join(map(repr, self.children))})'
+
+
+class ParsedQuery:
+    '''
+    A query split into the text that is scored and the tree that decides which documents match.
+    '''
+
+    def __init__(self, text: str, tree: QueryNode = None) -> None:
+        # the words of the query to score the documents with
+        self.text = text
+        # None when the query is a plain bag of words whose words are combined with OR
+        self.tree = tree
+
+    @property
+    def constrained(self) -> bool:
+        return self.tree is not None
+
+
+class _QueryParser:
+    # a recursive descent parser over the tokens of one query, forgiving about misplaced operators and parentheses
+
+    def __init__(self, tokens: list[tuple[str, str]], default_operator: str) -> None:
+        self.tokens = tokens
+        self.position = 0
+        self.default_operator = default_operator
+        # the words and phrases that are not negated, to score the documents with
+        self.words = []
+        self.negated = 0
+
+    def peek(self, ahead: int = 0) -> tuple[str, str]:
+        position = self.position + ahead
+        return self.tokens[position] if position < len(self.tokens) else (None, None)
+
+    def parse_or(self) -> QueryNode:
+        clauses = [self.parse_sequence()]
+        while self.peek() == ('operator', 'OR'):
+            self.position += 1
+            clauses.append(self.parse_sequence())
+        clauses = [clause for clause in clauses if clause is not None]
+        if len(clauses) <= 1:
+            return clauses[0] if clauses else None
+        return QueryNode('OR', clauses)
+
+    def parse_sequence(self) -> QueryNode:
+        # groups of operands joined by AND, the groups joined by the default operator. Phrases, proximities and
+        # negations always constrain the whole sequence.
+        groups, required, negations = [], [], []
+        joined = False
+        # whether the last operand went to required, the words joined to it by AND must match as well
+        last_required = False
+        while True:
+            kind, value = self.peek()
+            if kind is None or value == ')' or (kind, value) == ('operator', 'OR'):
+                break
+            if (kind, value) == ('operator', 'AND'):
+                self.position += 1
+                joined = True
+                continue
+            if (kind, value) == ('operator', 'NOT'):
+                self.position += 1
+                self.negated += 1
+                operand = self.parse_operand()
+                self.negated -= 1
+                if operand is not None:
+                    negations.append(QueryNode('NOT', [operand]))
+                continue
+            operand = self.parse_operand()
+            if operand is None:
+                continue
+            if operand.operator in ('PHRASE', 'NEAR') or (operand.operator == 'AND' and all(child.operator == 'NEAR' for child in operand.children)):
+                if joined and groups and not last_required:
+                    # the group of words before the phrase is joined to it by AND
+                    group = groups.pop()
+                    required.append(group[0] if len(group) == 1 else QueryNode('AND', group))
+                required.append(operand)
+                last_required = True
+            elif joined and last_required:
+                required.append(operand)
+            elif joined and groups:
+                groups[-1].append(operand)
+            else:
+                groups.append([operand])
+                last_required = False
+            joined = False
+
+        if required and self.default_operator == 'OR':
+            # next to a phrase or a proximity, the words that are not joined by AND only add to the score
+            groups = [group for group in groups if len(group) > 1]
+        groups = [group[0] if len(group) == 1 else QueryNode('AND', group) for group in groups]
+        if len(groups) > 1:
+            groups = [QueryNode(self.default_operator, groups)]
+        clauses = groups + required + negations
+        if not clauses:
+            return None
+        if len(clauses) == 1 and clauses[0].operator != 'NOT':
+            return clauses[0]
+        return QueryNode('AND', clauses)
+
+    def parse_operand(self) -> QueryNode:
+        kind, value = self.peek()
+        self.position += 1
+        if value == '(':
+            node = self.parse_or()
+            if self.peek() == ('paren', ')'):
+                self.position += 1
+            return node
+        if kind == 'phrase':
+            if not self.negated:
+                self.words.append(value)
+            return QueryNode('PHRASE', text=value) if value.strip() else None
+        if kind != 'word':
+            # an operator where an operand should be, or a closing parenthesis without an opening one
+            return None
+
+        left = QueryNode('TERM', text=value)
+        if not self.negated:
+            self.words.append(value)
+        # a NEAR b NEAR c is a NEAR b and b NEAR c
+        proximities = []
+        while self.peek()[0] == 'near' and self.peek(1)[0] == 'word':
+            distance = int(self.peek()[1])
+            right = QueryNode('TERM', text=self.peek(1)[1])
+            if not self.negated:
+                self.words.append(right.text)
+            self.position += 2
+            proximities.append(QueryNode('NEAR', [left, right], distance=distance))
+            left = right
+        if not proximities:
+            return left
+        return proximities[0] if len(proximities) == 1 else QueryNode('AND', proximities)
+
+
+def _query_tokens(query: str) -> list[tuple[str, str]]:
+    tokens = []
+    for phrase, paren, word in QUERY_TOKEN.findall(query):
+        if paren:
+            tokens.append(('paren', paren))
+        elif word:
+            near = NEAR_OPERATOR.match(word)
+            if near:
+                tokens.append(('near', near.group(1)))
+            elif word in OPERATORS:
+                tokens.append(('operator', word))
+            else:
+                tokens.append(('word', word))
+        else:
+            tokens.append(('phrase', phrase))
+    return tokens
+
+
+def parse_query(query: str, default_operator: str = 'OR') -> ParsedQuery:
+    '''
+    Split a query into its text and the tree of its phrases, proximities and boolean operators. A plain query
+    whose words are combined with OR has no tree.
+
+    Parameters:
+
+    query [str]: The query as typed by the user.
+
+    default_operator [str]: 'OR' or 'AND', how words without an operator between them are combined.
+    '''
+    if default_operator not in ('OR', 'AND'):
+        raise ValueError(f"The default operator is OR or AND, not {default_operator}")
+    tokens = _query_tokens(query)
+    if default_operator == 'OR' and all(kind == 'word' for kind, _ in tokens):
+        return ParsedQuery(query)
+    parser = _QueryParser(tokens, default_operator)
+    tree = parser.parse_or()
+    # a closing parenthesis without an opening one ends the query early, the rest is parsed as well
+    while parser.position < len(tokens):
+        parser.position += 1
+        rest = parser.parse_or()
+        if rest is not None:
+            tree = rest if tree is None else QueryNode(default_operator, [tree, rest])
+    return ParsedQuery(' '.join(parser.words), tree)
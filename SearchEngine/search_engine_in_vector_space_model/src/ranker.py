@@ -5,20 +5,70 @@ You will be implementing WordCountCosineSimilarity, DirichletLM, TF-IDF, BM25, P
 
 from sample_data import SAMPLE_DOCS  # sample document import
 import math
+import heapq
 from collections import Counter
 import numpy as np
+from scipy import sparse
+from document_preprocessor import Analyzer
+from postings import BLOCK_SIZE, DocumentBitmap, PostingsList, difference, find_frequency, intersect, near_documents, phrase_documents
+from query_parser import QueryNode, parse_query
 
 class Ranker:
     # TODO implement this class properly. This is responsible for returning a list of sorted relevant documents.
-    def __init__(self, index, document_preprocessor, stopword_filtering: bool, scorer: 'RelevanceScorer') -> None:
+
+    # top k queries with prunable scorers skip the documents that cannot make the top k
+    dynamic_pruning = True
+    # how the words of a query are combined when there is no operator between them, 'AND' for conjunctive queries
+    default_operator = 'OR'
+
+    def __init__(self, index, document_preprocessor, stopword_filtering: bool, scorer: 'RelevanceScorer', *,
+                 impact_bits: int = None, posting_budget: int = None) -> None:
+        # impact_bits scores queries score at a time from the index's impact-ordered postings of the scorer, quantized
+        # to that many bits (see impact.py), posting_budget is the number of postings after which such a query
+        # stops reading them, None to read them all
         self.index = index
+        # an Analyzer can be shared by several Rankers and the Indexer, a tokenizer gets an Analyzer of its own
+        if not isinstance(document_preprocessor, Analyzer) or document_preprocessor.stopword_filtering != stopword_filtering:
+            tokenizer = document_preprocessor.tokenizer if isinstance(document_preprocessor, Analyzer) else document_preprocessor
+            document_preprocessor = Analyzer(tokenizer, stopword_filtering)
+        self.analyzer = document_preprocessor
         self.tokenize = document_preprocessor.tokenize
         if isinstance(scorer, type):
             scorer = scorer(index)
         self.scorer = scorer
         self.stopword_filtering = stopword_filtering
+        # the number of postings whose contribution was computed for the last query
+        self.postings_evaluated = 0
+        # the index exported for batch_query, built on its first call
+        self.term_document_matrix = None
+        # an ImpactIndex to score queries with instead of the index's own impacts of the scorer, if any
+        self.impact_index = None
+        self.impact_bits = impact_bits
+        self.posting_budget = posting_budget
+
+    def query(self, query: str, k: int = None) -> list[dict[str, int]]:
+        '''
+        Return the k best documents for a query, sorted by score. All the matching documents are returned if k is None.
+        '''
+        return self.query_top_k(query, k)[0]
+
+    def query_top_k(self, query: str, k: int = None) -> tuple[list[dict[str, int]], int]:
+        '''
+        Score the documents matching a query and select the k best ones, without sorting the whole candidate set.
+        Documents with equal scores are ordered as a full sort would order them, so the result is always the
+        first k results of the full ranking. Quoted phrases, NEAR/k and boolean operators and the default
+        operator (see query_parser.py) decide which documents match, only those are scored.
+
+        Parameters:
+
+        query [str]: The query to search for.
+
+        k [int]: The number of results to return, or None for all of them.
 
-    def query(self, query: str) -> list[dict[str, int]]:
+        Returns:
+
+        The sorted results as [{docid: 100, score: 0.5}, ...] and the total number of matching documents.
+        '''
 
         # 1. Tokenize query
 
@@ -27,36 +77,615 @@ class Ranker:
         # 2. Run RelevanceScorer (like BM25 from below classes) (implemented as relevance classes)
 
         # 3. Return **sorted** results as format [{docid: 100, score:0.5}, {{docid: 10, score:0.2}}]
-        query_parts = self.tokenize(query)
+        parsed_query = parse_query(query, self.default_operator)
+        query_parts = self.tokenize_query(parsed_query.text)
+        # the documents that match the query, None if every document with a query term does
+        matches = self.match_query(parsed_query.tree) if parsed_query.constrained else None
 
-        if self.stopword_filtering:
-            temp = []
-            with open('stopwords.txt', 'r') as f:
-                STOPWORDS = set([line.strip().lower() for line in f])
-        
-                for term in query_parts:
-                    if term is None:
-                        continue
-                    
-                    if term.lower() in STOPWORDS:
-                        temp.append(None)
-                    else:
-                        temp.append(term)
-            query_parts = temp
-        
+        impact_index = self.impact_index
+        if impact_index is None and self.impact_bits is not None:
+            impact_index = self.index.get_impact_index(self.scorer, self.impact_bits)
+        if impact_index is not None:
+            docids, scores, self.postings_evaluated = impact_index.score(self.query_term_weights(query_parts), self.posting_budget)
+            if matches is not None:
+                matching = np.isin(docids, matches)
+                docids, scores = docids[matching], scores[matching]
+            scores = self.scorer.finish_scores(docids, scores, query_parts)
+            order = self.top_k_order(scores, k)
+            results = [{'docid': doc_id, 'score': score} for doc_id, score in zip(docids[order].tolist(), scores[order].tolist())]
+            # the impacts skip the postings past the budget and those that quantize to nothing, so the documents
+            # they scored are not all the matching ones
+            return results, self.count_hits(query_parts, matches)
+
+        if self.scorer.vectorized:
+            if k is not None and self.dynamic_pruning and self.scorer.prunable and matches is None:
+                docids, scores, total_hits = self.score_max_score(query_parts, k)
+            else:
+                docids, scores = self.score_postings_arrays(query_parts, matches)
+                total_hits = len(docids)
+            order = self.top_k_order(scores, k)
+            results = [{'docid': doc_id, 'score': score} for doc_id, score in zip(docids[order].tolist(), scores[order].tolist())]
+            return results, total_hits
+
+        # each term's postings are fetched once and shared by candidate selection and scoring
+        term_postings = {}
         possible_docs = set()
         for term in query_parts:
             if term is None:
                 continue
-            possible_docs.update(doc_id for doc_id, _ in self.index.get_postings(term))
-        
-        results = []
-        for doc_id in possible_docs:
-            score = self.scorer.score(doc_id, query_parts)
-            results.append(score)
+            if term not in term_postings:
+                term_postings[term] = self.index.get_postings(term)
+            possible_docs.update(posting[0] for posting in term_postings[term])
+        self.postings_evaluated = sum(len(postings) for postings in term_postings.values())
+        if matches is not None:
+            possible_docs.intersection_update(matches.tolist())
+
+        if self.scorer.term_at_a_time:
+            scores = self.score_term_at_a_time(query_parts, term_postings)
+            results = [{'docid': doc_id, 'score': scores[doc_id]} for doc_id in possible_docs]
+        else:
+            results = []
+            if possible_docs:
+                # the document-independent work is done once for the query, not once per candidate
+                plan = self.scorer.prepare(query_parts, term_postings)
+                results = [self.scorer.score_plan(doc_id, plan) for doc_id in possible_docs]
 
+        if k is not None and k < len(results):
+            # nlargest orders equal scores like the stable sort below
+            return heapq.nlargest(k, results, key=lambda x: (x['score'])), len(results)
         sorted_results = sorted(results, key=lambda x: (x['score']), reverse=True)
-        return sorted_results
+        return sorted_results, len(results)
+
+    def match_query(self, node: QueryNode, candidates: np.ndarray = None) -> np.ndarray:
+        '''
+        Return the sorted docids of the documents that match a parsed query, or None if it does not restrict them,
+        like a clause of stopwords.
+
+        The operands of an AND are evaluated from the one with the fewest postings to the one with the most, and
+        each operand only looks for the documents that are still left, so that a rare term makes the others cheap:
+        intersect() only decodes the blocks of a saved postings list that can hold the documents left.
+        The documents of a NOT are only looked up among what the other operands matched, and then removed.
+
+        Parameters:
+
+        node [QueryNode]: The query, or a clause of it.
+
+        candidates [np.ndarray]: The sorted docids the matches are restricted to, or None for every document.
+        '''
+        if node.operator == 'TERM':
+            terms = self.analyzed_terms(node.text)
+            if not terms:
+                return None
+            return intersect([self.index.get_postings_docids(term) for term in terms]
+                             + ([candidates] if candidates is not None else []))
+        if node.operator in ('PHRASE', 'NEAR'):
+            return self.match_positions(node, candidates)
+        if node.operator == 'OR':
+            matches = [self.match_query(child, candidates) for child in node.children]
+            matches = [docids for docids in matches if docids is not None]
+            return self.union(matches) if matches else None
+
+        # AND
+        operands = [child for child in node.children if child.operator != 'NOT']
+        negations = [child.children[0] for child in node.children if child.operator == 'NOT']
+        if not operands:
+            # nothing to remove the negated documents from
+            return np.zeros(0, dtype=np.uint32)
+        docids = candidates
+        for child in sorted(operands, key=self.match_cost):
+            if docids is not None and len(docids) == 0:
+                break
+            matches = self.match_query(child, docids)
+            if matches is not None:
+                docids = matches
+        if docids is None:
+            return None
+        for child in negations:
+            if len(docids) == 0:
+                break
+            excluded = self.match_query(child, docids)
+            if excluded is not None:
+                docids = difference(docids, excluded)
+        return docids
+
+    def match_cost(self, node: QueryNode) -> int:
+        # the number of postings a clause has to go through at most, from the document frequencies of its terms
+        if node.operator in ('TERM', 'PHRASE', 'NEAR'):
+            texts = [node.text] if node.operator != 'NEAR' else [child.text for child in node.children]
+            terms = [term for text in texts for term in self.analyzed_terms(text)]
+            return min((self.index.get_term_metadata(term)['document_frequency'] for term in terms), default=0)
+        costs = [self.match_cost(child) for child in node.children if child.operator != 'NOT']
+        if node.operator == 'OR':
+            return sum(costs)
+        return min(costs, default=0)
+
+    def match_positions(self, node: QueryNode, candidates: np.ndarray = None) -> np.ndarray:
+        '''
+        Return the sorted docids of the documents that hold a phrase or a proximity. The docids of their terms are
+        intersected first, shortest postings first, and only the positions of the documents left are merged. An
+        index without positions matches the documents that contain all the terms. Returns None when the phrase
+        only holds stopwords.
+
+        Parameters:
+
+        node [QueryNode]: A PHRASE or NEAR leaf.
+
+        candidates [np.ndarray]: The sorted docids the matches are restricted to, or None for every document.
+        '''
+        # the (offset, term) pairs of the leaf
+        if node.operator == 'PHRASE':
+            terms = [(offset, term) for offset, term in enumerate(self.tokenize_query(node.text)) if term is not None]
+        else:
+            left_terms, right_terms = (self.analyzed_terms(child.text) for child in node.children)
+            terms = [(0, left_terms[-1]), (0, right_terms[0])] if left_terms and right_terms else []
+        if not terms:
+            return None
+        docids = intersect([self.index.get_postings_docids(term) for term in {term for _, term in terms}]
+                           + ([candidates] if candidates is not None else []))
+        if len(terms) < 2 or len(docids) == 0:
+            return docids
+
+        term_positions = {}
+        for _, term in terms:
+            if term not in term_positions:
+                term_positions[term] = self.index.get_term_positions(term, docids)
+        if any(positions is None for positions in term_positions.values()):
+            return docids
+        if node.operator == 'PHRASE':
+            matches = phrase_documents([term_positions[term] for _, term in terms], [offset for offset, _ in terms])
+        else:
+            (_, left), (_, right) = terms
+            matches = near_documents(term_positions[left], term_positions[right], node.distance)
+        return docids[matches]
+
+    def analyzed_terms(self, text: str) -> list[str]:
+        # the query terms of a word or a phrase, without the stopwords
+        return [term for term in self.tokenize_query(text) if term is not None]
+
+    def tokenize_query(self, query: str) -> list[str]:
+        # the query tokens, with None for the stopwords when they are filtered
+        return self.analyzer.analyze_query(query)
+
+    def query_term_weights(self, query_parts: list[str]) -> dict[str, float]:
+        # the scorer's query_weight of every query term, for the scorers that weight terms once per occurrence too
+        term_weights = {}
+        for term, query_term_count in self.scorer.query_terms(query_parts):
+            if term is not None:
+                term_weights[term] = term_weights.get(term, 0) + self.scorer.query_weight(term, query_term_count)
+        return term_weights
+
+    def batch_query(self, queries: list[str], k: int = None) -> list[list[dict[str, int]]]:
+        '''
+        Score many queries at once. With a vectorized scorer the queries become the rows of a sparse query matrix
+        that is multiplied with the TermDocumentMatrix of the index, so every score comes out of one sparse
+        matrix product, and the k best documents of every row are then selected. Quoted phrases, NEAR/k, boolean
+        operators and the default operator restrict the documents of a row with match_query, as they do in query().
+        The results are those of query(), up to the rounding of adding the term contributions in another order.
+        Other scorers run query() per query.
+
+        Parameters:
+
+        queries [list[str]]: The queries to search for.
+
+        k [int]: The number of results to return per query, or None for all of them.
+        '''
+        if not self.scorer.vectorized:
+            return [self.query(query, k) for query in queries]
+        term_document_matrix = self.get_term_document_matrix()
+        matrix = term_document_matrix.matrix
+        parsed_queries = [parse_query(query, self.default_operator) for query in queries]
+        all_query_parts = [self.tokenize_query(parsed_query.text) for parsed_query in parsed_queries]
+
+        # the query matrix: a row per query, a column per term row of the term-document matrix
+        rows, columns, weights = [], [], []
+        for i, query_parts in enumerate(all_query_parts):
+            query_weights = {}
+            for term, weight in self.query_term_weights(query_parts).items():
+                row = term_document_matrix.term_rows.get(term)
+                if row is not None:
+                    query_weights[row] = weight
+            rows.extend([i] * len(query_weights))
+            columns.extend(query_weights)
+            weights.extend(query_weights.values())
+        query_matrix = sparse.csr_matrix((weights, (rows, columns)), shape=(len(queries), matrix.shape[0]))
+        self.postings_evaluated = int(np.diff(matrix.indptr)[query_matrix.indices].sum())
+
+        scores = query_matrix @ matrix
+        scores.sort_indices()
+        if term_document_matrix.nonpositive_weights:
+            # a score that adds up to 0 is dropped by the product, so the matching documents come from the patterns
+            pattern = query_matrix.copy()
+            pattern.data = np.ones(len(pattern.data))
+            hits = pattern @ term_document_matrix.pattern()
+            hits.sort_indices()
+        else:
+            hits = scores
+
+        results = []
+        for i, query_parts in enumerate(all_query_parts):
+            hit_columns = hits.indices[hits.indptr[i]:hits.indptr[i + 1]]
+            score_columns = scores.indices[scores.indptr[i]:scores.indptr[i + 1]]
+            row_scores = np.zeros(len(hit_columns))
+            row_scores[np.searchsorted(hit_columns, score_columns)] = scores.data[scores.indptr[i]:scores.indptr[i + 1]]
+            docids = term_document_matrix.docids[hit_columns]
+            if parsed_queries[i].constrained:
+                # only the documents that match the query's operators are kept
+                matches = self.match_query(parsed_queries[i].tree)
+                if matches is not None:
+                    matching = np.isin(docids, matches)
+                    docids, row_scores = docids[matching], row_scores[matching]
+            row_scores = self.scorer.finish_scores(docids, row_scores, query_parts)
+            order = self.top_k_order(row_scores, k)
+            results.append([{'docid': doc_id, 'score': score} for doc_id, score in zip(docids[order].tolist(), row_scores[order].tolist())])
+        return results
+
+    def get_term_document_matrix(self) -> 'TermDocumentMatrix':
+        # the matrix is built again once the index statistics show that the index changed
+        if self.term_document_matrix is None or self.term_document_matrix.statistics != self.index.get_statistics():
+            self.term_document_matrix = TermDocumentMatrix.from_index(self.index, self.scorer)
+        return self.term_document_matrix
+
+    def count_hits(self, query_parts: list[str], matches: np.ndarray = None) -> int:
+        '''
+        Return the number of documents that match a query, the documents with a query term, without scoring them.
+
+        Parameters:
+
+        query_parts [list[str]]: The query tokens, with None for filtered stopwords.
+
+        matches [np.ndarray]: The sorted docids that match the query's operators, or None if they do not restrict them.
+        '''
+        # the long postings lists are counted from their docid bitmaps, the others from their docids
+        bitmap = DocumentBitmap()
+        term_docids = []
+        for term in set(query_parts) - {None}:
+            term_bitmap = self.index.get_docid_bitmap(term)
+            if term_bitmap is not None:
+                bitmap |= term_bitmap
+                continue
+            docids = self.index.get_postings_docids(term)
+            if isinstance(docids, PostingsList):
+                # only the blocks that can hold a match are decoded
+                docids = docids.sorted_docids() if matches is None else docids.docids_near(matches)
+            term_docids.append(docids)
+        docids = self.union(term_docids) if term_docids else np.zeros(0, dtype=np.uint32)
+        if matches is None:
+            return len(bitmap) + int(np.count_nonzero(~bitmap.mask(docids)))
+        docids = np.intersect1d(docids, matches, assume_unique=True)
+        return int(np.count_nonzero(bitmap.mask(matches))) + int(np.count_nonzero(~bitmap.mask(docids)))
+
+    @staticmethod
+    def union(sorted_docids: list[np.ndarray]) -> np.ndarray:
+        # the sorted union of docid arrays that are each sorted, a stable sort merges the sorted runs quickly
+        docids = np.sort(np.concatenate(sorted_docids), kind='stable')
+        if len(docids) > 1:
+            docids = docids[np.concatenate(([True], docids[1:] != docids[:-1]))]
+        return docids
+
+    @staticmethod
+    def top_k_order(scores: np.ndarray, k: int = None) -> np.ndarray:
+        '''
+        Return the positions of the k largest scores from largest to smallest, with equal scores kept in position order
+        like a stable sort. np.argpartition picks the candidates so only k of them get sorted.
+
+        Parameters:
+
+        scores [np.ndarray]: The scores of the candidates, in docid order.
+
+        k [int]: The number of positions to return, or None for all of them.
+        '''
+        if k is None or k >= len(scores):
+            return np.argsort(-scores, kind='stable')
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        # every score above the k-th largest, then as many of the scores equal to it as fit, the earliest first
+        above = np.flatnonzero(scores > kth_score)
+        tied = np.flatnonzero(scores == kth_score)[:k - len(above)]
+        selected = np.sort(np.concatenate([above, tied]))
+        return selected[np.argsort(-scores[selected], kind='stable')]
+
+    def score_term_at_a_time(self, query_parts: list[str], term_postings: dict) -> dict[int, float]:
+        '''
+        Walk the postings of every query term once and add each term's contribution to a per-document accumulator.
+        Contributions are added in the same order as the scorer's score() adds them, so the scores are identical.
+
+        Parameters:
+
+        query_parts [list[str]]: The query tokens, with None for filtered stopwords.
+
+        term_postings [dict]: The postings of every query term.
+        '''
+        scores = {}
+        for term, query_term_count in self.scorer.query_terms(query_parts):
+            if term not in term_postings:
+                continue
+            for doc_id, contribution in self.scorer.score_term(term, query_term_count, term_postings[term]):
+                scores[doc_id] = scores.get(doc_id, 0) + contribution
+        for doc_id, score in scores.items():
+            scores[doc_id] = self.scorer.finish_score(doc_id, score, query_parts)
+        return scores
+
+    def score_postings_arrays(self, query_parts: list[str], candidates: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Score every candidate document with the scorer's vectorized score_postings, one array expression per query term.
+        The contributions are summed per document in query term order. Returns the (docids, scores) of the candidates
+        sorted by docid.
+
+        Parameters:
+
+        query_parts [list[str]]: The query tokens, with None for filtered stopwords.
+
+        candidates [np.ndarray]: The sorted docids that may be scored, or None to score every document of the query terms.
+        '''
+        term_columns = {}
+        all_docids = []
+        all_contributions = []
+        for term, query_term_count in self.scorer.query_terms(query_parts):
+            if term is None:
+                continue
+            if term not in term_columns:
+                docids, freqs = self.index.get_postings_arrays(term)
+                term_metadata = None
+                if candidates is not None:
+                    # the scorer needs the metadata of the whole postings list, not of the candidates' postings
+                    term_metadata = self.scorer.postings_metadata(freqs)
+                    positions = np.minimum(np.searchsorted(candidates, docids), max(len(candidates) - 1, 0))
+                    kept = candidates[positions] == docids if len(candidates) else np.zeros(len(docids), dtype=bool)
+                    docids, freqs = docids[kept], freqs[kept]
+                term_columns[term] = docids, freqs, self.index.get_doc_lengths(docids), term_metadata
+            docids, freqs, doc_lengths, term_metadata = term_columns[term]
+            if len(docids) == 0:
+                continue
+            all_docids.append(docids)
+            all_contributions.append(self.scorer.score_postings(term, query_term_count, docids, freqs, doc_lengths, term_metadata))
+        self.postings_evaluated = sum(len(docids) for docids in all_docids)
+        if not all_docids:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0)
+        docids, inverse = np.unique(np.concatenate(all_docids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_contributions), minlength=len(docids))
+        return docids, self.scorer.finish_scores(docids, scores, query_parts)
+
+    def score_max_score(self, query_parts: list[str], k: int) -> tuple[np.ndarray, np.ndarray, int]:
+        '''
+        Score a query with MaxScore dynamic pruning. Returns the (docids, scores) of a set of documents, sorted by
+        docid, that holds the k best ones with the same scores as score_postings_arrays, and the number of matching
+        documents.
+
+        Every query term gets an upper bound on its contribution to each block of its postings. A first threshold
+        is the k-th best exact score of the documents in the best blocks of the term with the largest bound. The terms
+        whose bounds add up to less than the threshold are non-essential: a document that only they contain cannot
+        reach the top k, so only the essential terms' postings are decoded and scored in full. Their documents are then
+        looked up in the non-essential terms, largest bound first, dropping every document whose score so far plus the
+        block bounds of the terms left falls below the threshold. A non-essential term's postings are only decoded in
+        the blocks that can hold a document left, found through the skip table, and the matching documents are
+        counted from the index's docid bitmaps.
+
+        Parameters:
+
+        query_parts [list[str]]: The query tokens, with None for filtered stopwords.
+
+        k [int]: The number of best documents that must be kept.
+        '''
+        term_sources = {}
+        terms = []
+        for term, query_term_count in self.scorer.query_terms(query_parts):
+            if term is None:
+                continue
+            if term not in term_sources:
+                # a frozen PostingsList is read block by block, other postings are decoded in full
+                postings = self.index.get_postings(term)
+                if not (isinstance(postings, PostingsList) and postings.frozen):
+                    postings = self.index.get_postings_arrays(term)
+                term_sources[term] = postings, self.index.get_term_metadata(term)
+            postings, term_metadata = term_sources[term]
+            if term_metadata['document_frequency'] == 0:
+                continue
+            block_statistics = self.index.get_block_statistics(term)
+            block_bounds = self.scorer.block_bounds(term, query_term_count, block_statistics, term_metadata)
+            terms.append((term, query_term_count, postings, term_metadata, block_statistics[0], block_bounds))
+        if not terms:
+            self.postings_evaluated = 0
+            return np.zeros(0, dtype=np.uint32), np.zeros(0), 0
+        total_hits = self.count_hits(query_parts)
+        if total_hits <= k:
+            docids, scores = self.score_postings_arrays(query_parts)
+            return docids, scores, total_hits
+        self.postings_evaluated = 0
+
+        def term_postings(i: int, candidates: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+            # the (docids, freqs) of term i, or of the blocks of its postings that can hold one of the candidates
+            postings = terms[i][2]
+            if not isinstance(postings, PostingsList):
+                return postings
+            return postings.decode() if candidates is None else postings.postings_near(candidates)
+
+        def block_docids(i: int, blocks) -> np.ndarray:
+            # the docids of some blocks of the postings of term i
+            postings = terms[i][2]
+            blocks = np.sort(np.asarray(blocks, dtype=np.int64))
+            if isinstance(postings, PostingsList):
+                return postings.decode_blocks(blocks)[0]
+            return np.concatenate([postings[0][block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE] for block in blocks.tolist()])
+
+        def contributions(i: int, candidates: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            # which candidates are in the postings of term i, and the term's contribution to them (0 for the others)
+            term, query_term_count, _, term_metadata, _, _ = terms[i]
+            docids, freqs = term_postings(i, candidates)
+            values = np.zeros(len(candidates))
+            if len(docids) == 0:
+                return np.zeros(len(candidates), dtype=bool), values
+            positions = np.minimum(np.searchsorted(docids, candidates), len(docids) - 1)
+            hits = docids[positions] == candidates
+            if hits.any():
+                hit_docids = candidates[hits]
+                values[hits] = self.scorer.score_postings(term, query_term_count, hit_docids, freqs[positions[hits]],
+                                                          self.index.get_doc_lengths(hit_docids), term_metadata)
+                self.postings_evaluated += int(np.count_nonzero(hits))
+            return hits, values
+
+        def exact_scores(candidates: np.ndarray, term_hits: list, term_values: list) -> np.ndarray:
+            # the contributions added in query term order, like the np.bincount of score_postings_arrays
+            scores = np.zeros(len(candidates))
+            for hits, values in zip(term_hits, term_values):
+                scores[hits] += values[hits]
+            return self.scorer.finish_scores(candidates, scores, query_parts)
+
+        # a term that is not in a document adds nothing, so a term's bound is never below 0
+        upper_bounds = np.array([max(float(block_bounds.max()), 0.0) for *_, block_bounds in terms])
+        by_bound = np.argsort(upper_bounds, kind='stable')
+
+        # the threshold: the k-th best score of the documents in the best blocks of the term with the largest bound
+        _, _, _, term_metadata, _, block_bounds = terms[by_bound[-1]]
+        best_blocks = np.argsort(-block_bounds, kind='stable')
+        block_sizes = np.minimum(term_metadata['document_frequency'] - best_blocks * BLOCK_SIZE, BLOCK_SIZE)
+        num_blocks = int(np.searchsorted(np.cumsum(block_sizes), k)) + 1
+        seeds = np.sort(block_docids(by_bound[-1], best_blocks[:num_blocks]))
+        if len(seeds) < k:
+            # the first documents of every term, at least k of them since more than k documents match
+            first_blocks = -(-k // BLOCK_SIZE)
+            seeds = self.union([block_docids(i, range(min(len(terms[i][4]), first_blocks))) for i in range(len(terms))])
+        seed_contributions = [contributions(i, seeds) for i in range(len(terms))]
+        seed_scores = exact_scores(seeds, *zip(*seed_contributions))
+        threshold = np.partition(seed_scores, len(seed_scores) - k)[len(seed_scores) - k]
+        # bounds are added in another order than the scores, so documents are only dropped below a small margin
+        threshold -= 1e-9 * (1 + abs(threshold))
+
+        # the non-essential terms: the most terms, smallest bounds first, whose bounds add up to less than the threshold
+        bound_sums = np.cumsum(upper_bounds[by_bound])
+        num_non_essential = min(int(np.searchsorted(bound_sums, threshold, side='left')), len(terms) - 1)
+        non_essential = by_bound[:num_non_essential]
+        essential = by_bound[num_non_essential:]
+
+        # only the essential terms' postings are decoded in full, the others only in the blocks of the candidates
+        essential_postings = {i: term_postings(i) for i in essential}
+        candidates = self.union([docids for docids, _ in essential_postings.values()])
+        term_hits, term_values = [None] * len(terms), [None] * len(terms)
+        partial_scores = np.zeros(len(candidates))
+        for i in essential:
+            term, query_term_count, _, term_metadata, _, _ = terms[i]
+            docids, freqs = essential_postings[i]
+            positions = np.searchsorted(candidates, docids)
+            hits = np.zeros(len(candidates), dtype=bool)
+            hits[positions] = True
+            values = np.zeros(len(candidates))
+            values[positions] = self.scorer.score_postings(term, query_term_count, docids, freqs, self.index.get_doc_lengths(docids), term_metadata)
+            self.postings_evaluated += len(docids)
+            term_hits[i], term_values[i] = hits, values
+            partial_scores += values
+
+        # the bound of every non-essential term on each candidate, from the block the candidate would be in
+        remaining_bounds = {}
+        for i in non_essential:
+            last_docids, block_bounds = terms[i][4], terms[i][5]
+            blocks = np.searchsorted(last_docids, candidates)
+            remaining_bounds[i] = np.where(blocks < len(block_bounds), np.maximum(block_bounds[np.minimum(blocks, len(block_bounds) - 1)], 0), 0)
+        remaining = sum(remaining_bounds.values(), np.zeros(len(candidates)))
+
+        for i in non_essential[::-1]:
+            keep = self.scorer.finish_scores(candidates, partial_scores + remaining, query_parts) >= threshold
+            if not keep.all():
+                candidates, partial_scores, remaining = candidates[keep], partial_scores[keep], remaining[keep]
+                remaining_bounds = {j: bounds[keep] for j, bounds in remaining_bounds.items()}
+                for j in essential:
+                    term_hits[j], term_values[j] = term_hits[j][keep], term_values[j][keep]
+                for j in non_essential:
+                    if term_hits[j] is not None:
+                        term_hits[j], term_values[j] = term_hits[j][keep], term_values[j][keep]
+            term_hits[i], term_values[i] = contributions(i, candidates)
+            partial_scores += term_values[i]
+            remaining -= remaining_bounds.pop(i)
+
+        return candidates, exact_scores(candidates, term_hits, term_values), total_hits
+
+class TermDocumentMatrix:
+    '''
+    An index exported as a SciPy CSR matrix with a row per term and a column per document, holding a vectorized
+    scorer's term_weights, so that many queries can be scored with one sparse matrix product (see Ranker.batch_query).
+
+    Attributes:
+
+    matrix [sparse.csr_matrix]: The weight of every term in every document that contains it.
+
+    term_rows [dict[str, int]]: The row of every term.
+
+    docids [np.ndarray]: The docid of every column, sorted.
+
+    doc_lengths [np.ndarray]: The length of every column's document.
+
+    statistics [dict]: The index statistics when the matrix was built.
+
+    nonpositive_weights [bool]: Whether some weights are not above 0, so that a document's score can add up to 0.
+    '''
+    def __init__(self, matrix: sparse.csr_matrix, term_rows: dict[str, int], docids: np.ndarray, doc_lengths: np.ndarray,
+                 statistics: dict) -> None:
+        self.matrix = matrix
+        self.term_rows = term_rows
+        self.docids = docids
+        self.doc_lengths = doc_lengths
+        self.statistics = statistics
+        self.nonpositive_weights = bool(len(matrix.data)) and bool(matrix.data.min() <= 0)
+
+    @classmethod
+    def from_index(cls, index, scorer: 'RelevanceScorer') -> 'TermDocumentMatrix':
+        '''
+        Build the matrix of an index from the postings arrays of all its terms.
+
+        Parameters:
+
+        index [InvertedIndex]: The index to export.
+
+        scorer [RelevanceScorer]: A vectorized scorer whose term_weights fill the matrix.
+        '''
+        terms = sorted(index.vocabulary)
+        term_columns = [index.get_postings_arrays(term) for term in terms]
+        if term_columns:
+            docids = np.unique(np.concatenate([term_docids for term_docids, _ in term_columns]))
+        else:
+            docids = np.zeros(0, dtype=np.uint32)
+        doc_lengths = index.get_doc_lengths(docids)
+
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indices, weights = [], []
+        for row, (term, (term_docids, freqs)) in enumerate(zip(terms, term_columns)):
+            indptr[row + 1] = indptr[row] + len(term_docids)
+            if len(term_docids) == 0:
+                continue
+            columns = np.searchsorted(docids, term_docids)
+            indices.append(columns)
+            weights.append(scorer.term_weights(term, term_docids, freqs, doc_lengths[columns]))
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        weights = np.concatenate(weights) if weights else np.zeros(0)
+        matrix = sparse.csr_matrix((weights, indices, indptr), shape=(len(terms), len(docids)))
+        return cls(matrix, {term: row for row, term in enumerate(terms)}, docids, doc_lengths, index.get_statistics())
+
+    def pattern(self) -> sparse.csr_matrix:
+        # the matrix with a 1 for every posting
+        pattern = self.matrix.copy()
+        pattern.data = np.ones(len(pattern.data))
+        return pattern
+
+
+class QueryPlan:
+    '''
+    The part of scoring a query that is the same for every document, computed once by RelevanceScorer.prepare.
+
+    Attributes:
+
+    query_parts [list[str]]: The query tokens, with None for filtered stopwords.
+
+    terms [list[tuple]]: The query terms as (term, query term count, postings, ...) tuples followed by the
+    scorer's factors for the term, such as its IDF or background probability.
+
+    statistics [dict]: The collection statistics the scorer needs, such as the mean document length.
+    '''
+    __slots__ = ('query_parts', 'terms', 'statistics')
+
+    def __init__(self, query_parts: list[str], terms: list[tuple] = None, statistics: dict = None) -> None:
+        self.query_parts = query_parts
+        self.terms = terms if terms is not None else []
+        self.statistics = statistics if statistics is not None else {}
+
 
 class RelevanceScorer:
     '''
@@ -66,6 +695,9 @@ class RelevanceScorer:
     # TODO Implement the functions in the child classes (WordCountCosineSimilarity, DirichletLM, BM25, PivotedNormalization, TF_IDF) 
     #      and not in this one
     
+    # scorers that implement score_term can be evaluated term at a time by the Ranker
+    term_at_a_time = False
+
     def __init__(self, index, parameters) -> None:
         self.index = index
         self.parameters = parameters
@@ -73,6 +705,107 @@ class RelevanceScorer:
     def score(self, docid: int, query_parts: list[str]) -> dict[str, int]:
         pass
 
+    def prepare(self, query_parts: list[str], term_postings: dict = None) -> QueryPlan:
+        '''
+        Compute the part of score() that does not depend on the document, once per query.
+        Scorers that only implement score() get a plan that score_plan passes back to it.
+
+        Parameters:
+
+        query_parts [list[str]]: The query tokens, with None for filtered stopwords.
+
+        term_postings [dict]: The postings of the query terms that were already fetched, if any.
+        '''
+        return QueryPlan(query_parts)
+
+    def score_plan(self, docid: int, plan: QueryPlan) -> dict[str, int]:
+        # score() for a query prepared by prepare
+        return self.score(docid, plan.query_parts)
+
+    def term_postings(self, term: str, term_postings: dict = None):
+        # the postings of a query term, unless they were already fetched
+        if term_postings is not None and term in term_postings:
+            return term_postings[term]
+        return self.index.get_postings(term)
+
+    def query_terms(self, query_parts: list[str]) -> list[tuple[str, int]]:
+        # the query terms in the order score() adds their contributions, each with its number of occurrences in the query
+        return list(Counter(query_parts).items())
+
+    def score_term(self, term: str, query_term_count: int, postings) -> list[tuple[int, float]]:
+        # the (docid, contribution) of every document in a term's postings, from score_postings for vectorized scorers
+        if not self.vectorized or not len(postings):
+            return []
+        docids = np.fromiter((posting[0] for posting in postings), dtype=np.uint32, count=len(postings))
+        freqs = np.fromiter((posting[1] for posting in postings), dtype=np.uint32, count=len(postings))
+        contributions = self.score_postings(term, query_term_count, docids, freqs, self.index.get_doc_lengths(docids))
+        return list(zip(docids.tolist(), contributions.tolist()))
+
+    def finish_score(self, docid: int, score: float, query_parts: list[str]) -> float:
+        # the final score of a document from the sum of its term contributions
+        return score
+
+    # scorers that implement score_postings score a whole postings list in one NumPy expression
+    vectorized = False
+
+    def score_postings(self, term: str, query_term_count: int, docids: np.ndarray, freqs: np.ndarray,
+                       doc_lengths: np.ndarray, term_metadata: dict = None) -> np.ndarray:
+        # the contributions of a term to the documents in its postings, given their docid, frequency and length columns.
+        # term_metadata is given when only some of the term's postings are passed. From score_term for scorers that are
+        # term at a time, which takes the statistics of the term from the postings it is given, so it gets all of them
+        if not self.term_at_a_time:
+            return np.zeros(len(docids))
+        postings = list(zip(docids.tolist(), freqs.tolist())) if term_metadata is None else self.index.get_postings(term)
+        contributions = dict(self.score_term(term, query_term_count, postings))
+        return np.array([contributions.get(docid, 0.0) for docid in docids.tolist()], dtype=np.float64)
+
+    def finish_scores(self, docids: np.ndarray, scores: np.ndarray, query_parts: list[str]) -> np.ndarray:
+        # finish_score for an array of documents
+        return scores
+
+    def term_weights(self, term: str, docids: np.ndarray, freqs: np.ndarray, doc_lengths: np.ndarray) -> np.ndarray:
+        # the weights of a term in a TermDocumentMatrix: its contribution to a document is the query_weight of its
+        # query term count times its weight in the document
+        return self.score_postings(term, 1, docids, freqs, doc_lengths)
+
+    def query_weight(self, term: str, query_term_count: int) -> float:
+        # the weight of a query term in Ranker.batch_query's query matrix and in impact-ordered scoring
+        return query_term_count
+
+    @staticmethod
+    def postings_metadata(freqs: np.ndarray, term_metadata: dict = None) -> dict[str, int]:
+        # the metadata of a term from its whole postings list, unless it is given
+        if term_metadata is not None:
+            return term_metadata
+        return {'document_frequency': len(freqs), 'total_term_frequency': int(freqs.sum(dtype=np.int64))}
+
+    # vectorized scorers whose term contributions never decrease with the term frequency nor increase with the
+    # document length (or the other way round for both), and whose finish_scores never raises a score, can be
+    # evaluated with MaxScore pruning
+    prunable = False
+
+    def block_bounds(self, term: str, query_term_count: int, block_statistics: tuple, term_metadata: dict) -> np.ndarray:
+        '''
+        Return an upper bound on the contribution of a term to any document of every block of its postings.
+        Since a contribution is monotonic in the term frequency and in the document length, its largest value in
+        a block is at one of the corners of the block's frequency and length ranges.
+
+        Parameters:
+
+        term [str]: The query term.
+
+        query_term_count [int]: The number of occurrences of the term in the query.
+
+        block_statistics [tuple]: The last docids and the frequency and document length ranges of the blocks,
+        from InvertedIndex.get_block_statistics.
+
+        term_metadata [dict]: The document frequency and total term frequency of the term.
+        '''
+        last_docids, min_freqs, max_freqs, min_lengths, max_lengths = block_statistics
+        corners = [self.score_postings(term, query_term_count, last_docids, freqs, lengths, term_metadata)
+                   for freqs in (min_freqs, max_freqs) for lengths in (min_lengths, max_lengths)]
+        return np.maximum.reduce(corners)
+
 
 class SampleScorer(RelevanceScorer):
     def __init__(self, index, parameters) -> None:
@@ -91,15 +824,33 @@ class WordCountCosineSimilarity(RelevanceScorer):
         
         # 2. Return the score
     def score(self, docid: int, query_parts: list[str]) -> dict[str, int]:
+        return self.score_plan(docid, self.prepare(query_parts))
+
+    def prepare(self, query_parts: list[str], term_postings: dict = None) -> QueryPlan:
+        return QueryPlan(query_parts, [(term, 1, self.term_postings(term, term_postings)) for term in query_parts])
+
+    def score_plan(self, docid: int, plan: QueryPlan) -> dict[str, int]:
         score = 0
-        for term in query_parts:
-            postings_list = self.index.get_postings(term)
-            for doc, term_frequency in postings_list:
-                if doc == docid:
-                    score += term_frequency
-                    break
+        for _, _, postings_list in plan.terms:
+            score += find_frequency(postings_list, docid)
         return {'docid': docid, 'score': score} 
 
+    term_at_a_time = True
+
+    def query_terms(self, query_parts: list[str]) -> list[tuple[str, int]]:
+        return [(term, 1) for term in query_parts]
+
+    def score_term(self, term: str, query_term_count: int, postings) -> list[tuple[int, float]]:
+        return [(posting[0], posting[1]) for posting in postings]
+
+    vectorized = True
+
+    def score_postings(self, term: str, query_term_count: int, docids: np.ndarray, freqs: np.ndarray,
+                       doc_lengths: np.ndarray, term_metadata: dict = None) -> np.ndarray:
+        return freqs.astype(np.float64)
+
+    prunable = True
+
 # TODO: Implement DirichletLM
 class DirichletLM(RelevanceScorer):
     def __init__(self, index, parameters: dict = {'mu': 2000}) -> None:
@@ -115,29 +866,60 @@ class DirichletLM(RelevanceScorer):
     # 4. Return the score 
     
     def score(self, docid: int, query_parts: list[str]) -> dict[str, int]:
-        doc_score = 0
+        return self.score_plan(docid, self.prepare(query_parts))
+
+    def prepare(self, query_parts: list[str], term_postings: dict = None) -> QueryPlan:
+        # each term's background probability, scaled by mu
         total_tokens = self.index.get_statistics()['total_token_count']
-        query_tf_dict = dict(Counter(query_parts))
-        
-        for term in query_tf_dict.keys():
-            term_freq_in_doc = self.index.get_postings(term)
-            
-            doc_term_freq = next((freq for doc, freq in term_freq_in_doc if doc == docid), 0)
-            
-            term_freq_in_query = query_tf_dict[term]
-            
+        terms = []
+        for term, term_freq_in_query in Counter(query_parts).items():
             word_prob_in_ref = self.index.get_term_metadata(term)['total_term_frequency'] / total_tokens
             if word_prob_in_ref == 0:
                 continue
-            
-            doc_score += term_freq_in_query * np.log(1 + doc_term_freq / (self.mu * word_prob_in_ref))
+            terms.append((term, term_freq_in_query, self.term_postings(term, term_postings), self.mu * word_prob_in_ref))
+        return QueryPlan(query_parts, terms)
+
+    def score_plan(self, docid: int, plan: QueryPlan) -> dict[str, int]:
+        doc_score = 0
+        for _, term_freq_in_query, term_freq_in_doc, background in plan.terms:
+            doc_term_freq = find_frequency(term_freq_in_doc, docid)
+            doc_score += term_freq_in_query * np.log(1 + doc_term_freq / background)
         
-        query_len = len(query_parts)
-        doc_len = self.index.get_doc_metadata(docid)['length']
+        query_len = len(plan.query_parts)
+        doc_len = self.index.get_doc_length(docid)
         doc_score += query_len * np.log(self.mu / (doc_len + self.mu))
         
         return {"docid": docid, "score": doc_score}
 
+    term_at_a_time = True
+
+    def score_term(self, term: str, query_term_count: int, postings) -> list[tuple[int, float]]:
+        total_tokens = self.index.get_statistics()['total_token_count']
+        word_prob_in_ref = sum(posting[1] for posting in postings) / total_tokens
+        if word_prob_in_ref == 0:
+            return []
+        return [(posting[0], query_term_count * np.log(1 + posting[1] / (self.mu * word_prob_in_ref))) for posting in postings]
+
+    def finish_score(self, docid: int, score: float, query_parts: list[str]) -> float:
+        doc_len = self.index.get_doc_length(docid)
+        return score + len(query_parts) * np.log(self.mu / (doc_len + self.mu))
+
+    vectorized = True
+
+    def score_postings(self, term: str, query_term_count: int, docids: np.ndarray, freqs: np.ndarray,
+                       doc_lengths: np.ndarray, term_metadata: dict = None) -> np.ndarray:
+        total_tokens = self.index.get_statistics()['total_token_count']
+        word_prob_in_ref = self.postings_metadata(freqs, term_metadata)['total_term_frequency'] / total_tokens
+        if word_prob_in_ref == 0:
+            return np.zeros(len(freqs))
+        return query_term_count * np.log(1 + freqs / (self.mu * word_prob_in_ref))
+
+    def finish_scores(self, docids: np.ndarray, scores: np.ndarray, query_parts: list[str]) -> np.ndarray:
+        doc_lens = self.index.get_doc_lengths(docids)
+        return scores + len(query_parts) * np.log(self.mu / (doc_lens + self.mu))
+
+    prunable = True
+
 # TODO: Implement BM25
 class BM25(RelevanceScorer):
     def __init__(self, index, parameters: dict = {'b': 0.75, 'k1': 1.2, 'k3': 8}) -> None:
@@ -153,29 +935,69 @@ class BM25(RelevanceScorer):
 
     # 4. Return the score   
     def score(self, docid: int, query_parts: list[str]) -> dict[str, int]:
-        doc_score = 0
-        query_tf_dict = dict(Counter(query_parts))
+        return self.score_plan(docid, self.prepare(query_parts))
 
-        doc_len = self.index.get_doc_metadata(docid)['length']
-        total_docs = self.index.get_statistics()['number_of_documents']
-        avg_doc_len = (self.index.get_statistics()['mean_document_length']if self.index.get_statistics()['number_of_documents'] != 0 else 0)
-        
-        for term in query_tf_dict.keys():
-            term_freq_in_doc = self.index.get_postings(term)
-            
-            doc_term_freq = next((freq for doc, freq in term_freq_in_doc if doc == docid), 0)
-            
+    def prepare(self, query_parts: list[str], term_postings: dict = None) -> QueryPlan:
+        # each term's IDF (bm_1) and query term frequency factor (bm_3)
+        statistics = self.index.get_statistics()
+        total_docs = statistics['number_of_documents']
+        avg_doc_len = statistics['mean_document_length'] if total_docs != 0 else 0
+        terms = []
+        for term, term_freq_in_query in Counter(query_parts).items():
             doc_freq = self.index.get_term_metadata(term)['document_frequency']
-
-            term_freq_in_query = query_tf_dict[term]
-
             bm_1 = np.log((total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
-            bm_2 = (self.k1 + 1) * doc_term_freq / (self.k1 * (1 - self.b + self.b * doc_len / avg_doc_len) + doc_term_freq)
             bm_3 = (self.k3 + 1) * term_freq_in_query / (self.k3 + term_freq_in_query)
+            terms.append((term, term_freq_in_query, self.term_postings(term, term_postings), bm_1, bm_3))
+        return QueryPlan(query_parts, terms, {'mean_document_length': avg_doc_len})
+
+    def score_plan(self, docid: int, plan: QueryPlan) -> dict[str, int]:
+        doc_score = 0
+        doc_len = self.index.get_doc_length(docid)
+        length_norm = self.k1 * (1 - self.b + self.b * doc_len / plan.statistics['mean_document_length'])
+        
+        for _, _, term_freq_in_doc, bm_1, bm_3 in plan.terms:
+            doc_term_freq = find_frequency(term_freq_in_doc, docid)
+            bm_2 = (self.k1 + 1) * doc_term_freq / (length_norm + doc_term_freq)
             doc_score += bm_1 * bm_2 * bm_3
             
         return {"docid": docid, "score": doc_score}
 
+    term_at_a_time = True
+
+    def score_term(self, term: str, query_term_count: int, postings) -> list[tuple[int, float]]:
+        statistics = self.index.get_statistics()
+        total_docs = statistics['number_of_documents']
+        avg_doc_len = statistics['mean_document_length'] if total_docs != 0 else 0
+        doc_freq = len(postings)
+        bm_1 = np.log((total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        bm_3 = (self.k3 + 1) * query_term_count / (self.k3 + query_term_count)
+        contributions = []
+        for posting in postings:
+            doc_term_freq = posting[1]
+            doc_len = self.index.get_doc_length(posting[0])
+            bm_2 = (self.k1 + 1) * doc_term_freq / (self.k1 * (1 - self.b + self.b * doc_len / avg_doc_len) + doc_term_freq)
+            contributions.append((posting[0], bm_1 * bm_2 * bm_3))
+        return contributions
+
+    vectorized = True
+
+    def score_postings(self, term: str, query_term_count: int, docids: np.ndarray, freqs: np.ndarray,
+                       doc_lengths: np.ndarray, term_metadata: dict = None) -> np.ndarray:
+        statistics = self.index.get_statistics()
+        total_docs = statistics['number_of_documents']
+        avg_doc_len = statistics['mean_document_length'] if total_docs != 0 else 0
+        doc_freq = self.postings_metadata(freqs, term_metadata)['document_frequency']
+        bm_1 = np.log((total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        bm_2 = (self.k1 + 1) * freqs / (self.k1 * (1 - self.b + self.b * doc_lengths / avg_doc_len) + freqs)
+        bm_3 = (self.k3 + 1) * query_term_count / (self.k3 + query_term_count)
+        return bm_1 * bm_2 * bm_3
+
+    def query_weight(self, term: str, query_term_count: int) -> float:
+        # bm_3, which is 1 in the term weights
+        return (self.k3 + 1) * query_term_count / (self.k3 + query_term_count)
+
+    prunable = True
+
 # TODO: Implement Pivoted Normalization
 class PivotedNormalization(RelevanceScorer):
     def __init__(self, index, parameters: dict = {'b': 0.2}) -> None:
@@ -191,28 +1013,66 @@ class PivotedNormalization(RelevanceScorer):
     # 4. Return the score  
     
     def score(self, docid: int, query_parts: list[str]) -> dict[str, int]:
+        return self.score_plan(docid, self.prepare(query_parts))
+
+    def prepare(self, query_parts: list[str], term_postings: dict = None) -> QueryPlan:
+        # the IDF of each term that is in the collection
+        statistics = self.index.get_statistics()
+        total_docs = statistics['number_of_documents']
+        avg_doc_len = statistics['mean_document_length'] if total_docs != 0 else 0
+        terms = []
+        for term, term_freq_in_query in Counter(query_parts).items():
+            doc_count_with_term = self.index.get_term_metadata(term)['document_frequency']
+            if doc_count_with_term == 0:
+                continue
+            idf = np.log((total_docs + 1) / doc_count_with_term)
+            terms.append((term, term_freq_in_query, self.term_postings(term, term_postings), idf))
+        return QueryPlan(query_parts, terms, {'mean_document_length': avg_doc_len})
+
+    def score_plan(self, docid: int, plan: QueryPlan) -> dict[str, int]:
         score = 0
-        query_tf_dict = dict(Counter(query_parts))
-        avg_doc_len = (self.index.get_statistics()['mean_document_length'] if self.index.get_statistics()['number_of_documents'] != 0 else 0)
-        total_docs = self.index.get_statistics()['number_of_documents']
-        doc_len = self.index.get_doc_metadata(docid)['length']
+        doc_len = self.index.get_doc_length(docid)
+        length_norm = 1 - self.b + self.b * doc_len / plan.statistics['mean_document_length']
         
-        for term in query_tf_dict.keys():
-            term_freq_in_doc = self.index.get_postings(term)
-            
-            doc_term_freq = next((freq for doc, freq in term_freq_in_doc if doc == docid), 0)
-            
-            term_freq_in_query = query_tf_dict[term]
-            
-            doc_count_with_term = self.index.get_term_metadata(term)['document_frequency']
-            if doc_count_with_term == 0 or doc_term_freq == 0:
+        for _, term_freq_in_query, term_freq_in_doc, idf in plan.terms:
+            doc_term_freq = find_frequency(term_freq_in_doc, docid)
+            if doc_term_freq == 0:
                 continue
 
-            middle_part = (1 + np.log(1 + np.log(doc_term_freq))) / (1 - self.b + self.b * doc_len / avg_doc_len)
-            score += term_freq_in_query * middle_part * np.log((total_docs + 1) / doc_count_with_term)
+            middle_part = (1 + np.log(1 + np.log(doc_term_freq))) / length_norm
+            score += term_freq_in_query * middle_part * idf
             
         return {"docid": docid, "score": score}
 
+    term_at_a_time = True
+
+    def score_term(self, term: str, query_term_count: int, postings) -> list[tuple[int, float]]:
+        statistics = self.index.get_statistics()
+        total_docs = statistics['number_of_documents']
+        avg_doc_len = statistics['mean_document_length'] if total_docs != 0 else 0
+        doc_count_with_term = len(postings)
+        idf = np.log((total_docs + 1) / doc_count_with_term) if doc_count_with_term else 0
+        contributions = []
+        for posting in postings:
+            doc_term_freq = posting[1]
+            doc_len = self.index.get_doc_length(posting[0])
+            middle_part = (1 + np.log(1 + np.log(doc_term_freq))) / (1 - self.b + self.b * doc_len / avg_doc_len)
+            contributions.append((posting[0], query_term_count * middle_part * idf))
+        return contributions
+
+    vectorized = True
+
+    def score_postings(self, term: str, query_term_count: int, docids: np.ndarray, freqs: np.ndarray,
+                       doc_lengths: np.ndarray, term_metadata: dict = None) -> np.ndarray:
+        statistics = self.index.get_statistics()
+        total_docs = statistics['number_of_documents']
+        avg_doc_len = statistics['mean_document_length'] if total_docs != 0 else 0
+        idf = np.log((total_docs + 1) / self.postings_metadata(freqs, term_metadata)['document_frequency'])
+        middle_part = (1 + np.log(1 + np.log(freqs))) / (1 - self.b + self.b * doc_lengths / avg_doc_len)
+        return query_term_count * middle_part * idf
+
+    prunable = True
+
 
 # TODO: Implement TF-IDF
 class TF_IDF(RelevanceScorer):
@@ -226,16 +1086,46 @@ class TF_IDF(RelevanceScorer):
 
     # 4. Return the score
     def score(self, docid: int, query_parts: list[str]) -> dict[str, int]:
+        return self.score_plan(docid, self.prepare(query_parts))
+
+    def prepare(self, query_parts: list[str], term_postings: dict = None) -> QueryPlan:
+        # the IDF of every query term occurrence, computed once per term
+        idfs = {term: self.index.get_IDF(term) for term in query_parts}
+        return QueryPlan(query_parts, [(term, 1, self.term_postings(term, term_postings), idfs[term]) for term in query_parts])
+
+    def score_plan(self, docid: int, plan: QueryPlan) -> dict[str, int]:
         score = 0
         
-        for term in query_parts:
-            tf = self.index.get_TF(term, docid)
-            idf = self.index.get_IDF(term)
+        for _, _, postings, idf in plan.terms:
+            # the tf of InvertedIndex.get_TF
+            freq = find_frequency(postings, docid)
+            tf = np.log(freq + 1) if freq else 0
             
             score += tf * idf
         
         return {'docid': docid, 'score': score}
 
+    term_at_a_time = True
+
+    def query_terms(self, query_parts: list[str]) -> list[tuple[str, int]]:
+        return [(term, 1) for term in query_parts]
+
+    def score_term(self, term: str, query_term_count: int, postings) -> list[tuple[int, float]]:
+        # the same tf as InvertedIndex.get_TF
+        idf = self.index.get_IDF(term)
+        return [(posting[0], np.log(posting[1] + 1) * idf) for posting in postings]
+
+    vectorized = True
+
+    def score_postings(self, term: str, query_term_count: int, docids: np.ndarray, freqs: np.ndarray,
+                       doc_lengths: np.ndarray, term_metadata: dict = None) -> np.ndarray:
+        # the idf of InvertedIndex.get_IDF, from the postings that are already fetched
+        doc_freq = self.postings_metadata(freqs, term_metadata)['document_frequency']
+        idf = 1 + np.log(self.index.get_statistics()['number_of_documents'] / doc_freq)
+        return np.log(freqs + 1.0) * idf
+
+    prunable = True
+
 # TODO: Implement your own ranker with proper heuristics
 class YourRanker(RelevanceScorer):
     def __init__(self, index, parameters: dict = {'b': 0.75}) -> None:
@@ -243,7 +1133,7 @@ class YourRanker(RelevanceScorer):
         self.b = parameters.get('b', 0.75)
     
     def score(self, docid: int, query_parts: list[str]) -> dict[str, int]:
-        doc_length = self.index.get_doc_metadata(docid).get('length', 0)
+        doc_length = self.index.get_doc_length(docid)
         avg_doc_length = self.index.get_statistics().get('mean_document_length', 0)
         N = self.index.get_statistics().get('number_of_documents', 0)
         
@@ -115,7 +115,7 @@ if __name__ == '__main__':
     # from pipeline import initialize
     # algorithm = initialize()
     # print(run_relevance_tests(algorithm))
-    from document_preprocessor import RegexTokenizer
+    from document_preprocessor import Analyzer, RegexTokenizer
     from indexing import Indexer, IndexType
     from ranker import Ranker, WordCountCosineSimilarity, DirichletLM, BM25, PivotedNormalization, TF_IDF, YourRanker
 
@@ -125,7 +125,8 @@ if __name__ == '__main__':
 
     stopword_filtering = True
 
-    document_preprocessor = RegexTokenizer(MULTIWORD_PATH)
+    # one analyzer for the index and all rankers: the tokenizer and the stopwords are loaded once
+    document_preprocessor = Analyzer(RegexTokenizer(MULTIWORD_PATH), stopword_filtering)
     
     print("step 1")
     
@@ -0,0 +1,406 @@
+'''
+The binary on-disk format of the inverted indexes in indexing.py.
+
+An index folder holds the following files:
+
+lexicon.bin     one fixed size record per term, sorted by term: where the term is in terms.bin,
+                its document frequency, where its postings are in postings.bin and its collection frequency
+terms.bin       the UTF-8 bytes of all terms, back to back, in lexicon order
+postings.bin    the encoded postings of every term, in lexicon order
+doctable.bin    one record per document, sorted by docid: docid, length and number of unique tokens
+statistics.json the collection-wide statistics of the index, the term statistics are in the lexicon
+impacts/        the impact-ordered postings of the scorers that were asked for, see impact.py
+
+The .bin files are opened with mmap, so loading an index only maps the files instead of parsing them,
+and several processes serving the same index share the operating system's page cache.
+Postings are only decoded when a term is looked up.
+'''
+import bisect
+from collections import OrderedDict
+from collections.abc import MutableMapping, MutableSet
+import json
+import mmap
+import os
+import numpy as np
+
+LEXICON_RECORD = np.dtype([('term_offset', '<u8'), ('term_length', '<u4'), ('document_frequency', '<u4'),
+                           ('postings_offset', '<u8'), ('postings_length', '<u8'), ('collection_frequency', '<u8')])
+DOCUMENT_RECORD = np.dtype([('docid', '<u4'), ('length', '<u4'), ('unique_tokens', '<u4')])
+
+
+def open_mmap(path: str):
+    '''
+    Map a file read-only. Returns a memoryview over the mapping (an empty bytes object for empty files, which cannot be mapped).
+    '''
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class IndexFileWriter:
+    '''
+    Writes lexicon.bin, terms.bin and postings.bin in one streaming pass. Terms must be added in sorted order.
+    The files are written under temporary names and only replace the previous index files on close(),
+    so an index can be rewritten while its old files are still mapped.
+    '''
+
+    def __init__(self, index_name: str) -> None:
+        self.index_name = index_name
+        self.files = {name: open(os.path.join(index_name, name + '.tmp'), 'wb')
+                      for name in ('lexicon.bin', 'terms.bin', 'postings.bin')}
+        self.term_offset = 0
+        self.postings_offset = 0
+
+    def add_term(self, term: str, postings: bytes, document_frequency: int, collection_frequency: int) -> None:
+        term_bytes = term.encode('utf-8')
+        record = np.array([(self.term_offset, len(term_bytes), document_frequency, self.postings_offset, len(postings),
+                            collection_frequency)],
+                          dtype=LEXICON_RECORD)
+        self.files['lexicon.bin'].write(record.tobytes())
+        self.files['terms.bin'].write(term_bytes)
+        self.files['postings.bin'].write(postings)
+        self.term_offset += len(term_bytes)
+        self.postings_offset += len(postings)
+
+    def close(self) -> None:
+        for name, file in self.files.items():
+            file.close()
+            os.replace(file.name, os.path.join(self.index_name, name))
+
+    def __enter__(self) -> 'IndexFileWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            for file in self.files.values():
+                file.close()
+                os.remove(file.name)
+
+
+class Lexicon:
+    '''
+    Read-only view of a saved index's terms and postings, backed by mmap.
+    Terms are found with a binary search over the sorted lexicon, so nothing is read into memory up front.
+    '''
+
+    def __init__(self, index_name: str) -> None:
+        self.index_name = index_name
+        lexicon = open_mmap(os.path.join(index_name, 'lexicon.bin'))
+        self.records = np.frombuffer(lexicon, dtype=LEXICON_RECORD)
+        self.terms = open_mmap(os.path.join(index_name, 'terms.bin'))
+        self.postings = open_mmap(os.path.join(index_name, 'postings.bin'))
+        # the same records viewed as 8 and 4 byte integers, since indexing a memoryview is much cheaper than a NumPy record
+        # (assumes a little-endian machine, like the files)
+        self.fields_u8 = memoryview(lexicon).cast('Q')
+        self.fields_u4 = memoryview(lexicon).cast('I')
+
+    def term_bytes(self, i: int) -> bytes:
+        offset = self.fields_u8[5 * i]
+        return bytes(self.terms[offset:offset + self.fields_u4[10 * i + 2]])
+
+    def find(self, term: str) -> int:
+        '''
+        Return the position of the term in the lexicon, or -1 if it is not in the index.
+        '''
+        key = term.encode('utf-8')
+        low, high = 0, len(self.records)
+        while low < high:
+            middle = (low + high) // 2
+            if self.term_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.records) and self.term_bytes(low) == key:
+            return low
+        return -1
+
+    def get_document_frequency(self, term: str) -> int:
+        i = self.find(term)
+        return self.fields_u4[10 * i + 3] if i >= 0 else 0
+
+    def get_term_statistics(self, i: int) -> tuple[int, int]:
+        # the (document frequency, collection frequency) of the i-th term
+        return self.fields_u4[10 * i + 3], self.fields_u8[5 * i + 4]
+
+    def get_postings_buffer(self, i: int):
+        # the encoded postings of the i-th term, as a zero-copy slice of the mapped postings file
+        offset = self.fields_u8[5 * i + 2]
+        return self.postings[offset:offset + self.fields_u8[5 * i + 3]]
+
+    def items(self):
+        # (term, encoded postings) of every term, in sorted order
+        for i in range(len(self.records)):
+            yield self.term_bytes(i).decode('utf-8'), self.get_postings_buffer(i)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, term: str) -> bool:
+        return self.find(term) >= 0
+
+    def __iter__(self):
+        for i in range(len(self.records)):
+            yield self.term_bytes(i).decode('utf-8')
+
+
+class Vocabulary(MutableSet):
+    '''
+    The vocabulary of a loaded index: the terms of its lexicon plus terms added or removed since it was loaded.
+    '''
+
+    def __init__(self, lexicon: Lexicon) -> None:
+        self.lexicon = lexicon
+        self.added = set()
+        self.removed = set()
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.added or (term not in self.removed and term in self.lexicon)
+
+    def __iter__(self):
+        for term in self.lexicon:
+            if term not in self.removed:
+                yield term
+        yield from self.added
+
+    def __len__(self) -> int:
+        return len(self.lexicon) - len(self.removed) + len(self.added)
+
+    def add(self, term: str) -> None:
+        if term not in self:
+            if term in self.removed:
+                self.removed.remove(term)
+            else:
+                self.added.add(term)
+
+    def discard(self, term: str) -> None:
+        if term in self.added:
+            self.added.remove(term)
+        elif term not in self.removed and term in self.lexicon:
+            self.removed.add(term)
+
+
+class DocumentTable(MutableMapping):
+    '''
+    The metadata ({'length', 'unique_tokens'}) of every document in the index, stored column by column.
+
+    Every document gets a dense ordinal when it is added, and its docid, length and number of unique tokens are
+    kept in NumPy columns indexed by that ordinal. Going from an ordinal to a docid is one array index.
+    Going from a docid to an ordinal is a binary search over the leading ordinals whose docids are increasing,
+    which covers a loaded table (saved sorted by docid) and documents added in docid order, plus a dict for
+    the remaining documents. Removed documents keep their ordinal and are flagged in the deleted column.
+    The table still behaves like the dict of dicts it replaces.
+    '''
+
+    def __init__(self, records=None) -> None:
+        records = np.empty(0, dtype=DOCUMENT_RECORD) if records is None else records
+        self.count = len(records)
+        # the columns of a loaded table are views of the mapped file until the table is changed
+        self.docid_column = records['docid']
+        self.length_column = records['length']
+        self.unique_tokens_column = records['unique_tokens']
+        self.deleted = np.zeros(self.count, dtype=bool)
+        self.num_deleted = 0
+        # the first sorted_count ordinals have increasing docids, the docids of the others are in unsorted
+        self.sorted_count = self.count
+        self.unsorted = {}
+
+    @staticmethod
+    def load(index_name: str) -> 'DocumentTable':
+        return DocumentTable(np.frombuffer(open_mmap(os.path.join(index_name, 'doctable.bin')), dtype=DOCUMENT_RECORD))
+
+    def save(self, index_name: str) -> None:
+        live = ~self.deleted[:self.count]
+        records = np.empty(int(live.sum()), dtype=DOCUMENT_RECORD)
+        records['docid'] = self.docids[live]
+        records['length'] = self.lengths[live]
+        records['unique_tokens'] = self.unique_tokens[live]
+        records.sort(order='docid', kind='stable')
+        path = os.path.join(index_name, 'doctable.bin')
+        with open(path + '.tmp', 'wb') as doctable_file:
+            doctable_file.write(records.tobytes())
+        os.replace(path + '.tmp', path)
+
+    @property
+    def docids(self) -> np.ndarray:
+        return self.docid_column[:self.count]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.length_column[:self.count]
+
+    @property
+    def unique_tokens(self) -> np.ndarray:
+        return self.unique_tokens_column[:self.count]
+
+    def ordinal(self, docid: int) -> int:
+        '''
+        Return the ordinal of a document, or -1 if it is not in the table.
+        '''
+        ordinal = self.unsorted.get(docid)
+        if ordinal is None:
+            if not 0 <= docid <= 0xFFFFFFFF:
+                return -1
+            # bisect over a memoryview is much cheaper than np.searchsorted for a single docid
+            docids = memoryview(self.docid_column)
+            ordinal = bisect.bisect_left(docids, docid, 0, self.sorted_count)
+            if ordinal == self.sorted_count or docids[ordinal] != docid:
+                return -1
+        return ordinal if not self.deleted[ordinal] else -1
+
+    def ordinals(self, docids) -> np.ndarray:
+        '''
+        Return the ordinals of many documents at once, with -1 for documents that are not in the table.
+        '''
+        docids = np.asarray(docids, dtype=np.int64)
+        if self.count == 0:
+            return np.full(len(docids), -1, dtype=np.int64)
+        prefix = self.docid_column[:self.sorted_count]
+        in_range = (docids >= 0) & (docids <= 0xFFFFFFFF)
+        ordinals = np.searchsorted(prefix, docids.clip(0, 0xFFFFFFFF).astype(np.uint32)).astype(np.int64)
+        found = in_range & (ordinals < len(prefix))
+        found[found] = prefix[ordinals[found]] == docids[found]
+        ordinals[~found] = -1
+        if self.unsorted:
+            # documents outside the sorted prefix, and removed documents that were added again
+            for i in np.flatnonzero(~found | self.deleted[np.where(found, ordinals, 0)]).tolist():
+                ordinals[i] = self.unsorted.get(int(docids[i]), ordinals[i])
+        ordinals[(ordinals >= 0) & self.deleted[np.maximum(ordinals, 0)]] = -1
+        return ordinals
+
+    def get_length(self, docid: int) -> int:
+        ordinal = self.ordinal(docid)
+        return int(self.length_column[ordinal]) if ordinal >= 0 else 0
+
+    def get_lengths(self, docids) -> np.ndarray:
+        ordinals = self.ordinals(docids)
+        lengths = np.zeros(len(ordinals), dtype=np.int64)
+        lengths[ordinals >= 0] = self.length_column[ordinals[ordinals >= 0]]
+        return lengths
+
+    def total_length(self) -> int:
+        return int(self.lengths[~self.deleted[:self.count]].sum(dtype=np.int64))
+
+    def compact(self) -> None:
+        '''
+        Drop the rows of removed documents. The remaining documents keep their order but get new ordinals.
+        '''
+        if self.num_deleted == 0:
+            return
+        live = ~self.deleted[:self.count]
+        docids = self.docids[live]
+        lengths, unique_tokens = self.lengths[live], self.unique_tokens[live]
+        self.count = len(docids)
+        self.docid_column, self.length_column, self.unique_tokens_column = docids, lengths, unique_tokens
+        self.deleted = np.zeros(self.count, dtype=bool)
+        self.num_deleted = 0
+        # the sorted prefix ends at the first docid that is not larger than the one before it
+        decreasing = np.flatnonzero(docids[1:] <= docids[:-1])
+        self.sorted_count = int(decreasing[0]) + 1 if len(decreasing) else self.count
+        self.unsorted = {docid: self.sorted_count + i for i, docid in enumerate(docids[self.sorted_count:].tolist())}
+
+    def _reserve(self, size: int) -> None:
+        # make the columns writable and large enough for size documents, doubling them when they grow
+        if size <= len(self.docid_column) and self.length_column.flags.writeable:
+            return
+        capacity = max(size, 2 * len(self.docid_column), 16)
+        for name in ('docid_column', 'length_column', 'unique_tokens_column', 'deleted'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            setattr(self, name, grown)
+
+    def __getitem__(self, docid: int) -> dict[str, int]:
+        ordinal = self.ordinal(docid)
+        if ordinal < 0:
+            raise KeyError(docid)
+        return {'length': int(self.length_column[ordinal]), 'unique_tokens': int(self.unique_tokens_column[ordinal])}
+
+    def __setitem__(self, docid: int, meta: dict[str, int]) -> None:
+        ordinal = self.ordinal(docid)
+        if ordinal < 0:
+            ordinal = self.count
+            self._reserve(ordinal + 1)
+            if self.sorted_count == ordinal and (ordinal == 0 or docid > self.docid_column[ordinal - 1]):
+                self.sorted_count += 1
+            else:
+                self.unsorted[docid] = ordinal
+            self.docid_column[ordinal] = docid
+            self.count += 1
+        else:
+            self._reserve(self.count)
+        self.length_column[ordinal] = meta['length']
+        self.unique_tokens_column[ordinal] = meta['unique_tokens']
+
+    def __delitem__(self, docid: int) -> None:
+        ordinal = self.ordinal(docid)
+        if ordinal < 0:
+            raise KeyError(docid)
+        self.deleted[ordinal] = True
+        self.num_deleted += 1
+        self.unsorted.pop(docid, None)
+
+    def __iter__(self):
+        return iter(self.docids[~self.deleted[:self.count]].tolist())
+
+    def __len__(self) -> int:
+        return self.count - self.num_deleted
+
+
+class PostingsCache:
+    '''
+    A least recently used cache of decoded postings lists, bounded by their size in bytes, that counts its hits and misses.
+    '''
+
+    def __init__(self, capacity_bytes: int) -> None:
+        self.capacity_bytes = capacity_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # term -> (postings, size in bytes), from the least to the most recently used
+        self.entries = OrderedDict()
+
+    def get(self, term: str):
+        # the cached postings of a term, or None
+        entry = self.entries.get(term)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(term)
+        return entry[0]
+
+    def put(self, term: str, postings, size: int) -> None:
+        # cache the postings of a term, evicting the least recently used ones to stay within the capacity
+        self.discard(term)
+        if size > self.capacity_bytes:
+            return
+        self.entries[term] = (postings, size)
+        self.size_bytes += size
+        while self.size_bytes > self.capacity_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+
+    def discard(self, term: str) -> None:
+        entry = self.entries.pop(term, None)
+        if entry is not None:
+            self.size_bytes -= entry[1]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def save_statistics(index_name: str, statistics: dict) -> None:
+    with open(os.path.join(index_name, 'statistics.json'), 'w', encoding='utf-8') as statistics_file:
+        json.dump(statistics, statistics_file, ensure_ascii=False)
+
+
+def load_statistics(index_name: str) -> dict:
+    with open(os.path.join(index_name, 'statistics.json'), 'r', encoding='utf-8') as statistics_file:
+        return json.load(statistics_file)
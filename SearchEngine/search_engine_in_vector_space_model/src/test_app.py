@@ -0,0 +1,61 @@
+'''
+Tests of the pagination of the cached search results in app.py, with a search engine that returns fixed results.
+'''
+import asyncio
+
+import pytest
+
+pytest.importorskip('fastapi')
+
+import pipeline
+from models import QueryModel, SearchResponse
+
+
+class FixedSearchEngine:
+    # num_results results, with docids counting down from num_results
+    def __init__(self, num_results: int) -> None:
+        self.num_results = num_results
+
+    def search_top_k(self, query: str, k: int) -> tuple[list[SearchResponse], int]:
+        results = [SearchResponse(id=i + 1, docid=self.num_results - i, score=float(self.num_results - i))
+                   for i in range(self.num_results)]
+        return results[:k], self.num_results
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # app builds the sample index when it is imported, the tests do not need it
+    monkeypatch.setattr(pipeline, 'initialize', lambda: None)
+    import app
+    yield app
+    for timer in app.timer_mgr.values():
+        timer.cancel()
+    app.timer_mgr.clear()
+    app.pagination_cache.clear()
+
+
+def search_pages(app, num_results: int) -> list:
+    app.algorithm = FixedSearchEngine(num_results)
+    first = asyncio.run(app.doSearch(QueryModel(query='q')))
+    pages = [first]
+    while pages[-1].page.next != f'/cache/q/page/{len(pages) - 1}':
+        pages.append(asyncio.run(app.getCache('q', len(pages))))
+    return pages
+
+
+@pytest.mark.parametrize('num_results, num_pages', [(0, 1), (1, 1), (10, 1), (11, 2), (99, 10), (100, 10)])
+def test_last_page_is_not_empty(app, num_results, num_pages):
+    pages = search_pages(app, num_results)
+    # pages are numbered from 0, with 100 results page 9 is the last one
+    assert len(pages) == num_pages
+    assert app.last_page(num_results) == num_pages - 1
+    assert sum(len(page.results) for page in pages) == num_results
+    assert all(page.results for page in pages) or num_results == 0
+    assert all(page.total_hits == num_results for page in pages)
+
+
+def test_pages_past_the_last_one(app):
+    search_pages(app, 100)
+    page = asyncio.run(app.getCache('q', 10))
+    assert [result.docid for result in page.results] == list(range(10, 0, -1))
+    assert page.page.next == '/cache/q/page/9'
@@ -0,0 +1,99 @@
+'''
+Tests of document_preprocessor.py: the multi-word expressions replaced in one pass of the Aho-Corasick automaton
+must give the text that one str.replace pass per expression gives, and the Analyzer caches analyzed queries.
+'''
+import numpy as np
+import pytest
+
+from conftest import MULTI_WORD_EXPRESSIONS
+from document_preprocessor import Analyzer, SplitTokenizer, load_stopwords
+
+# expressions that overlap, contain each other and share their words
+OVERLAPPING_EXPRESSIONS = ['new york', 'new york city', 'york city hall', 'city hall', 'hall of fame', 'new', 'a a',
+                           'a a a', 'of fame hall']
+
+
+def replace_naively(tokenizer, text: str) -> str:
+    # one str.replace pass per expression, longest first, as the tokenizer replaced them before the automaton
+    for expression in sorted(tokenizer.multi_word_expressions, key=len, reverse=True):
+        text = text.replace(expression, expression.replace(' ', '_'))
+    return text
+
+
+def random_texts(expressions: list[str], count: int, seed: int = 0) -> list[str]:
+    # the words of the expressions and a few others, shuffled, so that expressions occur whole, cut and overlapping
+    rng = np.random.default_rng(seed)
+    words = [word for expression in expressions for word in expression.split()] + ['the', 'x', 'York', '']
+    texts = []
+    for _ in range(count):
+        parts = [words[i] for i in rng.integers(0, len(words), int(rng.integers(0, 40)))]
+        parts += [expressions[i] for i in rng.integers(0, len(expressions), 3)]
+        rng.shuffle(parts)
+        texts.append(' '.join(parts))
+    return texts
+
+
+def test_multi_word_expressions_match_naive_replacement():
+    tokenizer = SplitTokenizer(MULTI_WORD_EXPRESSIONS)
+    assert tokenizer.use_automaton
+    expressions = [expression for expression in tokenizer.multi_word_expressions if ' ' in expression]
+    for text in random_texts(expressions, 300) + ['', 'Marine Corps', 'the Marine  Corps', 'Marine Corps Marine Corps']:
+        assert tokenizer.replace_multi_word_expressions(text) == replace_naively(tokenizer, text), text
+
+
+@pytest.mark.parametrize('expressions', [OVERLAPPING_EXPRESSIONS, OVERLAPPING_EXPRESSIONS[::-1], ['snake_case name', 'a b']])
+def test_overlapping_multi_word_expressions_match_naive_replacement(tmp_path, expressions):
+    # expressions with an underscore fall back to the sequential replacement
+    path = tmp_path / 'multi_word_expressions.txt'
+    path.write_text('\n'.join(expressions) + '\n')
+    tokenizer = SplitTokenizer(str(path))
+    assert tokenizer.use_automaton == ('snake_case name' not in expressions)
+    texts = random_texts(expressions, 500, seed=1) + ['new york city hall of fame hall', 'a a a a a', 'new new york']
+    for text in texts:
+        assert tokenizer.replace_multi_word_expressions(text) == replace_naively(tokenizer, text), text
+    text = 'the new york city hall of fame'
+    assert tokenizer.tokenize(text) == [token.replace('_', ' ') for token in replace_naively(tokenizer, text).split()]
+
+
+class CountingTokenizer(SplitTokenizer):
+    # counts the texts it tokenizes
+    def __init__(self, file_path: str) -> None:
+        super().__init__(file_path)
+        self.calls = 0
+
+    def tokenize(self, text: str) -> list[str]:
+        self.calls += 1
+        return super().tokenize(text)
+
+
+def test_analyzer_caches_queries(tmp_path):
+    stopwords = tmp_path / 'stopwords.txt'
+    stopwords.write_text('the\nof\n')
+    tokenizer = CountingTokenizer(MULTI_WORD_EXPRESSIONS)
+    analyzer = Analyzer(tokenizer, stopwords_path=str(stopwords), cache_size=2)
+    assert analyzer.analyze_query('The Marine Corps of Japan') == [None, 'Marine Corps', None, 'Japan']
+    # a repeated query is not tokenized again, and the list it returns can be changed
+    query_parts = analyzer.analyze_query('The Marine Corps of Japan')
+    query_parts.append('changed')
+    assert analyzer.analyze_query('The Marine Corps of Japan') == [None, 'Marine Corps', None, 'Japan']
+    assert tokenizer.calls == 1
+    # the least recently used query is dropped once more than cache_size are kept
+    analyzer.analyze_query('a')
+    analyzer.analyze_query('b')
+    analyzer.analyze_query('The Marine Corps of Japan')
+    assert tokenizer.calls == 4
+    info = analyzer.cache_info()
+    assert info.hits == 2 and info.currsize == 2
+    # documents are tokenized without the cache or the stopword filter
+    assert analyzer.tokenize('the Marine Corps') == ['the', 'Marine Corps']
+    assert tokenizer.calls == 5
+
+
+def test_stopwords_read_once(tmp_path):
+    stopwords = tmp_path / 'stopwords.txt'
+    stopwords.write_text('The\n')
+    first = Analyzer(SplitTokenizer(MULTI_WORD_EXPRESSIONS), stopwords_path=str(stopwords))
+    stopwords.write_text('a\n')
+    second = Analyzer(SplitTokenizer(MULTI_WORD_EXPRESSIONS), stopwords_path=str(stopwords))
+    assert first.stopwords is second.stopwords == load_stopwords(str(stopwords)) == frozenset({'the'})
+    assert Analyzer(SplitTokenizer(MULTI_WORD_EXPRESSIONS), stopword_filtering=False).analyze_query('the a') == ['the', 'a']
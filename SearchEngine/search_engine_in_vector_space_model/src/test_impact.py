@@ -0,0 +1,104 @@
+'''
+Tests of the impact-ordered postings in impact.py, as the Ranker scores with them and as the index saves them.
+'''
+import os
+
+import numpy as np
+import pytest
+
+from conftest import make_documents, make_index
+from impact import ImpactIndex
+from indexing import BasicInvertedIndex
+from ranker import BM25, Ranker, TF_IDF
+
+# terms in fewer than half of the documents, whose BM25 contributions are all positive and so all stored
+QUERIES = ['w10 w13', 'w12', 'w11 w11 w20 w31', 'w15 w16 w17', 'w38 unknown']
+
+
+@pytest.mark.parametrize('scorer_class', [BM25, TF_IDF])
+@pytest.mark.parametrize('bits', [8, 12])
+def test_impact_scores_close_to_exact_scores(tmp_path, analyzer, scorer_class, bits):
+    index = make_index(str(tmp_path / 'index'), make_documents(500))
+    impacts = Ranker(index, analyzer, False, scorer_class(index), impact_bits=bits)
+    exact = Ranker(index, analyzer, False, scorer_class(index))
+    impact_index = index.get_impact_index(impacts.scorer, bits)
+    for query in QUERIES:
+        results = {result['docid']: result['score'] for result in impacts.query(query)}
+        expected = {result['docid']: result['score'] for result in exact.query(query)}
+        assert set(results) == set(expected)
+        # every impact is rounded to the nearest multiple of the scale
+        tolerance = sum(impacts.query_term_weights(analyzer.analyze_query(query)).values()) * impact_index.scale / 2
+        for docid, score in expected.items():
+            assert abs(results[docid] - score) <= tolerance + 1e-9
+
+
+def test_impact_index_is_kept_per_scorer(tmp_path):
+    index = make_index(str(tmp_path / 'index'), make_documents(500))
+    impact_index = index.get_impact_index(BM25(index), 8)
+    assert index.get_impact_index(BM25(index), 8) is impact_index
+    assert index.get_impact_index(BM25(index, {'b': 0.5, 'k1': 1.2, 'k3': 8}), 8) is not impact_index
+    assert index.get_impact_index(BM25(index), 4) is not impact_index
+    assert index.get_impact_index(TF_IDF(index), 8) is not impact_index
+
+
+def test_posting_budget(tmp_path, analyzer):
+    index = make_index(str(tmp_path / 'index'), make_documents(500))
+    ranker = Ranker(index, analyzer, False, BM25(index), impact_bits=8, posting_budget=50)
+    assert len(ranker.query('w10 w12 w13', 10)) == 10
+    assert ranker.postings_evaluated == 50
+
+
+def test_impact_index_saved_with_the_index(tmp_path, analyzer):
+    index = make_index(str(tmp_path / 'index'), make_documents(500))
+    ranker = Ranker(index, analyzer, False, BM25(index), impact_bits=8)
+    expected = [ranker.query(query) for query in QUERIES]
+    index.save()
+    assert os.listdir(os.path.join(index.index_name, 'impacts'))
+
+    loaded = BasicInvertedIndex(index.index_name)
+    loaded.load()
+    impact_index = loaded.get_impact_index(BM25(loaded), 8)
+    # loaded from the index folder, not computed again
+    assert isinstance(impact_index.docids, np.memmap)
+    ranker = Ranker(loaded, analyzer, False, BM25(loaded), impact_bits=8)
+    assert [ranker.query(query) for query in QUERIES] == expected
+
+
+def test_impact_index_follows_index_changes(tmp_path, analyzer):
+    documents = make_documents(500)
+    index = make_index(str(tmp_path / 'index'), documents)
+    ranker = Ranker(index, analyzer, False, BM25(index), impact_bits=8)
+    ranker.query('w12')
+    index.save()
+
+    loaded = BasicInvertedIndex(index.index_name)
+    loaded.load()
+    ranker = Ranker(loaded, analyzer, False, BM25(loaded), impact_bits=8)
+    loaded.add_doc(1000, ['w12', 'w12', 'w12'])
+    loaded.remove_docs([docid for docid, tokens in documents.items() if 'w12' in tokens][:3])
+    exact = Ranker(loaded, analyzer, False, BM25(loaded))
+    assert {result['docid'] for result in ranker.query('w12')} == {result['docid'] for result in exact.query('w12')}
+
+    # the impacts saved before the change are replaced when the index is saved again
+    loaded.save()
+    reloaded = BasicInvertedIndex(index.index_name)
+    reloaded.load()
+    ranker = Ranker(reloaded, analyzer, False, BM25(reloaded), impact_bits=8)
+    assert 1000 in {result['docid'] for result in ranker.query('w12')}
+
+
+def test_explicit_impact_index(tmp_path, analyzer):
+    index = make_index(str(tmp_path / 'index'), make_documents(500))
+    ranker = Ranker(index, analyzer, False, BM25(index))
+    ranker.impact_index = ImpactIndex.from_index(index, ranker.scorer, 8)
+    assert ranker.query('w10 w13') == Ranker(index, analyzer, False, BM25(index), impact_bits=8).query('w10 w13')
+
+
+@pytest.mark.parametrize('posting_budget', [None, 50])
+def test_impact_total_hits(tmp_path, analyzer, posting_budget):
+    # the documents that match, also those of terms with no stored impacts and those past the budget
+    index = make_index(str(tmp_path / 'index'), make_documents(500))
+    impacts = Ranker(index, analyzer, False, BM25(index), impact_bits=8, posting_budget=posting_budget)
+    exact = Ranker(index, analyzer, False, BM25(index))
+    for query in QUERIES + ['w0 w10', 'w0', 'w10 AND w13', 'w12 NOT w0', 'w15 OR (w16 AND w17)']:
+        assert impacts.query_top_k(query, 10)[1] == exact.query_top_k(query, 10)[1], query
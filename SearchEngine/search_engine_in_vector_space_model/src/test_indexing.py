@@ -0,0 +1,304 @@
+'''
+Tests of the index classes in indexing.py: removed documents, the running statistics kept as documents are added
+and removed, and the postings written to and read from disk, across saves and loads, and the indexes that
+Indexer.create_index builds with its options.
+'''
+import json
+import os
+from collections import Counter
+
+import pytest
+
+from conftest import MULTI_WORD_EXPRESSIONS, make_documents
+from document_preprocessor import SplitTokenizer
+from indexing import BasicInvertedIndex, Indexer, IndexType, OnDiskInvertedIndex, PositionalInvertedIndex
+from storage import PostingsCache
+
+INDEX_CLASSES = [BasicInvertedIndex, PositionalInvertedIndex, OnDiskInvertedIndex]
+INDEX_TYPES = [IndexType.InvertedIndex, IndexType.PositionalIndex, IndexType.OnDiskInvertedIndex]
+DOCUMENTS = {docid: [f'w{(docid * 7 + i) % 23}' for i in range(3 + docid % 11)] for docid in range(1, 301)}
+
+
+def check_statistics(index) -> None:
+    # the running statistics are the ones counted again from the postings
+    for term in [f'w{i}' for i in range(23)] + ['new', 'unknown']:
+        postings = index.get_postings(term)
+        expected = {'document_frequency': len(postings), 'total_term_frequency': sum(posting[1] for posting in postings)}
+        assert index.get_term_metadata(term) == expected, term
+    statistics = index.get_statistics()
+    assert statistics['number_of_documents'] == len(index.document_metadata)
+    assert statistics['total_token_count'] == sum(index.get_doc_length(docid) for docid in index.document_metadata)
+
+
+@pytest.mark.parametrize('index_class', INDEX_CLASSES)
+def test_running_statistics_match_a_recount(tmp_path, index_class):
+    index = index_class(str(tmp_path / 'index'))
+    index.compaction_threshold = 1.0
+    for docid, tokens in DOCUMENTS.items():
+        index.add_doc(docid, tokens)
+    index.freeze()
+    index.remove_docs(range(1, 301, 5))
+    check_statistics(index)
+    index.save()
+    check_statistics(index)
+
+    loaded = index_class(index.index_name)
+    loaded.load()
+    check_statistics(loaded)
+    # changed after the load, over the saved statistics, and saved again
+    loaded.remove_docs(range(2, 301, 7))
+    loaded.add_doc(1000, ['new', 'w0', 'w0'])
+    loaded.freeze()
+    check_statistics(loaded)
+    loaded.save()
+    check_statistics(loaded)
+    reloaded = index_class(index.index_name)
+    reloaded.load()
+    check_statistics(reloaded)
+
+
+@pytest.mark.parametrize('index_class', [BasicInvertedIndex, PositionalInvertedIndex])
+def test_term_statistics_are_not_in_statistics_json(tmp_path, index_class):
+    # they are in the lexicon, so that loading an index does not read a record per term
+    index = index_class(str(tmp_path / 'index'))
+    for docid, tokens in DOCUMENTS.items():
+        index.add_doc(docid, tokens)
+    index.freeze()
+    index.save()
+    with open(os.path.join(index.index_name, 'statistics.json')) as statistics_file:
+        assert 'vocab' not in json.load(statistics_file)
+
+    loaded = index_class(index.index_name)
+    loaded.load()
+    assert not loaded.term_statistics
+    check_statistics(loaded)
+    assert not loaded.term_statistics
+
+
+@pytest.mark.parametrize('index_class', INDEX_CLASSES)
+def test_statistics_counted_again_after_a_document_is_added_twice(tmp_path, index_class):
+    # adding a document again without removing it keeps its old postings, the term statistics are counted again
+    index = index_class(str(tmp_path / 'index'))
+    for docid, tokens in list(DOCUMENTS.items())[:50]:
+        index.add_doc(docid, tokens)
+    index.add_doc(3, DOCUMENTS[4])
+    index.freeze()
+    assert not index.term_statistics_exact
+    check_statistics(index)
+    index.save()
+    assert index.term_statistics_exact
+    check_statistics(index)
+
+
+@pytest.mark.parametrize('index_class', INDEX_CLASSES)
+def test_removed_documents_round_trip(tmp_path, index_class):
+    index = index_class(str(tmp_path / 'index'))
+    # removed documents stay out of the index while they are tombstones, after a save and after a load
+    index.compaction_threshold = 1.0
+    for docid, tokens in DOCUMENTS.items():
+        index.add_doc(docid, tokens)
+    index.freeze()
+    removed = set(range(1, 301, 3))
+    index.remove_docs(removed)
+    assert index.tombstones
+
+    def check(index) -> None:
+        live = set(DOCUMENTS) - removed
+        assert set(index.document_metadata) == live
+        assert index.get_statistics()['number_of_documents'] == len(live)
+        for term in ['w0', 'w5', 'w22']:
+            expected = sorted((docid, DOCUMENTS[docid].count(term)) for docid in live if term in DOCUMENTS[docid])
+            postings = index.get_postings(term)
+            assert [tuple(posting[:2]) for posting in postings] == expected
+            assert index.get_term_metadata(term)['document_frequency'] == len(expected)
+
+    check(index)
+    index.save()
+    check(index)
+    loaded = index_class(index.index_name)
+    loaded.load()
+    assert not loaded.tombstones
+    check(loaded)
+
+
+@pytest.mark.parametrize('index_class', INDEX_CLASSES)
+def test_removing_documents_reads_no_postings(tmp_path, index_class, monkeypatch):
+    # the statistics of the removed documents' terms are taken from the forward index
+    index = index_class(str(tmp_path / 'index'))
+    index.compaction_threshold = 1.0
+    for docid, tokens in DOCUMENTS.items():
+        index.add_doc(docid, tokens)
+    index.freeze()
+    index.remove_docs([1, 2])
+
+    def read_postings(*args):
+        raise AssertionError('postings read')
+
+    with monkeypatch.context() as patch:
+        for name in ['get_postings', 'get_term_frequency', '_read_postings']:
+            if hasattr(index, name):
+                patch.setattr(index, name, read_postings)
+        index.remove_docs(range(3, 301, 4))
+    check_statistics(index)
+
+
+@pytest.mark.parametrize('index_class', INDEX_CLASSES)
+@pytest.mark.parametrize('forward_index', [True, False])
+def test_compaction_rewrites_the_removed_documents_terms(tmp_path, index_class, forward_index, monkeypatch):
+    # with the forward index only the postings lists of the removed documents' terms are rewritten, without it
+    # every term's are
+    index = index_class(str(tmp_path / 'index'), forward_index=forward_index)
+    index.compaction_threshold = 1.0
+    for docid, tokens in DOCUMENTS.items():
+        index.add_doc(docid, tokens)
+    index.freeze()
+    rewritten = []
+    remove_postings = index._remove_postings
+    monkeypatch.setattr(index, '_remove_postings', lambda terms, docids: rewritten.extend(terms) or remove_postings(terms, docids))
+    index.remove_docs([1, 2])
+    index.compact()
+    expected = set(DOCUMENTS[1] + DOCUMENTS[2]) if forward_index else {f'w{i}' for i in range(23)}
+    assert set(rewritten) == expected
+    for term in expected:
+        assert not {1, 2} & {posting[0] for posting in index.get_postings(term)}
+    check_statistics(index)
+
+
+@pytest.mark.parametrize('index_class', INDEX_CLASSES)
+def test_document_added_again_is_removed(tmp_path, index_class):
+    # a document added twice without being removed is not in the forward index, its removal scans the terms
+    index = index_class(str(tmp_path / 'index'))
+    index.compaction_threshold = 1.0
+    for docid, tokens in list(DOCUMENTS.items())[:50]:
+        index.add_doc(docid, tokens)
+    index.add_doc(3, ['new', 'w0', 'w0'])
+    index.freeze()
+    index.remove_docs([3, 4])
+    for term in ['new', 'w0']:
+        assert 3 not in [posting[0] for posting in index.get_postings(term)]
+    check_statistics(index)
+
+
+@pytest.mark.parametrize('write_batch_size', [7, 40, 1000])
+def test_on_disk_batched_writes(tmp_path, write_batch_size):
+    # the postings written in batches, read between them and after they are joined, are those of one batch
+    expected = OnDiskInvertedIndex(str(tmp_path / 'expected'))
+    expected.write_batch_size = 10 ** 6
+    index = OnDiskInvertedIndex(str(tmp_path / 'index'))
+    index.write_batch_size = write_batch_size
+    for docid, tokens in DOCUMENTS.items():
+        expected.add_doc(docid, tokens)
+        index.add_doc(docid, tokens)
+        if docid % 50 == 0:
+            assert list(index.get_postings('w3')) == [posting for posting in expected.get_postings('w3')]
+    # a document added again has the frequencies of both times
+    expected.add_doc(5, ['w0', 'w1'])
+    index.add_doc(5, ['w0', 'w1'])
+    assert index.get_term_frequency('w0', 5) == DOCUMENTS[5].count('w0') + 1
+    expected.freeze()
+    index.freeze()
+    assert not index.postings_chunks
+    for term in [f'w{i}' for i in range(23)]:
+        assert list(index.get_postings(term)) == list(expected.get_postings(term))
+
+
+@pytest.mark.parametrize('cache_bytes', [64 << 20, 2000])
+def test_on_disk_reads_through_the_postings_cache(tmp_path, cache_bytes):
+    # the postings read from the database are those of an index kept in memory, a term read again comes from the
+    # cache while it fits
+    expected = BasicInvertedIndex(str(tmp_path / 'expected'))
+    index = OnDiskInvertedIndex(str(tmp_path / 'index'))
+    for docid, tokens in DOCUMENTS.items():
+        expected.add_doc(docid, tokens)
+        index.add_doc(docid, tokens)
+    index.save()
+    loaded = OnDiskInvertedIndex(index.index_name)
+    loaded.postings_cache = PostingsCache(cache_bytes)
+    loaded.load()
+    terms = [f'w{i}' for i in range(23)]
+    for _ in range(2):
+        for term in terms:
+            assert list(loaded.get_postings(term)) == list(expected.get_postings(term)), term
+            assert loaded.postings_cache.size_bytes <= cache_bytes
+    assert loaded.get_postings('unknown') == []
+    cache = loaded.postings_cache
+    if cache_bytes > 2000:
+        assert cache.misses == len(terms) and cache.hits == len(terms)
+    else:
+        assert cache.hits < len(terms)
+
+
+def test_positional_saved_postings_are_cached(tmp_path):
+    index = PositionalInvertedIndex(str(tmp_path / 'index'))
+    for docid, tokens in DOCUMENTS.items():
+        index.add_doc(docid, tokens)
+    index.save()
+    loaded = PositionalInvertedIndex(index.index_name)
+    loaded.load()
+    postings = loaded.get_saved_postings('w3')
+    assert postings == list(index.get_postings('w3'))
+    assert loaded.get_saved_postings('w3') is postings
+    assert loaded.saved_postings_cache.hits == 1
+
+
+def write_dataset(path, documents: dict[int, list[str]]) -> str:
+    # the documents as a JSONL dataset, one {"docid", "text"} object per line
+    with open(path, 'w', encoding='utf-8') as file:
+        for docid, tokens in documents.items():
+            file.write(json.dumps({'docid': docid, 'text': ' '.join(tokens)}) + '\n')
+    return str(path)
+
+
+def index_contents(index) -> tuple[dict, dict, dict]:
+    # everything an index answers: the postings of every term, the document metadata and the statistics
+    postings = {term: list(index.get_postings(term)) for term in index.vocabulary}
+    return postings, {docid: index.get_doc_metadata(docid) for docid in index.document_metadata}, index.get_statistics()
+
+
+@pytest.mark.parametrize('index_type', INDEX_TYPES)
+def test_parallel_tokenization_builds_the_serial_index(tmp_path, index_type):
+    dataset = write_dataset(tmp_path / 'dataset.jsonl', make_documents(300))
+    tokenizer = SplitTokenizer(MULTI_WORD_EXPRESSIONS)
+    serial = Indexer.create_index(str(tmp_path / 'serial'), index_type, dataset, tokenizer, False, 2)
+    # batches that do not divide the number of documents, so that the last one is cut short
+    parallel = Indexer.create_index(str(tmp_path / 'parallel'), index_type, dataset, tokenizer, False, 2,
+                                    num_workers=2, batch_size=7)
+    assert index_contents(parallel) == index_contents(serial)
+
+
+@pytest.mark.parametrize('index_type', INDEX_TYPES)
+def test_memory_budget_builds_the_in_memory_index(tmp_path, index_type, monkeypatch):
+    # the segments flushed whenever the budget is reached are merged into the index built in memory
+    dataset = write_dataset(tmp_path / 'dataset.jsonl', make_documents(300))
+    tokenizer = SplitTokenizer(MULTI_WORD_EXPRESSIONS)
+    expected = Indexer.create_index(str(tmp_path / 'expected'), index_type, dataset, tokenizer, False, 0)
+    flushes = []
+    for index_class in INDEX_CLASSES:
+        flush_to_disk = index_class.flush_to_disk
+        monkeypatch.setattr(index_class, 'flush_to_disk', lambda self, flush_to_disk=flush_to_disk: flushes.append(1) or flush_to_disk(self))
+    index = Indexer.create_index(str(tmp_path / 'index'), index_type, dataset, tokenizer, False, 0, memory_budget=20000)
+    assert len(flushes) > 3
+    assert not [name for name in os.listdir(index.index_name) if name.startswith('segment_')]
+    assert index_contents(index) == index_contents(expected)
+
+    loaded = type(index)(index.index_name)
+    loaded.load()
+    assert index_contents(loaded) == index_contents(expected)
+
+
+@pytest.mark.parametrize('index_type', INDEX_TYPES)
+def test_minimum_collection_frequency(tmp_path, index_type):
+    # only the terms that occur often enough in the whole collection are indexed, with all their postings
+    documents = make_documents(300, vocabulary=400)
+    counts = Counter(token for tokens in documents.values() for token in tokens)
+    dataset = write_dataset(tmp_path / 'dataset.jsonl', documents)
+    tokenizer = SplitTokenizer(MULTI_WORD_EXPRESSIONS)
+    full = Indexer.create_index(str(tmp_path / 'full'), index_type, dataset, tokenizer, False, 0)
+    pruned = Indexer.create_index(str(tmp_path / 'pruned'), index_type, dataset, tokenizer, False, 0, minimum_collection_frequency=5)
+    frequent = {term for term, count in counts.items() if count >= 5}
+    assert 0 < len(frequent) < len(counts)
+    assert set(pruned.vocabulary) == frequent
+    for term in counts:
+        assert list(pruned.get_postings(term)) == (list(full.get_postings(term)) if term in frequent else []), term
+    # the pruned terms still count in the document lengths, like stopwords
+    assert {docid: pruned.get_doc_length(docid) for docid in documents} == {docid: full.get_doc_length(docid) for docid in documents}
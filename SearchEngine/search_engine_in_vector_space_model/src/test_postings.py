@@ -0,0 +1,200 @@
+'''
+Round-trip tests of the postings codec in postings.py and of the lookups that read it block by block.
+'''
+import numpy as np
+import pytest
+
+from postings import (BLOCK_SIZE, DocumentBitmap, PositionalPostingsList, PostingsCursor, PostingsList, decode_block,
+                      decode_blocks, decode_postings, decode_varints, encode_postings, encode_varints, gallop, intersect)
+
+# the list lengths around the block boundaries, where the skip table starts and where a block is cut short
+LENGTHS = [0, 1, 2, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 2 * BLOCK_SIZE, 2 * BLOCK_SIZE + 1, 1000]
+
+
+def make_postings(count: int, seed: int = 0, max_gap: int = 50) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    docids = np.cumsum(rng.integers(1, max_gap, count)).astype(np.uint32)
+    freqs = rng.integers(1, 300, count).astype(np.uint32)
+    return docids, freqs
+
+
+@pytest.mark.parametrize('values', [[], [0], [127], [128], [300, 0, 16383, 16384], list(range(40)),
+                                    [2 ** 32 - 1, 2 ** 40, 1, 2 ** 63 - 1] * 10])
+def test_varints_round_trip(values):
+    assert decode_varints(encode_varints(values)).tolist() == values
+
+
+def test_varints_small_and_numpy_paths_agree():
+    values = [0, 1, 127, 128, 255, 2 ** 21, 2 ** 31 + 5]
+    # the same values, encoded one by one and all at once
+    assert b''.join(encode_varints([value]) for value in values * 10) == encode_varints(values * 10)
+
+
+@pytest.mark.parametrize('count', LENGTHS)
+def test_postings_round_trip(count):
+    docids, freqs = make_postings(count)
+    decoded_docids, decoded_freqs = decode_postings(encode_postings(docids, freqs))
+    assert decoded_docids.dtype == np.uint32 and decoded_freqs.dtype == np.uint32
+    assert decoded_docids.tolist() == docids.tolist()
+    assert decoded_freqs.tolist() == freqs.tolist()
+
+
+def test_postings_large_gaps():
+    docids = np.array([0, 5, 2 ** 31, 2 ** 31 + 1, 2 ** 32 - 2], dtype=np.uint32)
+    freqs = np.array([1, 2 ** 20, 3, 4, 5], dtype=np.uint32)
+    decoded_docids, decoded_freqs = decode_postings(encode_postings(docids, freqs))
+    assert decoded_docids.tolist() == docids.tolist()
+    assert decoded_freqs.tolist() == freqs.tolist()
+
+    # a large gap across a block boundary
+    docids, freqs = make_postings(BLOCK_SIZE + 1)
+    docids[BLOCK_SIZE:] += np.uint32(2 ** 31)
+    assert decode_postings(encode_postings(docids, freqs))[0].tolist() == docids.tolist()
+
+
+@pytest.mark.parametrize('count', [BLOCK_SIZE + 1, 2 * BLOCK_SIZE, 1000])
+def test_decode_block(count):
+    docids, freqs = make_postings(count)
+    buffer = encode_postings(docids, freqs)
+    num_blocks = -(-count // BLOCK_SIZE)
+    for block in range(num_blocks):
+        block_docids, block_freqs = decode_block(buffer, block)
+        assert block_docids.tolist() == docids[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE].tolist()
+        assert block_freqs.tolist() == freqs[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE].tolist()
+
+
+@pytest.mark.parametrize('count', LENGTHS)
+def test_decode_blocks_and_postings_near(count):
+    docids, freqs = make_postings(count)
+    postings = PostingsList.from_columns(docids, freqs)
+    postings.freeze()
+    rng = np.random.default_rng(3)
+    for _ in range(10):
+        blocks = np.sort(rng.choice(postings.num_blocks, rng.integers(0, postings.num_blocks + 1), replace=False))
+        expected = np.isin(np.arange(count) // BLOCK_SIZE, blocks)
+        block_docids, block_freqs = decode_blocks(postings.to_bytes(), blocks)
+        assert block_docids.tolist() == docids[expected].tolist()
+        assert block_freqs.tolist() == freqs[expected].tolist()
+    # every posting of the asked docids is in the blocks decoded for them
+    targets = np.sort(rng.integers(0, int(docids[-1]) + 10 if count else 10, 3))
+    near_docids, near_freqs = postings.postings_near(targets)
+    assert np.all(near_docids[1:] > near_docids[:-1])
+    assert set(docids[np.isin(docids, targets)].tolist()) <= set(near_docids.tolist())
+    assert near_freqs.tolist() == freqs[np.isin(docids, near_docids)].tolist()
+
+
+@pytest.mark.parametrize('count', LENGTHS)
+def test_postings_list_lookups(count):
+    docids, freqs = make_postings(count)
+    postings = PostingsList.from_columns(docids, freqs)
+    postings.freeze()
+    assert len(postings) == count
+    assert postings.num_blocks == -(-count // BLOCK_SIZE)
+    assert postings == PostingsList.from_buffer(postings.to_bytes())
+    # every posting is found through the skip table, the docids in between and past the end are not
+    for i, (docid, freq) in enumerate(zip(docids.tolist(), freqs.tolist())):
+        assert postings.find(docid) == i
+        assert postings.get_freq(docid) == freq
+        assert postings.find(docid + 1) == (i + 1 if i + 1 < count and docids[i + 1] == docid + 1 else -1)
+    last = int(docids[-1]) if count else 0
+    assert postings.find(last + 1) == -1
+    assert postings.get_freq(last + 1) == 0
+
+
+def test_unfrozen_postings_list_sorted_on_freeze():
+    docids, freqs = make_postings(BLOCK_SIZE + 10)
+    postings = PostingsList()
+    for docid, freq in reversed(list(zip(docids.tolist(), freqs.tolist()))):
+        postings.append(docid, freq)
+    assert postings.sorted_docids().tolist() == docids.tolist()
+    postings.freeze()
+    assert postings.docids.tolist() == docids.tolist()
+    assert postings.freqs.tolist() == freqs.tolist()
+
+
+def test_positional_postings_round_trip():
+    rng = np.random.default_rng(1)
+    postings = PositionalPostingsList()
+    expected = {}
+    # appended out of docid order, with large positions and a document added twice
+    for docid in rng.permutation(300).tolist():
+        positions = sorted(set(rng.integers(0, 2 ** 20, rng.integers(1, 6)).tolist()))
+        expected[docid] = positions
+        postings.append(docid, positions)
+    postings.append(7, [2 ** 21])
+    expected[7] = sorted(expected[7] + [2 ** 21])
+
+    assert list(postings.docids) == sorted(expected)
+    for i, docid in enumerate(sorted(expected)):
+        assert postings.find(docid) == i
+        assert postings.get_freq(docid) == len(expected[docid])
+        assert postings.get_positions(i) == expected[docid]
+
+    indices = [0, 7, 8, 299]
+    freqs, positions = postings.get_positions_array(indices)
+    assert freqs.tolist() == [len(expected[i]) for i in indices]
+    assert positions.tolist() == [position for i in indices for position in expected[i]]
+
+
+def test_gallop():
+    docids = [2, 4, 4, 8, 16, 32, 64]
+    for start in range(len(docids) + 1):
+        for target in range(70):
+            expected = next((i for i in range(start, len(docids)) if docids[i] >= target), len(docids))
+            assert gallop(docids, target, start) == expected
+
+
+@pytest.mark.parametrize('count', [1, BLOCK_SIZE, 1000])
+def test_postings_cursor(count):
+    docids, freqs = make_postings(count)
+    postings = PostingsList.from_columns(docids, freqs)
+    postings.freeze()
+
+    cursor = PostingsCursor(postings)
+    seen = []
+    while not cursor.exhausted:
+        seen.append((cursor.docid, cursor.freq))
+        cursor.next()
+    assert seen == list(zip(docids.tolist(), freqs.tolist()))
+
+    cursor = PostingsCursor(postings)
+    for target in range(0, int(docids[-1]) + 10, 37):
+        position = int(np.searchsorted(docids, target))
+        assert cursor.advance(target) == (int(docids[position]) if position < count else None)
+
+
+def test_intersect():
+    rng = np.random.default_rng(2)
+    for count in [0, 5, BLOCK_SIZE + 1, 3000]:
+        columns = [np.unique(rng.integers(0, 5000, size)).astype(np.uint32) for size in (count, 2000, 4000)]
+        expected = np.intersect1d(np.intersect1d(columns[0], columns[1]), columns[2])
+        frozen = []
+        for column in columns:
+            postings = PostingsList.from_columns(column, np.ones(len(column)))
+            postings.freeze()
+            frozen.append(postings)
+        assert intersect(columns).tolist() == expected.tolist()
+        assert intersect(frozen).tolist() == expected.tolist()
+        assert intersect([frozen[0], columns[1], frozen[2]]).tolist() == expected.tolist()
+    assert intersect([]).tolist() == []
+
+
+def test_document_bitmap():
+    bitmap = DocumentBitmap()
+    for docid in [0, 7, 8, 1000, 7]:
+        bitmap.add(docid)
+    assert len(bitmap) == 4
+    assert list(bitmap) == [0, 7, 8, 1000]
+    assert bitmap.mask([0, 1, 7, 8, 999, 1000, 5000, -1]).tolist() == [True, False, True, True, False, True, False, False]
+    bitmap.discard(7)
+    bitmap.discard(-1)
+    assert 7 not in bitmap and -1 not in bitmap
+    with pytest.raises(ValueError):
+        bitmap.add(-1)
+    assert len(bitmap) == 3
+
+    other = DocumentBitmap.from_docids([3, 8, 2000])
+    assert list(other) == [3, 8, 2000] and len(other) == 3
+    bitmap |= other
+    assert list(bitmap) == [0, 3, 8, 1000, 2000] and len(bitmap) == 5
+    assert len(DocumentBitmap.from_docids([])) == 0
@@ -0,0 +1,163 @@
+'''
+Tests of the query syntax in query_parser.py and of the documents the Ranker matches for it, checked against a
+brute force search over the tokens of every document.
+'''
+import numpy as np
+import pytest
+
+from conftest import make_documents
+from indexing import PositionalInvertedIndex
+from query_parser import parse_query
+from ranker import BM25, Ranker
+
+INDEX_CLASS = PositionalInvertedIndex
+WORDS = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
+# a small vocabulary, so that most phrases and proximities match some documents and not others
+DOCUMENTS = make_documents(400, WORDS, (2, 25))
+
+
+def brute_force(node) -> set[int]:
+    # the documents that match a parsed query, from the tokens of every document
+    if node.operator == 'TERM':
+        return {docid for docid, tokens in DOCUMENTS.items() if node.text in tokens}
+    if node.operator == 'PHRASE':
+        phrase = node.text.split()
+        return {docid for docid, tokens in DOCUMENTS.items()
+                if any(tokens[start:start + len(phrase)] == phrase for start in range(len(tokens)))}
+    if node.operator == 'NEAR':
+        left, right = (child.text for child in node.children)
+        return {docid for docid, tokens in DOCUMENTS.items()
+                if any(abs(i - j) <= node.distance for i, token in enumerate(tokens) if token == left
+                       for j, other in enumerate(tokens) if other == right)}
+    if node.operator == 'OR':
+        return set().union(*(brute_force(child) for child in node.children))
+    operands = [brute_force(child) for child in node.children if child.operator != 'NOT']
+    matches = set.intersection(*operands) if operands else set()
+    for child in node.children:
+        if child.operator == 'NOT':
+            matches -= brute_force(child.children[0])
+    return matches
+
+
+@pytest.fixture(scope='module')
+def ranker(index, analyzer):
+    return Ranker(index, analyzer, False, BM25(index))
+
+
+def check_matches(ranker: Ranker, query: str, default_operator: str = 'OR') -> None:
+    parsed_query = parse_query(query, default_operator)
+    expected = brute_force(parsed_query.tree)
+    assert set(ranker.match_query(parsed_query.tree).tolist()) == expected, query
+
+    # only the matching documents are scored, with the scores of the bag of words query
+    ranker.default_operator = default_operator
+    try:
+        results = ranker.query(query)
+    finally:
+        ranker.default_operator = 'OR'
+    bag_of_words = {result['docid']: result['score'] for result in ranker.query(parsed_query.text)}
+    assert {result['docid'] for result in results} == expected & set(bag_of_words), query
+    for result in results:
+        assert result['score'] == pytest.approx(bag_of_words[result['docid']])
+
+
+@pytest.mark.parametrize('query, text, tree', [
+    ('"a b" c', 'a b c', "PHRASE('a b')"),
+    ('c "a b" "d e"', 'c a b d e', "AND(PHRASE('a b'), PHRASE('d e'))"),
+    ('pizza NEAR/3 york', 'pizza york', "NEAR/3('pizza', 'york')"),
+    ('a NEAR/3 b NEAR/2 c', 'a b c', "AND(NEAR/3('a', 'b'), NEAR/2('b', 'c'))"),
+    ('"" a', ' a', "TERM('a')"),
+    ('"unclosed a', '"unclosed a', None),
+])
+def test_parse_phrases_and_proximities(query, text, tree):
+    parsed_query = parse_query(query)
+    assert parsed_query.text == text
+    assert (repr(parsed_query.tree) if parsed_query.constrained else None) == tree
+
+
+def test_plain_query_has_no_tree():
+    parsed_query = parse_query('a b c')
+    assert not parsed_query.constrained
+    assert parsed_query.text == 'a b c'
+
+
+@pytest.mark.parametrize('query', ['"a b"', '"a b c"', '"b a a"', '"h g"', '"a a"', 'c "a b"', '"a b" AND "c d"',
+                                   'a NEAR/0 b', 'a NEAR/1 b', 'a NEAR/3 h', 'g NEAR/2 h', 'a NEAR/2 b NEAR/1 c',
+                                   '"a b" d NEAR/4 e'])
+def test_phrase_and_proximity_matches(ranker, query):
+    check_matches(ranker, query)
+
+
+def test_random_phrases_match_brute_force(ranker):
+    rng = np.random.default_rng(1)
+    for _ in range(100):
+        words = [WORDS[word] for word in rng.integers(0, len(WORDS), int(rng.integers(2, 4)))]
+        check_matches(ranker, '"' + ' '.join(words) + '"')
+        check_matches(ranker, f'{words[0]} NEAR/{int(rng.integers(0, 6))} {words[1]}')
+
+
+@pytest.mark.parametrize('query, default_operator, tree', [
+    ('a b', 'AND', "AND(TERM('a'), TERM('b'))"),
+    ('a AND b OR c', 'OR', "OR(AND(TERM('a'), TERM('b')), TERM('c'))"),
+    ('a OR b c', 'AND', "OR(TERM('a'), AND(TERM('b'), TERM('c')))"),
+    ('(a OR b) AND c', 'OR', "AND(OR(TERM('a'), TERM('b')), TERM('c'))"),
+    ('a NOT b', 'OR', "AND(TERM('a'), NOT(TERM('b')))"),
+    ('NOT b', 'OR', "AND(NOT(TERM('b')))"),
+    ('x NOT "a b"', 'AND', "AND(TERM('x'), NOT(PHRASE('a b')))"),
+    ('"a b" AND c', 'OR', "AND(PHRASE('a b'), TERM('c'))"),
+    ('c AND "a b" d', 'OR', "AND(TERM('c'), PHRASE('a b'))"),
+    # misplaced operators and parentheses are skipped
+    ('a) b', 'OR', "OR(TERM('a'), TERM('b'))"),
+    ('AND a OR', 'OR', "TERM('a')"),
+    ('((a', 'OR', "TERM('a')"),
+])
+def test_parse_boolean_operators(query, default_operator, tree):
+    assert repr(parse_query(query, default_operator).tree) == tree
+
+
+def test_negated_words_are_not_scored():
+    assert parse_query('a NOT b NOT "c d"').text == 'a'
+
+
+def test_unknown_default_operator():
+    with pytest.raises(ValueError):
+        parse_query('a b', 'NEAR')
+
+
+@pytest.mark.parametrize('query', ['a AND b', 'a OR h', 'a NOT b', 'NOT a', 'h AND NOT (a OR b)', '(a OR g) AND (b OR h)',
+                                   '"a b" AND c', 'c AND "a b" d', 'a NEAR/2 b NOT c', 'g AND h AND f AND e'])
+@pytest.mark.parametrize('default_operator', ['OR', 'AND'])
+def test_boolean_matches(ranker, query, default_operator):
+    check_matches(ranker, query, default_operator)
+
+
+def test_random_boolean_queries_match_brute_force(ranker):
+    rng = np.random.default_rng(2)
+
+    def random_query(depth: int = 0) -> str:
+        if depth > 2 or rng.random() < 0.4:
+            return WORDS[int(rng.integers(0, len(WORDS)))]
+        operator = [' AND ', ' OR ', ' ', ' NOT '][int(rng.integers(0, 4))]
+        return f'({random_query(depth + 1)}{operator}{random_query(depth + 1)})'
+
+    for _ in range(100):
+        query = random_query()
+        for default_operator in ['OR', 'AND']:
+            if parse_query(query, default_operator).constrained:
+                check_matches(ranker, query, default_operator)
+
+
+@pytest.mark.parametrize('default_operator', ['OR', 'AND'])
+def test_batch_query_matches_query(ranker, default_operator):
+    # the query syntax restricts every row of a batch like it restricts query()
+    queries = ['a b', '"a b" c', 'a NEAR/2 b', 'a AND b', 'a NOT b', 'h AND NOT (a OR b)', 'c AND "a b" d', 'NOT a', 'e f g']
+    ranker.default_operator = default_operator
+    try:
+        for k in [None, 5]:
+            for query, results in zip(queries, ranker.batch_query(queries, k)):
+                expected = ranker.query(query, k)
+                assert {result['docid'] for result in results} == {result['docid'] for result in expected}, query
+                scores = {result['docid']: result['score'] for result in expected}
+                assert all(result['score'] == pytest.approx(scores[result['docid']]) for result in results)
+    finally:
+        ranker.default_operator = 'OR'
@@ -0,0 +1,155 @@
+'''
+Tests of the query paths of the Ranker: MaxScore top k queries and scorers without score_postings, scored term at
+a time with an accumulator, must return what scoring every matching document returns.
+'''
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from conftest import make_documents, make_index
+from postings import find_frequency
+from ranker import BM25, DirichletLM, PivotedNormalization, Ranker, RelevanceScorer, TF_IDF, WordCountCosineSimilarity
+
+PRUNABLE_SCORERS = [BM25, DirichletLM, PivotedNormalization, TF_IDF, WordCountCosineSimilarity]
+# every tenth document is a copy of another one, so that some documents have the same score for every query
+DOCUMENTS = make_documents(copy_every=10)
+
+
+def make_queries(vocabulary_size: int = 40, seed: int = 1) -> list[str]:
+    rng = np.random.default_rng(seed)
+    queries = ['w0', 'w0 w1', 'w39 w0', 'w0 w0 w5', 'w7 unknown', 'unknown']
+    for _ in range(40):
+        queries.append(' '.join(f'w{word}' for word in rng.integers(0, vocabulary_size, int(rng.integers(2, 6)))))
+    return queries
+
+
+@pytest.mark.parametrize('scorer_class', PRUNABLE_SCORERS)
+@pytest.mark.parametrize('k', [1, 3, 10, 100, 10000])
+def test_max_score_matches_exhaustive_scoring(index, analyzer, scorer_class, k):
+    pruned = Ranker(index, analyzer, False, scorer_class(index))
+    exhaustive = Ranker(index, analyzer, False, scorer_class(index))
+    exhaustive.dynamic_pruning = False
+    assert pruned.scorer.prunable
+    for query in make_queries():
+        results, total_hits = pruned.query_top_k(query, k)
+        expected, expected_hits = exhaustive.query_top_k(query, k)
+        # equal scores are ordered by docid in both, so the same documents are cut off at the k-th one
+        assert [result['docid'] for result in results] == [result['docid'] for result in expected], query
+        assert np.allclose([result['score'] for result in results], [result['score'] for result in expected])
+        assert total_hits == expected_hits
+        assert len(results) == min(k, expected_hits)
+
+
+def test_max_score_after_removing_documents(tmp_path, analyzer):
+    # the postings without the removed documents are no longer frozen, they are decoded in full
+    index = make_index(str(tmp_path), DOCUMENTS)
+    index.compaction_threshold = 1.0
+    index.remove_docs(range(1, 600, 7))
+    pruned, exhaustive = Ranker(index, analyzer, False, BM25(index)), Ranker(index, analyzer, False, BM25(index))
+    exhaustive.dynamic_pruning = False
+    for query in make_queries()[:15]:
+        results, total_hits = pruned.query_top_k(query, 10)
+        expected, expected_hits = exhaustive.query_top_k(query, 10)
+        assert [result['docid'] for result in results] == [result['docid'] for result in expected], query
+        assert total_hits == expected_hits
+
+
+def test_max_score_keeps_tied_documents(index, analyzer):
+    # the copies of a document tie with it, the first ones by docid make the top k
+    ranker = Ranker(index, analyzer, False, BM25(index))
+    full = ranker.query('w3 w12 w25')
+    scores = [result['score'] for result in full]
+    assert len(set(scores)) < len(scores)
+    for k in range(1, 30):
+        assert [result['docid'] for result in ranker.query('w3 w12 w25', k)] == [result['docid'] for result in full[:k]]
+
+
+@pytest.mark.parametrize('scorer_class', PRUNABLE_SCORERS)
+@pytest.mark.parametrize('k', [None, 10])
+def test_batch_query_matches_query(index, analyzer, scorer_class, k):
+    # one sparse matrix product for all the queries gives what query() gives one query at a time
+    ranker = Ranker(index, analyzer, False, scorer_class(index))
+    queries = make_queries()
+    for query, results in zip(queries, ranker.batch_query(queries, k)):
+        expected = ranker.query(query, k)
+        assert len(results) == len(expected), query
+        scores = {result['docid']: result['score'] for result in expected}
+        if k is None:
+            assert set(scores) == {result['docid'] for result in results}, query
+        # the k-th score may be tied, the k best scores are the same
+        assert np.allclose([result['score'] for result in results], [result['score'] for result in expected])
+        assert all(result['score'] == pytest.approx(scores.get(result['docid'], result['score'])) for result in results)
+    assert ranker.batch_query([]) == []
+
+
+class QueryTermFrequency(RelevanceScorer):
+    # a scorer without score_postings, like a third-party one: the frequency of the query terms in a document
+    term_at_a_time = True
+
+    def __init__(self, index, parameters: dict = {}) -> None:
+        super().__init__(index, parameters)
+
+    def score(self, docid: int, query_parts: list[str]) -> dict[str, int]:
+        score = sum(count * find_frequency(self.index.get_postings(term), docid) for term, count in Counter(query_parts).items() if term is not None)
+        return {'docid': docid, 'score': score}
+
+    def score_term(self, term: str, query_term_count: int, postings) -> list[tuple[int, float]]:
+        return [(docid, query_term_count * freq) for docid, freq in postings]
+
+
+class AccumulatorRanker(Ranker):
+    # counts the queries scored term at a time
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.term_at_a_time_queries = 0
+
+    def score_term_at_a_time(self, query_parts: list[str], term_postings: dict) -> dict[int, float]:
+        self.term_at_a_time_queries += 1
+        return super().score_term_at_a_time(query_parts, term_postings)
+
+
+def without_vectorization(scorer_class, term_at_a_time: bool = True):
+    # the scorer with only its score_term, or only its score, as a scorer without score_postings would be
+    return type(scorer_class.__name__, (scorer_class,), {'vectorized': False, 'prunable': False, 'term_at_a_time': term_at_a_time})
+
+
+@pytest.mark.parametrize('scorer_class', PRUNABLE_SCORERS + [QueryTermFrequency])
+@pytest.mark.parametrize('k', [None, 5])
+def test_term_at_a_time_matches_document_at_a_time(index, analyzer, scorer_class, k):
+    term_at_a_time = AccumulatorRanker(index, analyzer, False, without_vectorization(scorer_class)(index))
+    document_at_a_time = AccumulatorRanker(index, analyzer, False, without_vectorization(scorer_class, False)(index))
+    for query in make_queries()[:15]:
+        results = term_at_a_time.query(query, k)
+        expected = document_at_a_time.query(query, k)
+        assert [result['docid'] for result in results] == [result['docid'] for result in expected], query
+        assert np.allclose([result['score'] for result in results], [result['score'] for result in expected])
+        if scorer_class.vectorized:
+            vectorized = Ranker(index, analyzer, False, scorer_class(index)).query(query)
+            scores = {result['docid']: result['score'] for result in vectorized}
+            assert all(result['score'] == pytest.approx(scores[result['docid']]) for result in results)
+    assert term_at_a_time.term_at_a_time_queries == 15
+    assert document_at_a_time.term_at_a_time_queries == 0
+
+
+
+@pytest.mark.parametrize('scorer_class', [BM25, DirichletLM, TF_IDF])
+def test_default_score_term(index, scorer_class):
+    # score_term from score_postings, for a scorer that only implements the latter
+    derived = type(scorer_class.__name__, (scorer_class,), {'score_term': RelevanceScorer.score_term})(index)
+    scorer = scorer_class(index)
+    for term in ['w0', 'w7', 'w39', 'unknown']:
+        postings = index.get_postings(term)
+        results, expected = derived.score_term(term, 2, postings), scorer.score_term(term, 2, postings)
+        assert [docid for docid, _ in results] == [docid for docid, _ in expected]
+        assert np.allclose([score for _, score in results], [score for _, score in expected])
+
+
+def test_default_score_postings(index, analyzer):
+    # score_postings from score_term, for a scorer that only implements the latter
+    vectorized = Ranker(index, analyzer, False, type('QueryTermFrequency', (QueryTermFrequency,), {'vectorized': True})(index))
+    ranker = Ranker(index, analyzer, False, QueryTermFrequency(index))
+    for query in make_queries()[:15]:
+        # equal scores are ordered by docid when vectorized, in candidate order otherwise
+        results = {result['docid']: result['score'] for result in vectorized.query(query)}
+        assert results == pytest.approx({result['docid']: result['score'] for result in ranker.query(query)}), query
@@ -0,0 +1,116 @@
+'''
+Round-trip tests of the mapped index files in storage.py.
+'''
+import mmap
+
+import numpy as np
+import pytest
+
+from conftest import make_documents, make_index
+from indexing import BasicInvertedIndex, PositionalInvertedIndex
+from postings import decode_postings, encode_postings
+from storage import DocumentTable, IndexFileWriter, Lexicon, PostingsCache
+
+
+def write_lexicon(index_name: str, terms: dict[str, tuple[list[int], list[int]]]) -> None:
+    with IndexFileWriter(index_name) as writer:
+        for term in sorted(terms, key=lambda term: term.encode('utf-8')):
+            docids, freqs = terms[term]
+            writer.add_term(term, encode_postings(docids, freqs), len(docids), sum(freqs))
+
+
+def test_lexicon_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    terms = {}
+    # an empty postings list, lists around a block boundary and terms that are not ASCII
+    for term, count in [('a', 1), ('apple', 128), ('apples', 129), ('zebra', 1000), ('café', 3), ('日本', 2), ('empty', 0)]:
+        docids = np.cumsum(rng.integers(1, 100, count)).tolist()
+        terms[term] = docids, rng.integers(1, 10, count).tolist()
+    write_lexicon(str(tmp_path), terms)
+
+    lexicon = Lexicon(str(tmp_path))
+    assert len(lexicon) == len(terms)
+    assert list(lexicon) == sorted(terms, key=lambda term: term.encode('utf-8'))
+    for term, (docids, freqs) in terms.items():
+        assert term in lexicon
+        assert lexicon.get_document_frequency(term) == len(docids)
+        assert lexicon.get_term_statistics(lexicon.find(term)) == (len(docids), sum(freqs))
+        decoded_docids, decoded_freqs = decode_postings(lexicon.get_postings_buffer(lexicon.find(term)))
+        assert decoded_docids.tolist() == docids
+        assert decoded_freqs.tolist() == freqs
+    for term in ['', 'b', 'applesauce', 'zzz', 'caf']:
+        assert term not in lexicon
+        assert lexicon.find(term) == -1
+        assert lexicon.get_document_frequency(term) == 0
+    assert [term for term, _ in lexicon.items()] == list(lexicon)
+
+
+def test_empty_lexicon(tmp_path):
+    write_lexicon(str(tmp_path), {})
+    lexicon = Lexicon(str(tmp_path))
+    assert len(lexicon) == 0
+    assert 'a' not in lexicon
+
+
+def test_document_table_round_trip(tmp_path):
+    table = DocumentTable()
+    # docids out of order, so that some of them are outside the sorted prefix
+    for docid in [5, 9, 2, 100, 7, 2 ** 32 - 1]:
+        table[docid] = {'length': docid % 13, 'unique_tokens': docid % 7}
+    table[9] = {'length': 30, 'unique_tokens': 20}
+    del table[100]
+    expected = {docid: table[docid] for docid in table}
+    table.save(str(tmp_path))
+
+    loaded = DocumentTable.load(str(tmp_path))
+    assert len(loaded) == len(expected)
+    assert sorted(loaded) == sorted(expected)
+    for docid, meta in expected.items():
+        assert loaded[docid] == meta
+        assert loaded.get_length(docid) == meta['length']
+    assert 100 not in loaded
+    assert loaded.get_lengths([2, 100, 9, 3]).tolist() == [2, 0, 30, 0]
+    assert loaded.total_length() == sum(meta['length'] for meta in expected.values())
+
+    # the columns of a loaded table are views of the mapped file, changing it copies them first
+    loaded[1] = {'length': 4, 'unique_tokens': 4}
+    del loaded[5]
+    assert loaded[1] == {'length': 4, 'unique_tokens': 4}
+    assert 5 not in loaded
+    loaded.compact()
+    assert sorted(loaded) == sorted((set(expected) - {5}) | {1})
+    assert loaded.ordinals([1, 5, 9]).tolist()[1] == -1
+
+
+
+def test_postings_cache():
+    cache = PostingsCache(100)
+    cache.put('a', [1], 60)
+    cache.put('b', [2], 30)
+    assert cache.get('a') == [1]
+    # the least recently used entry is evicted first
+    cache.put('c', [3], 30)
+    assert cache.get('b') is None
+    assert cache.get('a') == [1] and cache.get('c') == [3]
+    assert cache.size_bytes <= 100
+    cache.discard('a')
+    assert cache.get('a') is None
+    assert cache.hits == 3 and cache.misses == 2
+
+
+@pytest.mark.parametrize('index_class', [BasicInvertedIndex, PositionalInvertedIndex])
+def test_saved_index_reads_the_mapped_files(tmp_path, index_class):
+    # a loaded index answers like the one that was saved, its postings are read from the mapped postings file
+    documents = make_documents(300)
+    index = make_index(str(tmp_path / 'index'), documents, index_class)
+    index.save()
+    loaded = index_class(index.index_name)
+    loaded.load()
+    assert isinstance(loaded.lexicon.get_postings_buffer(loaded.lexicon.find('w0')).obj, mmap.mmap)
+    assert loaded.get_statistics() == index.get_statistics()
+    assert set(loaded.vocabulary) == set(index.vocabulary)
+    for term in list(index.vocabulary) + ['unknown']:
+        assert list(loaded.get_postings(term)) == list(index.get_postings(term)), term
+        assert loaded.get_term_metadata(term) == index.get_term_metadata(term)
+    for docid in documents:
+        assert loaded.get_doc_metadata(docid) == index.get_doc_metadata(docid)